@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+#
+#  __init__.py
+#  pangaea
+#
+#  Author : Alan D Snow, 2017.
+#  License: BSD 3-Clause
+"""pangaea benchmarks
+    Benchmarks for the lsm accessor run with airspeed velocity (asv).
+"""
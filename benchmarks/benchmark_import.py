@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+#
+#  benchmark_import.py
+#  pangaea
+#
+#  Author : Alan D Snow, 2017.
+#  License: BSD 3-Clause
+"""Benchmarks for the time to import pangaea in a new process.
+
+GDAL, gazar, wrf-python, and pyproj are loaded when first used,
+so they are not part of the import time.
+"""
+
+
+def timeraw_import_pangaea():
+    """Time to import pangaea and register the lsm accessor."""
+    return "import pangaea"
+
+
+def timeraw_import_open_mfdataset():
+    """Time to import the reader used with ERA/NWM data."""
+    return "from pangaea import open_mfdataset"
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+#
+#  benchmark_xlsm.py
+#  pangaea
+#
+#  Author : Alan D Snow, 2017.
+#  License: BSD 3-Clause
+"""Benchmarks for the lsm accessor with synthetic
+WRF, GRIB Lambert, NWM, and ERA grids.
+
+Run with airspeed velocity::
+
+    asv run
+"""
+import os
+import shutil
+import tempfile
+import time
+
+from osgeo import gdal, osr
+
+import pangaea as pa
+from pangaea.warp import grid_from_definition
+
+from .synthetic import GRID_SIZES, MODEL_WRITERS
+
+# accessor settings set by pangaea.open_mfdataset
+LSM_SETTINGS = ('y_var', 'x_var', 'y_dim', 'x_dim',
+                'lon_to_180', 'coords_projected')
+
+
+def _write_match_grid(grid_def, out_path):
+    """Write an empty grid with half of the resolution to resample to."""
+    geotransform = list(grid_def['geotransform'])
+    geotransform[1] *= 2
+    geotransform[5] *= 2
+    match_def = dict(grid_def,
+                     geotransform=geotransform,
+                     shape=[max(dim // 2, 1) for dim in grid_def['shape']])
+    gdal.GetDriverByName('GTiff') \
+        .CreateCopy(out_path, grid_from_definition(match_def).dataset)
+
+
+class LSMGridReaderSuite(object):
+    """Time the lsm accessor for each model and grid size."""
+    params = (sorted(MODEL_WRITERS), sorted(GRID_SIZES))
+    param_names = ('model', 'grid_size')
+    timeout = 600
+
+    def setup_cache(self):
+        """Write the synthetic files once for all of the benchmarks."""
+        data_info = {}
+        for model, write_model in MODEL_WRITERS.items():
+            for grid_size, sizes in GRID_SIZES.items():
+                out_dir = os.path.abspath(os.path.join(model, grid_size))
+                os.makedirs(out_dir)
+                open_kwargs, variable = write_model(out_dir, *sizes)
+                match_grid = os.path.join(out_dir, 'match_grid.tif')
+                with pa.open_mfdataset(**open_kwargs) as xds:
+                    _write_match_grid(xds.lsm.grid_definition, match_grid)
+                data_info[(model, grid_size)] = \
+                    (open_kwargs, variable, match_grid)
+        return data_info
+
+    def setup(self, data_info, model, grid_size):
+        self.open_kwargs, self.variable, self.match_grid = \
+            data_info[(model, grid_size)]
+        self.xds = pa.open_mfdataset(**self.open_kwargs)
+        self.out_dir = tempfile.mkdtemp()
+        self.num_cells = self.xds[self.variable].size
+
+    def teardown(self, data_info, model, grid_size):
+        self.xds.close()
+        shutil.rmtree(self.out_dir)
+
+    def _lsm(self):
+        """Get an accessor without cached values."""
+        xds = self.xds.copy()
+        for setting in LSM_SETTINGS:
+            setattr(xds.lsm, setting, getattr(self.xds.lsm, setting))
+        return xds.lsm
+
+    def time_open_mfdataset(self, data_info, model, grid_size):
+        pa.open_mfdataset(**self.open_kwargs).close()
+
+    def time_projection(self, data_info, model, grid_size):
+        self._lsm().projection.ExportToWkt()
+
+    def time_geotransform(self, data_info, model, grid_size):
+        self._lsm().geotransform
+
+    def time_latlon(self, data_info, model, grid_size):
+        self._lsm().latlon
+
+    def peakmem_latlon(self, data_info, model, grid_size):
+        self._lsm().latlon
+
+    def time_getvar(self, data_info, model, grid_size):
+        self._lsm().getvar(self.variable).values
+
+    def peakmem_getvar(self, data_info, model, grid_size):
+        self._lsm().getvar(self.variable).values
+
+    def track_getvar_throughput(self, data_info, model, grid_size):
+        start_time = time.time()
+        self._lsm().getvar(self.variable).values
+        return self.num_cells / max(time.time() - start_time, 1e-9)
+    track_getvar_throughput.unit = 'cells/s'
+
+    def time_resample(self, data_info, model, grid_size):
+        self._lsm().resample(self.variable, self.match_grid)
+
+    def peakmem_resample(self, data_info, model, grid_size):
+        self._lsm().resample(self.variable, self.match_grid)
+
+    def time_to_projection(self, data_info, model, grid_size):
+        projection = osr.SpatialReference()
+        projection.ImportFromEPSG(4326)
+        self._lsm().to_projection(self.variable, projection)
+
+    def peakmem_to_projection(self, data_info, model, grid_size):
+        projection = osr.SpatialReference()
+        projection.ImportFromEPSG(4326)
+        self._lsm().to_projection(self.variable, projection)
+
+    def time_to_tif(self, data_info, model, grid_size):
+        self._lsm().to_tif(self.variable, 0,
+                           os.path.join(self.out_dir, 'out.tif'))
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+#
+#  synthetic.py
+#  pangaea
+#
+#  Author : Alan D Snow, 2017.
+#  License: BSD 3-Clause
+"""Write synthetic land surface model files for the benchmarks."""
+import os
+
+import numpy as np
+import pandas as pd
+from pyproj import Proj
+import xarray as xr
+
+# (number of time steps, y size, x size)
+GRID_SIZES = {
+    'small': (6, 120, 160),
+    'hrrr': (24, 1059, 1799),
+}
+
+START_TIME = pd.Timestamp('2017-01-01')
+
+
+def _lambert_grid(proj4_str, y_size, x_size, cell_size):
+    """Get the projected coordinates (South to North)
+    and latitude/longitude of a Lambert Conformal grid."""
+    x_coords = (np.arange(x_size) - (x_size - 1) / 2.0) * cell_size
+    y_coords = (np.arange(y_size) - (y_size - 1) / 2.0) * cell_size
+    x_2d, y_2d = np.meshgrid(x_coords, y_coords)
+    lon, lat = Proj(proj4_str)(x_2d, y_2d, inverse=True)
+    return y_coords, x_coords, lat, lon
+
+
+def _times(n_times):
+    """Get hourly time values."""
+    return START_TIME + pd.to_timedelta(np.arange(n_times), unit='h')
+
+
+def _data(n_times, y_size, x_size):
+    """Get random data with dimensions (time, y, x)."""
+    return np.random.RandomState(0) \
+        .rand(n_times, y_size, x_size).astype(np.float32)
+
+
+def write_wrf(out_dir, n_times, y_size, x_size):
+    """WRF output with one time step per file."""
+    cell_size = 3000.0
+    proj4_str = ('+proj=lcc +lat_1=30 +lat_2=60 +lat_0=38.5 '
+                 '+lon_0=-97.5 +a=6370000 +b=6370000 +units=m')
+    _, _, lat, lon = _lambert_grid(proj4_str, y_size, x_size, cell_size)
+    attrs = {
+        'MAP_PROJ': 1,
+        'TRUELAT1': 30.0,
+        'TRUELAT2': 60.0,
+        'MOAD_CEN_LAT': 38.5,
+        'STAND_LON': -97.5,
+        'POLE_LAT': 90.0,
+        'POLE_LON': 0.0,
+        'CEN_LAT': 38.5,
+        'CEN_LON': -97.5,
+        'DX': cell_size,
+        'DY': cell_size,
+    }
+    dims = ('Time', 'south_north', 'west_east')
+    data = _data(n_times, y_size, x_size)
+    for time_index in range(n_times):
+        time_value = START_TIME + pd.Timedelta(hours=time_index)
+        xr.Dataset(
+            {
+                'RAINC': (dims, data[time_index:time_index + 1]),
+                'XLAT': (dims, lat[None].astype(np.float32)),
+                'XLONG': (dims, lon[None].astype(np.float32)),
+                'Times': (('Time',),
+                          np.array([time_value
+                                    .strftime('%Y-%m-%d_%H:%M:%S')],
+                                   dtype='S19')),
+            },
+            attrs=attrs,
+        ).to_netcdf(os.path.join(
+            out_dir,
+            time_value.strftime('wrfout_d01_%Y-%m-%d_%H:%M:%S.nc')))
+    return {
+        'path_to_lsm_files': os.path.join(out_dir, '*.nc'),
+        'lat_var': 'XLAT',
+        'lon_var': 'XLONG',
+        'time_var': 'Times',
+        'lat_dim': 'south_north',
+        'lon_dim': 'west_east',
+        'time_dim': 'Time',
+    }, 'RAINC'
+
+
+def write_grib_lambert(out_dir, n_times, y_size, x_size):
+    """HRRR style Lambert Conformal GRIB grid with the
+    projection in the latitude attributes."""
+    cell_size = 3000.0
+    proj4_str = ('+proj=lcc +lat_1=38.5 +lat_2=38.5 +lat_0=38.5 '
+                 '+lon_0=262.5 +ellps=WGS84 +datum=WGS84 +units=m')
+    _, _, lat, lon = _lambert_grid(proj4_str, y_size, x_size, cell_size)
+    lat_attrs = {
+        'grid_type': 'Lambert Conformal (secant, tangent, '
+                     'conical or bipolar)',
+        'Latin1': [38.5],
+        'Latin2': [38.5],
+        'Lov': [262.5],
+        'La1': [float(lat[0, 0])],
+        'Lo1': [float(lon[0, 0]) % 360],
+        'Dx': [cell_size / 1000.0],
+        'Dy': [cell_size / 1000.0],
+    }
+    dims = ('time', 'ygrid_0', 'xgrid_0')
+    xr.Dataset(
+        {
+            'TMP_P0_L103_GLC0': (dims, _data(n_times, y_size, x_size)),
+        },
+        coords={
+            'gridlat_0': (dims[1:], lat, lat_attrs),
+            'gridlon_0': (dims[1:], lon % 360),
+            'time': _times(n_times),
+        },
+    ).to_netcdf(os.path.join(out_dir, 'hrrr.nc'))
+    return {
+        'path_to_lsm_files': os.path.join(out_dir, '*.nc'),
+        'lat_var': 'gridlat_0',
+        'lon_var': 'gridlon_0',
+        'time_var': 'time',
+        'lat_dim': 'ygrid_0',
+        'lon_dim': 'xgrid_0',
+        'time_dim': 'time',
+    }, 'TMP_P0_L103_GLC0'
+
+
+def write_nwm(out_dir, n_times, y_size, x_size):
+    """National Water Model grid with projected 1D coordinates."""
+    cell_size = 1000.0
+    proj4_str = ('+proj=lcc +lat_1=30 +lat_2=60 +lat_0=40 +lon_0=-97 '
+                 '+x_0=0 +y_0=0 +a=6370000 +b=6370000 +units=m +no_defs')
+    y_coords, x_coords, _, _ = \
+        _lambert_grid(proj4_str, y_size, x_size, cell_size)
+    xr.Dataset(
+        {
+            'T2D': (('time', 'y', 'x'), _data(n_times, y_size, x_size)),
+            'ProjectionCoordinateSystem': ((), b'',
+                                           {'proj4': proj4_str}),
+        },
+        coords={
+            'y': y_coords,
+            'x': x_coords,
+            'time': _times(n_times),
+        },
+    ).to_netcdf(os.path.join(out_dir, 'nwm.nc'))
+    return {
+        'path_to_lsm_files': os.path.join(out_dir, '*.nc'),
+        'lat_var': 'y',
+        'lon_var': 'x',
+        'time_var': 'time',
+        'lat_dim': 'y',
+        'lon_dim': 'x',
+        'time_dim': 'time',
+        'coords_projected': True,
+    }, 'T2D'
+
+
+def write_era(out_dir, n_times, y_size, x_size):
+    """ERA style regular latitude/longitude grid from 0 to 360."""
+    cell_size = 0.25
+    xr.Dataset(
+        {
+            'tp': (('time', 'latitude', 'longitude'),
+                   _data(n_times, y_size, x_size)),
+        },
+        coords={
+            'latitude': 50.0 - np.arange(y_size) * cell_size,
+            'longitude': 240.0 + np.arange(x_size) * cell_size,
+            'time': _times(n_times),
+        },
+    ).to_netcdf(os.path.join(out_dir, 'era.nc'))
+    return {
+        'path_to_lsm_files': os.path.join(out_dir, '*.nc'),
+        'lat_var': 'latitude',
+        'lon_var': 'longitude',
+        'time_var': 'time',
+        'lat_dim': 'latitude',
+        'lon_dim': 'longitude',
+        'time_dim': 'time',
+        'lon_to_180': True,
+    }, 'tp'
+
+
+MODEL_WRITERS = {
+    'wrf': write_wrf,
+    'grib_lambert': write_grib_lambert,
+    'nwm': write_nwm,
+    'era': write_era,
+}
@@ -9,8 +9,9 @@
     Module for reading in land surface model data with xarray.
 """
 from .xlsm import LSMGridReader
-from .read import open_mfdataset
-from .log import log_to_console, log_to_file
+from .read import append_zarr, open_mfdataset, open_zarr
+from .log import (get_metrics, log_metrics, log_to_console, log_to_file,
+                  reset_metrics)
 from .meta import version
 
 __version__ = version()
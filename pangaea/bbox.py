@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#
+#  bbox.py
+#  pangaea
+#
+#  Author : Alan D Snow, 2017.
+#  License: BSD 3-Clause
+"""pangaea.bbox
+
+    This module provides the subsets of the grid within bounding boxes
+    for the land surface model accessor (see :class:`pangaea.LSMGridReader`).
+"""
+import numpy as np
+
+
+def _bbox_vertices(bounds):
+    """Get the polygon vertices of the bounds
+    (min_x, min_y, max_x, max_y)."""
+    min_x, min_y, max_x, max_y = bounds
+    return np.array([[min_x, min_y],
+                     [min_x, max_y],
+                     [max_x, max_y],
+                     [max_x, min_y]], dtype=np.float64)
+
+
+class BBoxMixin(object):
+    """
+    Bounding box subsets of the :class:`pangaea.LSMGridReader` accessor.
+    """
+    def bbox_slices(self, bbox, bbox_projection=None):
+        """Get the slices of the grid cells that intersect a bounding box.
+        The indices are computed from the
+        :func:`~pangaea.LSMGridReader.affine`,
+        so no data or coordinates are loaded.
+
+            .. note:: The slices are for the grid with [0,0]
+                as Northeast and [-1,-1] as Southwest
+                (same as :func:`~pangaea.LSMGridReader.getvar`).
+
+            Parameters
+            ----------
+            bbox: :obj:`tuple` or polygon
+                Bounding box (min_x, min_y, max_x, max_y),
+                list of (x, y) polygon vertices, or a shapely geometry.
+            bbox_projection: :func:`osr.SpatialReference`, optional
+                Projection of the bounding box coordinates.
+                Default is longitude/latitude (EPSG:4326).
+
+            Returns
+            -------
+            :obj:`slice`, :obj:`slice`
+                The slices in the y and x directions.
+        """
+        if hasattr(bbox, 'exterior'):
+            vertices = np.array(bbox.exterior.coords, dtype=np.float64)
+        elif hasattr(bbox, 'bounds'):
+            vertices = _bbox_vertices(bbox.bounds)
+        elif np.ndim(bbox) == 1:
+            vertices = _bbox_vertices(bbox)
+        else:
+            vertices = np.array(bbox, dtype=np.float64)
+
+        # densify the edges to capture the curvature after projecting
+        vertices = np.concatenate([
+            np.linspace(start, end, 21, endpoint=False)
+            for start, end in zip(vertices, np.roll(vertices, -1, axis=0))
+        ])
+        x_coords, y_coords = vertices[:, 0], vertices[:, 1]
+        if bbox_projection is None:
+            if str(self.epsg) != '4326':
+                x_coords, y_coords = self._transform_from_latlon(x_coords,
+                                                                 y_coords)
+        else:
+            # pylint: disable=import-outside-toplevel
+            from .transform import transform_points
+            x_coords, y_coords = transform_points(
+                bbox_projection, self.projection, x_coords, y_coords)
+
+        # pylint: disable=import-outside-toplevel
+        from .regrid import _apply_affine
+        cols, rows = _apply_affine(~self.affine,
+                                   np.asarray(x_coords),
+                                   np.asarray(y_coords))
+        col_start = int(np.clip(np.floor(np.min(cols)), 0, self.x_size))
+        col_end = int(np.clip(np.ceil(np.max(cols)), 0, self.x_size))
+        row_start = int(np.clip(np.floor(np.min(rows)), 0, self.y_size))
+        row_end = int(np.clip(np.ceil(np.max(rows)), 0, self.y_size))
+        if col_start >= col_end or row_start >= row_end:
+            raise ValueError("The bounding box does not intersect "
+                             "the grid ...")
+        return slice(row_start, row_end), slice(col_start, col_end)
+
+    def getvar_bbox(self, variable, bbox, bbox_projection=None,
+                    calc_4d_method=None, calc_4d_dim=None):
+        """Get variable from model within a bounding box. Only the
+        window of the grid intersecting the bounding box is read.
+
+            .. warning:: The grids will always be returned with [0,0]
+                as Northeast and [-1,-1] as Southwest.
+
+            Parameters
+            ----------
+            variable: :obj:`str`
+                Name of variable in dataset.
+            bbox: :obj:`tuple` or polygon
+                Bounding box (min_x, min_y, max_x, max_y),
+                list of (x, y) polygon vertices, or a shapely geometry.
+            bbox_projection: :func:`osr.SpatialReference`, optional
+                Projection of the bounding box coordinates.
+                Default is longitude/latitude (EPSG:4326).
+            calc_4d_method: :obj:`str`
+                Method to convert 4D variables to 3D variables
+                (Ex. 'mean', 'min', or 'max').
+            calc_4d_dim: :obj:`str`
+                Dimension to reduce grid from 4D to 3D (Ex. 'top_bottom').
+
+            Returns
+            -------
+            :func:`xarray.DataArray`
+        """
+        yslice, xslice = self.bbox_slices(bbox, bbox_projection)
+        return self.getvar(variable,
+                           yslice=yslice,
+                           xslice=xslice,
+                           calc_4d_method=calc_4d_method,
+                           calc_4d_dim=calc_4d_dim)
@@ -0,0 +1,286 @@
+# -*- coding: utf-8 -*-
+#
+#  catalog.py
+#  pangaea
+#
+#  Author : Alan D Snow, 2017.
+#  License: BSD 3-Clause
+"""pangaea.catalog
+
+    This module provides a sidecar catalog of the files in a
+    land surface model collection to quickly reopen the collection.
+"""
+import json
+from multiprocessing.pool import ThreadPool
+import os
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .log import count
+
+CATALOG_VERSION = 2
+
+
+def file_signature(path):
+    """Get the modification time and size of a file.
+
+    Parameters
+    ----------
+    path: :obj:`str`
+        Path to the file.
+
+    Returns
+    -------
+    :obj:`dict`
+    """
+    file_stat = os.stat(path)
+    return {'mtime': file_stat.st_mtime, 'size': file_stat.st_size}
+
+
+class LSMCatalog(object):
+    """
+    JSON catalog with the time values and the dimensions, shapes, and
+    data types of the variables in each file of a land surface model
+    collection. Only new or changed files need to be scanned when the
+    collection is reopened and the files are only read when the data
+    is computed (see :func:`~LSMCatalog.lazy_dataset`).
+
+    Parameters
+    ----------
+    catalog_path: :obj:`str`
+        Path to the JSON catalog file. It is loaded if it exists.
+
+    Catalog example::
+
+        import pangaea as pa
+
+        with pa.open_mfdataset('/path/to/ncfiles/*.nc',
+                               lat_var='lat',
+                               lon_var='lon',
+                               time_var='time',
+                               lat_dim='lat',
+                               lon_dim='lon',
+                               time_dim='time',
+                               catalog='/path/to/ncfiles/catalog.json') as xds:
+            print(xds.lsm.datetime)
+    """
+    def __init__(self, catalog_path):
+        self.catalog_path = catalog_path
+        self.entries = {}
+        if os.path.exists(catalog_path):
+            with open(catalog_path) as catalog_file:
+                catalog_info = json.load(catalog_file)
+            if catalog_info.get('version') == CATALOG_VERSION:
+                self.entries = catalog_info['files']
+
+    def __contains__(self, path):
+        return os.path.abspath(path) in self.entries
+
+    def is_current(self, path):
+        """Check if the catalog entry for a file is up to date.
+
+        Parameters
+        ----------
+        path: :obj:`str`
+            Path to the file.
+
+        Returns
+        -------
+        bool
+        """
+        entry = self.entries.get(os.path.abspath(path))
+        if entry is None:
+            return False
+        signature = file_signature(path)
+        return (entry['mtime'] == signature['mtime'] and
+                entry['size'] == signature['size'])
+
+    def update(self, paths, scan_file, n_workers=None):
+        """Scan new or changed files and remove files
+        that do not exist anymore.
+
+        Parameters
+        ----------
+        paths: :obj:`list`
+            Paths to the files in the collection.
+        scan_file: function
+            Function that takes a path and returns a :obj:`dict`
+            with the 'time' values (:func:`pandas.DatetimeIndex`)
+            and the 'variables' in the file (see :func:`variable_info`).
+        n_workers: int, optional
+            Number of threads to scan the files with.
+            Default is one thread.
+
+        Returns
+        -------
+        bool
+            True if the catalog changed.
+        """
+        paths = [os.path.abspath(path) for path in paths]
+        scan_paths = [path for path in paths if not self.is_current(path)]
+
+        def scan_entry(path):
+            """scan file for the catalog"""
+            entry = file_signature(path)
+            file_info = scan_file(path)
+            entry['time'] = [pd.Timestamp(time_value).isoformat()
+                             for time_value in file_info['time']]
+            entry['variables'] = file_info['variables']
+            return path, entry
+
+        if scan_paths:
+            count('files_scanned', len(scan_paths))
+            pool = ThreadPool(n_workers or 1)
+            try:
+                self.entries.update(pool.map(scan_entry, scan_paths))
+            finally:
+                pool.close()
+                pool.join()
+
+        removed_paths = [path for path in self.entries
+                         if not os.path.exists(path)]
+        for path in removed_paths:
+            del self.entries[path]
+        return bool(scan_paths or removed_paths)
+
+    def save(self):
+        """Write the catalog to the JSON file."""
+        with open(self.catalog_path, 'w') as catalog_file:
+            json.dump({'version': CATALOG_VERSION,
+                       'files': self.entries},
+                      catalog_file,
+                      indent=1,
+                      sort_keys=True)
+
+    def times(self, path):
+        """Get the time values in a file.
+
+        Parameters
+        ----------
+        path: :obj:`str`
+            Path to the file.
+
+        Returns
+        -------
+        :func:`pandas.DatetimeIndex`
+        """
+        return pd.to_datetime(self.entries[os.path.abspath(path)]['time'])
+
+    def overlaps(self, path, start_time=None, end_time=None):
+        """Check if the time values in a file overlap a time window.
+
+        Parameters
+        ----------
+        path: :obj:`str`
+            Path to the file.
+        start_time: :func:`pandas.Timestamp`, optional
+            Start of the time window.
+        end_time: :func:`pandas.Timestamp`, optional
+            End of the time window.
+
+        Returns
+        -------
+        bool
+        """
+        times = self.times(path)
+        if times.empty:
+            return False
+        if start_time is not None and times.max() < start_time:
+            return False
+        if end_time is not None and times.min() > end_time:
+            return False
+        return True
+
+    def variables(self, path):
+        """Get the dimensions, shape, and data type
+        of the variables in a file.
+
+        Parameters
+        ----------
+        path: :obj:`str`
+            Path to the file.
+
+        Returns
+        -------
+        :obj:`dict`
+        """
+        return self.entries[os.path.abspath(path)]['variables']
+
+    def lazy_dataset(self, path, open_file, drop_variables=()):
+        """Build the dataset of a file from the catalog without
+        opening the file. The variables are dask arrays that open
+        the file when they are computed. The file is only opened once
+        for all variables computed at the same time.
+
+        .. note:: The dataset does not have attributes.
+
+        Parameters
+        ----------
+        path: :obj:`str`
+            Path to the file.
+        open_file: function
+            Function that takes a path and returns the
+            :func:`xarray.Dataset` scanned into the catalog.
+        drop_variables: :obj:`list`, optional
+            Names of the variables to leave out. Dimension coordinates
+            are read when the dataset is created, so they need to be
+            left out to not open the file.
+
+        Returns
+        -------
+        :func:`xarray.Dataset`
+        """
+        # pylint: disable=import-outside-toplevel
+        import dask
+        # pylint: disable=import-outside-toplevel
+        import dask.array as da
+
+        def read_variable(xds, name):
+            """read variable from the opened file"""
+            return np.asarray(xds[name].values)
+
+        # the file is opened once and shared by the variables computed
+        # together; it is closed when the dataset is garbage collected
+        file_xds = dask.delayed(open_file)(
+            path, dask_key_name='open-file-{0}'.format(path))
+
+        data_vars = {}
+        coords = {}
+        for name, var_info in self.variables(path).items():
+            if name in drop_variables:
+                continue
+            data = da.from_delayed(
+                dask.delayed(read_variable, pure=True)(file_xds, name),
+                shape=tuple(var_info['shape']),
+                dtype=np.dtype(var_info['dtype']),
+            )
+            variables = coords if var_info['coord'] else data_vars
+            variables[name] = (var_info['dims'], data)
+        return xr.Dataset(data_vars, coords=coords)
+
+
+def variable_info(xds):
+    """Get the catalog information of the variables in a dataset.
+
+    Parameters
+    ----------
+    xds: :func:`xarray.Dataset`
+        Dataset of a file.
+
+    Returns
+    -------
+    :obj:`dict`
+        The 'dims', 'shape', 'dtype', and if it
+        is a 'coord' of each variable.
+    """
+    return {
+        str(name): {
+            'dims': [str(dim) for dim in var.dims],
+            'shape': [int(dim) for dim in var.shape],
+            'dtype': var.dtype.str,
+            'coord': name in xds.coords,
+        }
+        for name, var in xds.variables.items()
+    }
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+#
+#  derived.py
+#  pangaea
+#
+#  Author : Alan D Snow, 2017.
+#  License: BSD 3-Clause
+"""pangaea.derived
+
+    This module provides a registry of variables derived from
+    the variables in land surface model output
+    (see :func:`pangaea.LSMGridReader.getvar`).
+"""
+import numpy as np
+
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+# functions available in the expressions without numexpr
+_NUMPY_FUNCTIONS = {
+    'abs': np.absolute,
+    'arctan2': np.arctan2,
+    'cos': np.cos,
+    'exp': np.exp,
+    'log': np.log,
+    'sin': np.sin,
+    'sqrt': np.sqrt,
+    'where': np.where,
+}
+
+# derived variable name -> list of definitions
+DERIVED_VARIABLES = {}
+
+
+class DerivedVariable(object):
+    """
+    Variable calculated from an expression of source variables.
+
+    Parameters
+    ----------
+    name: :obj:`str`
+        Name of the derived variable.
+    expression: :obj:`str`
+        Expression with the source variable names
+        (see :func:`numexpr.evaluate`).
+    sources: :obj:`tuple`
+        Names of the source variables in the expression.
+    attrs: :obj:`dict`, optional
+        Attributes of the derived variable (Ex. units).
+    """
+    def __init__(self, name, expression, sources, attrs=None):
+        self.name = name
+        self.expression = expression
+        self.sources = tuple(sources)
+        self.attrs = dict(attrs or {})
+        self._code = compile(expression, '<{0}>'.format(name), 'eval')
+
+    def evaluate(self, *source_arrays):
+        """Evaluate the expression in one pass over the arrays
+        with numexpr (or with NumPy if numexpr is not installed).
+
+        Parameters
+        ----------
+        *source_arrays: :func:`numpy.ndarray`
+            Arrays in the order of the sources.
+
+        Returns
+        -------
+        :func:`numpy.ndarray`
+        """
+        local_dict = dict(zip(self.sources, source_arrays))
+        if numexpr is not None:
+            return numexpr.evaluate(self.expression, local_dict=local_dict)
+        local_dict = dict(_NUMPY_FUNCTIONS, **local_dict)
+        return eval(self._code,  # pylint: disable=eval-used
+                    {'__builtins__': {}}, local_dict)
+
+
+def register_derived_variable(name, expression, sources, attrs=None):
+    """Register a derived variable to get with
+    :func:`pangaea.LSMGridReader.getvar`.
+
+    A name can have definitions for different models. The first
+    definition with all of the sources in the dataset is used.
+
+    Register example::
+
+        from pangaea.derived import register_derived_variable
+
+        register_derived_variable('wind_speed_100m',
+                                  'sqrt(u100**2 + v100**2)',
+                                  sources=('u100', 'v100'),
+                                  attrs={'units': 'm s**-1'})
+
+    Parameters
+    ----------
+    name: :obj:`str`
+        Name of the derived variable.
+    expression: :obj:`str`
+        Expression with the source variable names
+        (see :func:`numexpr.evaluate`).
+    sources: :obj:`tuple`
+        Names of the source variables in the expression.
+    attrs: :obj:`dict`, optional
+        Attributes of the derived variable (Ex. units).
+    """
+    DERIVED_VARIABLES.setdefault(name, []) \
+        .append(DerivedVariable(name, expression, sources, attrs))
+
+
+def find_derived_variable(name, variables):
+    """Find the definition of a derived variable
+    with all of the sources in the variables.
+
+    Parameters
+    ----------
+    name: :obj:`str`
+        Name of the derived variable.
+    variables: :obj:`list`
+        Names of the variables in the dataset.
+
+    Returns
+    -------
+    :func:`DerivedVariable` or None
+    """
+    for derived_variable in DERIVED_VARIABLES.get(name, []):
+        if all(source in variables for source in derived_variable.sources):
+            return derived_variable
+    return None
+
+
+# WRF
+register_derived_variable(
+    'wind_speed', 'sqrt(U10**2 + V10**2)', ('U10', 'V10'),
+    {'units': 'm s-1', 'long_name': 'Wind speed at 10 m'})
+register_derived_variable(
+    'relative_humidity',
+    '100 * (Q2 * PSFC / (0.622 + Q2)) / '
+    '(611.2 * exp(17.67 * (T2 - 273.15) / (T2 - 29.65)))',
+    ('Q2', 'T2', 'PSFC'),
+    {'units': '%', 'long_name': 'Relative humidity at 2 m'})
+register_derived_variable(
+    'net_radiation',
+    'SWDOWN * (1 - ALBEDO) + EMISS * GLW - EMISS * 5.67e-8 * TSK**4',
+    ('SWDOWN', 'ALBEDO', 'GLW', 'EMISS', 'TSK'),
+    {'units': 'W m-2', 'long_name': 'Net radiation at the surface'})
+
+# ERA Interim & ERA5
+register_derived_variable(
+    'wind_speed', 'sqrt(u10**2 + v10**2)', ('u10', 'v10'),
+    {'units': 'm s**-1', 'long_name': 'Wind speed at 10 m'})
+register_derived_variable(
+    'relative_humidity',
+    '100 * exp(17.67 * (d2m - 273.15) / (d2m - 29.65) - '
+    '17.67 * (t2m - 273.15) / (t2m - 29.65))',
+    ('d2m', 't2m'),
+    {'units': '%', 'long_name': 'Relative humidity at 2 m'})
+register_derived_variable(
+    'net_radiation', 'ssr + str', ('ssr', 'str'),
+    {'units': 'J m**-2', 'long_name': 'Accumulated net radiation'})
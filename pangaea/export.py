@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+#
+#  export.py
+#  pangaea
+#
+#  Author : Alan D Snow, 2017.
+#  License: BSD 3-Clause
+"""pangaea.export
+
+    This module provides helper functions to export
+    stacks of grids to GeoTIFF files.
+"""
+from multiprocessing.pool import ThreadPool
+import os
+
+import numpy as np
+from osgeo import gdal, gdalconst
+
+from .log import count
+from .warp import band_chunks
+
+
+def tif_creation_options(compress='DEFLATE', tiled=True):
+    """Get the GeoTIFF creation options.
+
+    Parameters
+    ----------
+    compress: :obj:`str`, optional
+        Compression method (Ex. 'DEFLATE', 'LZW').
+        If None, the data will not be compressed. Default is 'DEFLATE'.
+    tiled: bool, optional
+        If True, the GeoTIFF will be tiled. Default is True.
+
+    Returns
+    -------
+    :obj:`list`
+    """
+    options = ['BIGTIFF=IF_SAFER']
+    if tiled:
+        options.append('TILED=YES')
+    if compress:
+        options.append('COMPRESS={0}'.format(compress))
+    return options
+
+
+def _create_tif(out_path, grid_def, num_bands, options):
+    """Create an empty GeoTIFF file for the grid definition."""
+    y_size, x_size = grid_def['shape']
+    dataset = gdal.GetDriverByName('GTiff').Create(out_path,
+                                                   x_size,
+                                                   y_size,
+                                                   num_bands,
+                                                   gdalconst.GDT_Float32,
+                                                   options=options)
+    dataset.SetGeoTransform(grid_def['geotransform'])
+    dataset.SetProjection(grid_def['wkt'])
+    return dataset
+
+
+def _to_cog(tif_path, out_path, compress):
+    """Convert GeoTIFF to Cloud Optimized GeoTIFF (GDAL >= 3.1)."""
+    options = []
+    if compress:
+        options.append('COMPRESS={0}'.format(compress))
+    cog_driver = gdal.GetDriverByName('COG')
+    if cog_driver is None:
+        raise ValueError("The GDAL COG driver is not available. "
+                         "GDAL >= 3.1 is required ...")
+    src_ds = gdal.Open(tif_path, gdalconst.GA_ReadOnly)
+    cog_driver.CreateCopy(out_path, src_ds, options=options)
+    src_ds = None
+    os.remove(tif_path)
+
+
+def write_multiband_tif(data_array, grid_def, out_path,
+                        band_chunk_size=None, compress='DEFLATE',
+                        tiled=True, cog=False):
+    """Write a stack of bands to a multi-band GeoTIFF chunk by chunk.
+
+    Parameters
+    ----------
+    data_array: :func:`xarray.DataArray` or :func:`numpy.ndarray`
+        3D array with dimensions (band, y, x).
+    grid_def: :obj:`dict`
+        Definition of the grid (see :func:`pangaea.warp.grid_definition`).
+    out_path: :obj:`str`
+        Path to output geotiff file.
+    band_chunk_size: int, optional
+        Number of bands to read into memory at once. Default is all bands.
+    compress: :obj:`str`, optional
+        Compression method. Default is 'DEFLATE'.
+    tiled: bool, optional
+        If True, the GeoTIFF will be tiled. Default is True.
+    cog: bool, optional
+        If True, the output is a Cloud Optimized GeoTIFF. Default is False.
+    """
+    num_bands = data_array.shape[0]
+    tif_path = out_path + '.tmp' if cog else out_path
+    dataset = _create_tif(tif_path, grid_def, num_bands,
+                          tif_creation_options(compress, tiled))
+    for band_slice in band_chunks(num_bands, band_chunk_size):
+        data = np.asarray(data_array[band_slice])
+        count('bytes_read', data.nbytes)
+        for band_index, band_data in enumerate(data):
+            dataset.GetRasterBand(band_slice.start + band_index + 1) \
+                .WriteArray(band_data)
+    dataset.FlushCache()
+    dataset = None
+    if cog:
+        _to_cog(tif_path, out_path, compress)
+    count('tifs_written')
+
+
+def write_tif_series(data_array, grid_def, out_paths,
+                     band_chunk_size=None, compress='DEFLATE',
+                     tiled=True, cog=False, n_workers=None):
+    """Write each band in a stack of bands to a separate GeoTIFF.
+
+    Parameters
+    ----------
+    data_array: :func:`xarray.DataArray` or :func:`numpy.ndarray`
+        3D array with dimensions (band, y, x).
+    grid_def: :obj:`dict`
+        Definition of the grid (see :func:`pangaea.warp.grid_definition`).
+    out_paths: :obj:`list`
+        Path to output geotiff file for each band.
+    band_chunk_size: int, optional
+        Number of bands to read into memory at once. Default is all bands.
+    compress: :obj:`str`, optional
+        Compression method. Default is 'DEFLATE'.
+    tiled: bool, optional
+        If True, the GeoTIFF will be tiled. Default is True.
+    cog: bool, optional
+        If True, the output is a Cloud Optimized GeoTIFF. Default is False.
+    n_workers: int, optional
+        If set, the files are written in parallel
+        with this number of threads.
+    """
+    options = tif_creation_options(compress, tiled)
+
+    def write_band(band_info):
+        """write band to file"""
+        out_path, band_data = band_info
+        tif_path = out_path + '.tmp' if cog else out_path
+        dataset = _create_tif(tif_path, grid_def, 1, options)
+        dataset.GetRasterBand(1).WriteArray(band_data)
+        dataset.FlushCache()
+        dataset = None
+        if cog:
+            _to_cog(tif_path, out_path, compress)
+        count('tifs_written')
+
+    pool = None
+    if n_workers is not None and n_workers > 1:
+        pool = ThreadPool(n_workers)
+    try:
+        for band_slice in band_chunks(data_array.shape[0], band_chunk_size):
+            data = np.asarray(data_array[band_slice])
+            count('bytes_read', data.nbytes)
+            band_info = zip(out_paths[band_slice], data)
+            if pool is None:
+                for band in band_info:
+                    write_band(band)
+            else:
+                pool.map(write_band, list(band_info))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
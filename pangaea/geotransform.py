@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+#
+#  geotransform.py
+#  pangaea
+#
+#  Author : Alan D Snow, 2017.
+#  License: BSD 3-Clause
+"""pangaea.geotransform
+
+    This module provides the projection, size, geotransform, and axes
+    of the grid for the land surface model accessor
+    (see :class:`pangaea.LSMGridReader`).
+"""
+from affine import Affine
+import numpy as np
+
+from .log import LOGGER
+
+
+class GeotransformMixin(object):
+    """
+    Projection, grid size, geotransform, and axes of the
+    :class:`pangaea.LSMGridReader` accessor.
+    """
+    def _load_wrf_projection(self):
+        """Load the osgeo.osr projection for WRF Grid.
+
+        - 'MAP_PROJ': The map projection type as an integer.
+        - 'TRUELAT1': True latitude 1.
+        - 'TRUELAT2': True latitude 2.
+        - 'MOAD_CEN_LAT': Mother of all domains center latitude.
+        - 'STAND_LON': Standard longitude.
+        - 'POLE_LAT': Pole latitude.
+        - 'POLE_LON': Pole longitude.
+        """
+        # load in params from WRF Global Attributes
+        possible_proj_params = ('MAP_PROJ', 'TRUELAT1', 'TRUELAT2',
+                                'MOAD_CEN_LAT', 'STAND_LON', 'POLE_LAT',
+                                'POLE_LON', 'CEN_LAT', 'CEN_LON', 'DX', 'DY')
+        proj_params = dict()
+        for proj_param in possible_proj_params:
+            if proj_param in self._obj.attrs:
+                proj_params[proj_param] = self._obj.attrs[proj_param]
+
+        # determine projection from WRF Grid
+        # pylint: disable=import-outside-toplevel
+        import wrf
+        # pylint: disable=import-outside-toplevel
+        from osgeo import osr
+        proj = wrf.projection.getproj(**proj_params)
+
+        # export to Proj4 and add as osr projection
+        self._projection = osr.SpatialReference()
+        self._projection.ImportFromProj4(str(proj.proj4()))
+
+    def _load_grib_projection(self):
+        """Get the osgeo.osr projection for Grib Grid.
+            - grid_type:  Lambert Conformal
+            - Latin1:     True latitude 1.
+            - Latin2:     True latitude 2.
+            - Lov:        Central meridian.
+            - Lo1:        Pole longitude.
+            - La1:        Pole latitude.
+            - Dx:         [ 3.]
+            - Dy:         [ 3.]
+        """
+        lat_var_attrs = self._obj[self.y_var].attrs
+        if 'Lambert Conformal' in lat_var_attrs['grid_type']:
+            mean_lat = self._obj[self.y_var].mean().values
+            proj4_str = ("+proj=lcc "
+                         "+lat_1={true_lat_1} "
+                         "+lat_2={true_lat_2} "
+                         "+lat_0={latitude_of_origin} "
+                         "+lon_0={central_meridian} "
+                         "+x_0=0 +y_0=0 "
+                         "+ellps=WGS84 +datum=WGS84 "
+                         "+units=m +no_defs") \
+                .format(true_lat_1=lat_var_attrs['Latin1'][0],
+                        true_lat_2=lat_var_attrs['Latin2'][0],
+                        latitude_of_origin=mean_lat,
+                        central_meridian=lat_var_attrs['Lov'][0])
+        else:
+            raise ValueError("Unsupported projection: {grid_type}"
+                             .format(grid_type=lat_var_attrs['grid_type']))
+
+        # export to Proj4 and add as osr projection
+        # pylint: disable=import-outside-toplevel
+        from osgeo import osr
+        self._projection = osr.SpatialReference()
+        self._projection.ImportFromProj4(proj4_str)
+
+    @property
+    def projection(self):
+        """:func:`osgeo.osr.SpatialReference`
+            The projection for the dataset.
+        """
+        if self._projection is None:
+            # pylint: disable=import-outside-toplevel
+            from osgeo import osr
+            # read projection information from global attributes
+            map_proj4 = self._obj.attrs.get('proj4')
+            if map_proj4 is not None:
+                self._projection = osr.SpatialReference()
+                self._projection.ImportFromProj4(str(map_proj4))
+            elif 'MAP_PROJ' in self._obj.attrs:
+                self._load_wrf_projection()
+            elif 'grid_type' in self._obj[self.y_var].attrs:
+                self._load_grib_projection()
+            elif 'ProjectionCoordinateSystem' in self._obj.keys():
+                # national water model
+                proj4_str = self._obj['ProjectionCoordinateSystem'] \
+                                .attrs['proj4']
+                self._projection = osr.SpatialReference()
+                self._projection.ImportFromProj4(str(proj4_str))
+            else:
+                # default to EPSG 4326
+                self._projection = osr.SpatialReference()
+                self._projection.ImportFromEPSG(4326)
+            # make sure EPSG loaded if possible
+            self._projection.AutoIdentifyEPSG()
+        return self._projection
+
+    @property
+    def epsg(self):
+        """str: EPSG code"""
+        if self._epsg is None:
+            self._epsg = self.projection.GetAuthorityCode(None)
+        return self._epsg
+
+    @property
+    def dx(self):
+        """float: Pixel size in x direction."""
+        return self.geotransform[1]
+
+    @property
+    def dy(self):
+        """float: Pixel size in y direction."""
+        return -self.geotransform[-1]
+
+    def _metadata_geotransform(self):
+        """Calculate the geotransform from the grid metadata
+        by only transforming the reference point of the grid.
+
+        - WRF: 'DX', 'DY', 'CEN_LAT', 'CEN_LON' global attributes.
+        - GRIB: 'Dx', 'Dy' (km), 'La1', 'Lo1' latitude attributes.
+        """
+        attrs = self._obj.attrs
+        if 'MAP_PROJ' in attrs and \
+                all(attr in attrs for attr in ('DX', 'DY',
+                                               'CEN_LAT', 'CEN_LON')):
+            dx = float(attrs['DX'])
+            dy = float(attrs['DY'])
+            # the center of the domain is the center of the grid
+            center_x, center_y = self._transform_from_latlon(
+                float(attrs['CEN_LON']), float(attrs['CEN_LAT']))
+            return (float(center_x) - dx * self.x_size / 2.0, dx, 0,
+                    float(center_y) + dy * self.y_size / 2.0, 0, -dy)
+
+        lat_var_attrs = self._obj[self.y_var].attrs
+        if all(attr in lat_var_attrs for attr in ('Dx', 'Dy', 'La1', 'Lo1')):
+            dx = float(np.ravel(lat_var_attrs['Dx'])[0]) * 1000.0
+            dy = float(np.ravel(lat_var_attrs['Dy'])[0]) * 1000.0
+            # the first point is the center of the first cell
+            first_x, first_y = self._transform_from_latlon(
+                float(np.ravel(lat_var_attrs['Lo1'])[0]),
+                float(np.ravel(lat_var_attrs['La1'])[0]))
+            if self.y_inverted:
+                max_y = float(first_y) + dy * (self.y_size - 0.5)
+            else:
+                max_y = float(first_y) + dy / 2.0
+            return (float(first_x) - dx / 2.0, dx, 0, max_y, 0, -dy)
+        return None
+
+    def _sample_latlon(self, rows, cols):
+        """Get the latitude and longitude of grid cells
+        without loading the full coordinate arrays.
+
+            .. note:: The rows are for the grid with [0,0]
+                as Northeast and [-1,-1] as Southwest.
+        """
+        if self.y_inverted:
+            rows = self.y_size - 1 - np.asarray(rows)
+        lat_var = self._obj[self.y_var]
+        lon_var = self._obj[self.x_var]
+        if lat_var.ndim == 3:
+            lat_var = lat_var[0]
+        if lon_var.ndim == 3:
+            lon_var = lon_var[0]
+        lat = np.array([float(lat_var[row, col])
+                        for row, col in zip(rows, cols)])
+        lon = np.array([float(lon_var[row, col])
+                        for row, col in zip(rows, cols)])
+        if self.coords_projected:
+            lon, lat = self._transform_to_latlon(lon, lat)
+        return lat, lon
+
+    def _verify_geotransform(self, geotransform, tolerance=0.1):
+        """Check the geotransform with the coordinates of the corner
+        and center cells (tolerance is a fraction of the cell size)."""
+        rows = np.array([0, 0, self.y_size - 1, self.y_size - 1,
+                         self.y_size // 2])
+        cols = np.array([0, self.x_size - 1, 0, self.x_size - 1,
+                         self.x_size // 2])
+        lat, lon = self._sample_latlon(rows, cols)
+        proj_x, proj_y = self._transform_from_latlon(lon, lat)
+        expected_x = geotransform[0] + (cols + 0.5) * geotransform[1]
+        expected_y = geotransform[3] + (rows + 0.5) * geotransform[5]
+        return bool(
+            np.all(np.abs(proj_x - expected_x) <=
+                   tolerance * abs(geotransform[1])) and
+            np.all(np.abs(proj_y - expected_y) <=
+                   tolerance * abs(geotransform[5]))
+        )
+
+    @property
+    def geotransform(self):
+        """:obj:`tuple`: The geotransform for grid.
+
+            .. note:: If `geotransform_from_metadata` is True,
+                the geotransform is calculated from the grid metadata
+                when available instead of the coordinates of every cell.
+                If `verify_geotransform` is also True, it is only used
+                if it matches the coordinates of a few sampled cells.
+        """
+        if self._geotransform is None:
+            metadata_geotransform = None
+            if self.geotransform_from_metadata:
+                metadata_geotransform = self._metadata_geotransform()
+                if metadata_geotransform is not None and \
+                        self.verify_geotransform and \
+                        not self._verify_geotransform(metadata_geotransform):
+                    LOGGER.warning("Geotransform from metadata does not "
+                                   "match the coordinates. "
+                                   "Using the coordinates ...")
+                    metadata_geotransform = None
+
+            # pylint: disable=import-outside-toplevel
+            from gazar.grid import geotransform_from_yx
+            if self._obj.attrs.get('geotransform') is not None:
+                self._geotransform = [float(g) for g in
+                                      self._obj.attrs.get('geotransform')]
+            elif metadata_geotransform is not None:
+                self._geotransform = metadata_geotransform
+            elif self.is_rectilinear:
+                y_axis, x_axis = self.axes
+                self._geotransform = geotransform_from_yx(
+                    y_axis[:1, None],
+                    x_axis[None, :1],
+                    y_cell_size=np.nanmean(np.absolute(np.diff(y_axis))),
+                    x_cell_size=np.nanmean(np.absolute(np.diff(x_axis))))
+            elif str(self.epsg) != '4326':
+                proj_y, proj_x = self.coords
+                self._geotransform = geotransform_from_yx(proj_y,
+                                                          proj_x)
+            else:
+                self._geotransform = geotransform_from_yx(*self.latlon)
+
+        return self._geotransform
+
+    @property
+    def affine(self):
+        """:func:`Affine`: The affine for the transformation."""
+        if self._affine is None:
+            self._affine = Affine.from_gdal(*self.geotransform)
+        return self._affine
+
+    @property
+    def x_size(self):
+        """int: Number of columns in the dataset."""
+        return self._obj.dims[self.x_dim]
+
+    @property
+    def y_size(self):
+        """int: Number of rows in the dataset."""
+        return self._obj.dims[self.y_dim]
+
+    @property
+    def is_rectilinear(self):
+        """bool: The grid coordinates are 1D axes
+        in the grid projection."""
+        if 'MAP_PROJ' in self._obj.attrs:
+            return False
+        if self._obj[self.x_var].ndim != 1 or \
+                self._obj[self.y_var].ndim != 1:
+            return False
+        return self.coords_projected or str(self.epsg) == '4326'
+
+    @property
+    def axes(self):
+        """Returns 1D y, x coordinate axes of a rectilinear grid
+        in the grid projection without creating 2D arrays.
+
+            .. note:: The y axis is always returned from North to South.
+        """
+        if not self.is_rectilinear:
+            raise ValueError("The grid is not rectilinear. "
+                             "Use coords instead ...")
+        y_coords, x_coords = self._raw_axes()
+        if self.lon_to_180 and not self.coords_projected:
+            x_coords = (x_coords + 180) % 360 - 180
+        return y_coords, x_coords
+
+    @property
+    def grid_definition(self):
+        """:obj:`dict`: Definition of the grid projection,
+        geotransform, and shape."""
+        # pylint: disable=import-outside-toplevel
+        from .warp import grid_definition
+        return grid_definition(self.projection.ExportToWkt(),
+                               self.geotransform,
+                               (self.y_size, self.x_size))
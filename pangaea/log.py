@@ -12,8 +12,16 @@ Documentation can be found at `_pangaea Documentation HOWTO`_.
    https://github.com/snowman2/pangaea
 """
 # default modules
+from functools import wraps
 import logging
 import os
+import threading
+import time
+try:
+    import tracemalloc
+except ImportError:
+    # python 2
+    tracemalloc = None
 # external modules
 import appdirs
 # local modules
@@ -26,6 +34,20 @@ LOGGER.propagate = False
 DEFAULT_LOG_DIR = appdirs.user_log_dir('pangaea', 'logs')
 DEFAULT_LOG_FILE = os.path.join(DEFAULT_LOG_DIR, 'pangaea.log')
 
+# timing, counter, and memory metrics
+_METRICS = {
+    'enabled': False,
+    'trace_memory': False,
+    'timers': {},
+    'counters': {},
+    'peak_memory': {},
+    'started_tracing': False,
+}
+_METRICS_LOCK = threading.Lock()
+# timers tracking the peak memory in all threads
+# as the tracemalloc peak is for the whole process
+_ACTIVE_TIMERS = []
+
 
 def log_to_console(status=True, level=None):
     """Log events to  the console.
@@ -95,3 +117,160 @@ def log_to_file(status=True, filename=DEFAULT_LOG_FILE, level=None):
         for handle in LOGGER.handlers:
             if type(handle).__name__ == 'FileHandler':
                 LOGGER.removeHandler(handle)
+
+
+def log_metrics(status=True, trace_memory=False):
+    """Collect timing, counter, and memory metrics.
+
+    The time of each timed operation is logged at the DEBUG level
+    and the metrics are available with :func:`get_metrics`.
+
+    Args:
+        status (bool, Optional, Default=True)
+            whether collecting metrics should be turned on(True) or off(False)
+        trace_memory (bool, Optional, Default=False) :
+            whether to track the peak memory of timed operations
+            with tracemalloc (Python 3.9+, ignored otherwise as the
+            peak memory cannot be reset for each operation).
+            tracemalloc is only stopped if it was started here.
+      """
+    _METRICS['enabled'] = status
+    _METRICS['trace_memory'] = \
+        status and trace_memory and hasattr(tracemalloc, 'reset_peak')
+    if _METRICS['trace_memory']:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _METRICS['started_tracing'] = True
+    elif _METRICS['started_tracing']:
+        _METRICS['started_tracing'] = False
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+
+def metrics_enabled():
+    """Check if metrics are collected.
+
+    Returns:
+        bool
+    """
+    return _METRICS['enabled']
+
+
+def reset_metrics():
+    """Remove all of the collected metrics."""
+    with _METRICS_LOCK:
+        _METRICS['timers'] = {}
+        _METRICS['counters'] = {}
+        _METRICS['peak_memory'] = {}
+
+
+def get_metrics():
+    """Get the collected metrics.
+
+    Returns:
+        dict: with 'timers' ({name: {'count', 'total', 'max'}} in seconds),
+        'counters' ({name: value}), and 'peak_memory' ({name: bytes}).
+    """
+    with _METRICS_LOCK:
+        return {
+            'timers': {name: dict(timer_info) for name, timer_info
+                       in _METRICS['timers'].items()},
+            'counters': dict(_METRICS['counters']),
+            'peak_memory': dict(_METRICS['peak_memory']),
+        }
+
+
+def count(name, value=1):
+    """Add to a counter (Ex. 'files_opened', 'bytes_read').
+
+    Args:
+        name (string) :
+            name of the counter.
+        value (int, Optional, Default=1) :
+            value to add to the counter.
+      """
+    if not _METRICS['enabled']:
+        return
+    with _METRICS_LOCK:
+        _METRICS['counters'][name] = \
+            _METRICS['counters'].get(name, 0) + value
+
+
+class Timer(object):
+    """Time an operation as a context manager or decorator
+    when metrics are collected (see :func:`log_metrics`).
+
+    The peak memory is for the whole process, so it includes
+    the memory used by other threads during the operation.
+
+    Args:
+        name (string) :
+            name of the timed operation.
+
+    Timer example::
+
+        from pangaea.log import Timer
+
+        with Timer('my_operation'):
+            do_something()
+
+        @Timer('my_function')
+        def my_function():
+            do_something()
+    """
+    def __init__(self, name):
+        self.name = name
+        self._start_time = None
+        self._peak_memory = 0
+
+    def __call__(self, func):
+        @wraps(func)
+        def timed_func(*args, **kwargs):
+            """timed function"""
+            with Timer(self.name):
+                return func(*args, **kwargs)
+        return timed_func
+
+    def __enter__(self):
+        if _METRICS['enabled']:
+            if _METRICS['trace_memory']:
+                with _METRICS_LOCK:
+                    # keep the peak of the active timers before it is reset
+                    traced_peak = tracemalloc.get_traced_memory()[1]
+                    for timer in _ACTIVE_TIMERS:
+                        timer._peak_memory = max(timer._peak_memory,
+                                                 traced_peak)
+                    self._peak_memory = 0
+                    _ACTIVE_TIMERS.append(self)
+                    tracemalloc.reset_peak()
+            self._start_time = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._start_time is None:
+            return
+        elapsed = time.time() - self._start_time
+        self._start_time = None
+        peak_memory = None
+        with _METRICS_LOCK:
+            if any(timer is self for timer in _ACTIVE_TIMERS):
+                _ACTIVE_TIMERS[:] = [timer for timer in _ACTIVE_TIMERS
+                                     if timer is not self]
+                if tracemalloc.is_tracing():
+                    peak_memory = max(tracemalloc.get_traced_memory()[1],
+                                      self._peak_memory)
+                self._peak_memory = 0
+            timer_info = _METRICS['timers'].setdefault(
+                self.name, {'count': 0, 'total': 0.0, 'max': 0.0})
+            timer_info['count'] += 1
+            timer_info['total'] += elapsed
+            timer_info['max'] = max(timer_info['max'], elapsed)
+            if peak_memory is not None:
+                _METRICS['peak_memory'][self.name] = \
+                    max(_METRICS['peak_memory'].get(self.name, 0),
+                        peak_memory)
+        if peak_memory is None:
+            LOGGER.debug("%s: %.3f seconds", self.name, elapsed)
+        else:
+            LOGGER.debug("%s: %.3f seconds, peak memory %.1f MB",
+                         self.name, elapsed, peak_memory / 1e6)
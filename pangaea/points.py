@@ -0,0 +1,246 @@
+# -*- coding: utf-8 -*-
+#
+#  points.py
+#  pangaea
+#
+#  Author : Alan D Snow, 2017.
+#  License: BSD 3-Clause
+"""pangaea.points
+
+    This module provides the time series of variables at points
+    for the land surface model accessor (see :class:`pangaea.LSMGridReader`).
+"""
+import numpy as np
+import xarray as xr
+
+from .log import Timer
+
+
+def _latlon_to_xyz(lat, lon):
+    """Convert latitude/longitude to points on the unit sphere."""
+    lat = np.radians(lat)
+    lon = np.radians(lon)
+    cos_lat = np.cos(lat)
+    return np.stack([cos_lat * np.cos(lon),
+                     cos_lat * np.sin(lon),
+                     np.sin(lat)], axis=-1)
+
+
+def _point_weights(rows, cols, shape, method):
+    """Get the grid cells and weights to interpolate at points.
+
+    Parameters
+    ----------
+    rows: :func:`numpy.ndarray`
+        Fractional row of each point (0 at the center of the first row).
+    cols: :func:`numpy.ndarray`
+        Fractional column of each point (0 at the center of
+        the first column).
+    shape: :obj:`tuple`
+        Shape of the grid (y size, x size).
+    method: :obj:`str`
+        One of 'nearest' or 'bilinear'.
+
+    Returns
+    -------
+    :func:`numpy.ndarray`, :func:`numpy.ndarray`, \
+    :func:`numpy.ndarray`, :func:`numpy.ndarray`
+        Rows, columns, and weights of the cells with
+        shape (point, corner) and if each point is inside the grid.
+    """
+    y_size, x_size = shape
+    with np.errstate(invalid='ignore'):
+        valid = (rows >= -0.5) & (rows <= y_size - 0.5) & \
+            (cols >= -0.5) & (cols <= x_size - 0.5)
+    rows = np.where(valid, rows, 0)
+    cols = np.where(valid, cols, 0)
+    if method == 'nearest':
+        row_indices = np.clip(np.floor(rows + 0.5), 0, y_size - 1)
+        col_indices = np.clip(np.floor(cols + 0.5), 0, x_size - 1)
+        return (row_indices.astype(np.int64)[:, None],
+                col_indices.astype(np.int64)[:, None],
+                np.ones((rows.size, 1)),
+                valid)
+    if method != 'bilinear':
+        raise ValueError("Invalid method: {method}. "
+                         "Use 'nearest' or 'bilinear' ..."
+                         .format(method=method))
+
+    row_0 = np.clip(np.floor(rows), 0, max(y_size - 2, 0)).astype(np.int64)
+    col_0 = np.clip(np.floor(cols), 0, max(x_size - 2, 0)).astype(np.int64)
+    row_1 = np.minimum(row_0 + 1, y_size - 1)
+    col_1 = np.minimum(col_0 + 1, x_size - 1)
+    row_weight = np.clip(rows - row_0, 0, 1)
+    col_weight = np.clip(cols - col_0, 0, 1)
+    return (np.stack([row_0, row_0, row_1, row_1], axis=-1),
+            np.stack([col_0, col_1, col_0, col_1], axis=-1),
+            np.stack([(1 - row_weight) * (1 - col_weight),
+                      (1 - row_weight) * col_weight,
+                      row_weight * (1 - col_weight),
+                      row_weight * col_weight], axis=-1),
+            valid)
+
+
+class PointsMixin(object):
+    """
+    Point time series of the :class:`pangaea.LSMGridReader` accessor.
+    """
+    @property
+    def _latlon_tree(self):
+        """Cached KD-tree of the grid cell centers on the unit sphere."""
+        cache_key = self._coords_cache_key
+        cached = self._coords_cache.get('latlon_tree')
+        if cached is None or cached[0] != cache_key:
+            # pylint: disable=import-outside-toplevel
+            from scipy.spatial import cKDTree
+            lat, lon = self.latlon
+            with Timer('lsm.latlon_tree'):
+                cached = (cache_key,
+                          cKDTree(_latlon_to_xyz(lat, lon).reshape(-1, 3)))
+            self._coords_cache['latlon_tree'] = cached
+        return cached[1]
+
+    def _tree_indices(self, lon, lat):
+        """Get the fractional grid indices of longitude/latitude points
+        from the nearest cell and the local grid vectors."""
+        tree = self._latlon_tree
+        grid_xyz = tree.data.reshape(self.y_size, self.x_size, 3)
+        point_xyz = _latlon_to_xyz(lat, lon)
+        _, nearest = tree.query(point_xyz)
+        rows, cols = np.divmod(nearest, self.x_size)
+
+        # solve for the offset from the nearest cell center
+        # with the vectors to the neighboring cells
+        row_lo = np.maximum(rows - 1, 0)
+        row_hi = np.minimum(rows + 1, self.y_size - 1)
+        col_lo = np.maximum(cols - 1, 0)
+        col_hi = np.minimum(cols + 1, self.x_size - 1)
+        row_vec = (grid_xyz[row_hi, cols] - grid_xyz[row_lo, cols]) / \
+            np.maximum(row_hi - row_lo, 1)[:, None]
+        col_vec = (grid_xyz[rows, col_hi] - grid_xyz[rows, col_lo]) / \
+            np.maximum(col_hi - col_lo, 1)[:, None]
+        offset = point_xyz - grid_xyz[rows, cols]
+        row_row = np.sum(row_vec * row_vec, axis=-1)
+        col_col = np.sum(col_vec * col_vec, axis=-1)
+        row_col = np.sum(row_vec * col_vec, axis=-1)
+        row_off = np.sum(row_vec * offset, axis=-1)
+        col_off = np.sum(col_vec * offset, axis=-1)
+        det = row_row * col_col - row_col ** 2
+        singular = det <= 0
+        det[singular] = 1
+        row_shift = np.where(singular, 0,
+                             (col_col * row_off - row_col * col_off) / det)
+        col_shift = np.where(singular, 0,
+                             (row_row * col_off - row_col * row_off) / det)
+        return rows + row_shift, cols + col_shift
+
+    @Timer('lsm.getvar_points')
+    def getvar_points(self, variable, x_coords, y_coords, projection=None,
+                      method='nearest', time_chunk_size=None):
+        """Get the time series of a variable at points.
+
+        The points are mapped to grid indices at once with the
+        :func:`~pangaea.LSMGridReader.affine` for rectilinear grids or
+        a cached KD-tree of :func:`~pangaea.LSMGridReader.latlon` for
+        curvilinear grids (Ex. WRF, HRRR). The values at all points
+        are read with one vectorized indexing pass per time chunk.
+
+            Point extraction example::
+
+                gauges = xds.lsm.getvar_points('RAINC',
+                                               gauge_lon, gauge_lat,
+                                               method='bilinear')
+
+            Parameters
+            ----------
+            variable: :obj:`str`
+                Name of variable in dataset.
+            x_coords: array-like
+                X coordinates (or longitude) of the points.
+            y_coords: array-like
+                Y coordinates (or latitude) of the points.
+            projection: :func:`osr.SpatialReference`, optional
+                Projection of the point coordinates.
+                Default is longitude/latitude (EPSG:4326).
+            method: :obj:`str`, optional
+                One of 'nearest' or 'bilinear'. Default is 'nearest'.
+            time_chunk_size: int, optional
+                Number of time steps to read at once. If set, the
+                values are loaded into memory one chunk at a time.
+                Default is all time steps at once.
+
+            Returns
+            -------
+            :func:`xarray.DataArray`
+                Values with the grid dimensions replaced by the
+                'point' dimension. Points outside of the grid are NaN.
+        """
+        x_coords = np.atleast_1d(np.asarray(x_coords, dtype=np.float64))
+        y_coords = np.atleast_1d(np.asarray(y_coords, dtype=np.float64))
+        if x_coords.shape != y_coords.shape or x_coords.ndim != 1:
+            raise ValueError("'x_coords' and 'y_coords' need to be "
+                             "1D arrays of the same size ...")
+
+        if self.is_rectilinear:
+            grid_x, grid_y = x_coords, y_coords
+            if projection is not None:
+                # pylint: disable=import-outside-toplevel
+                from .transform import transform_points
+                grid_x, grid_y = transform_points(projection,
+                                                  self.projection,
+                                                  grid_x, grid_y)
+            elif str(self.epsg) != '4326':
+                grid_x, grid_y = self._transform_from_latlon(grid_x,
+                                                             grid_y)
+            elif self.lon_to_180:
+                grid_x = (grid_x + 180) % 360 - 180
+            # pylint: disable=import-outside-toplevel
+            from .regrid import _apply_affine
+            cols, rows = _apply_affine(~self.affine, grid_x, grid_y)
+            # index 0 at the center of the first cell
+            rows, cols = rows - 0.5, cols - 0.5
+        else:
+            lon, lat = x_coords, y_coords
+            if projection is not None:
+                # pylint: disable=import-outside-toplevel
+                from .transform import transform_points
+                lon, lat = transform_points(projection, 'epsg:4326',
+                                            lon, lat)
+            rows, cols = self._tree_indices(lon, lat)
+
+        rows, cols, weights, valid = \
+            _point_weights(rows, cols, (self.y_size, self.x_size), method)
+        if self.y_inverted:
+            rows = self.y_size - 1 - rows
+
+        indexers = {
+            self.y_dim: xr.Variable(('point', 'corner'), rows),
+            self.x_dim: xr.Variable(('point', 'corner'), cols),
+        }
+        weights = xr.DataArray(weights, dims=('point', 'corner'))
+        var = self._obj[variable].variable
+
+        def read_points(var_chunk):
+            """read and interpolate the values at all points"""
+            values = xr.DataArray(var_chunk.isel(indexers))
+            return (values * weights).sum(dim='corner', min_count=1) / \
+                weights.where(values.notnull()).sum(dim='corner')
+
+        if time_chunk_size is None or self.time_dim not in var.dims:
+            data = read_points(var)
+        else:
+            num_times = var.sizes[self.time_dim]
+            data = xr.concat(
+                [read_points(var.isel({self.time_dim: slice(
+                    start, start + time_chunk_size)})).load()
+                 for start in range(0, num_times, time_chunk_size)],
+                dim=self.time_dim)
+
+        data = data.where(xr.DataArray(valid, dims=('point',)))
+        data.name = variable
+        data.attrs = dict(self._obj[variable].attrs)
+        if self.time_dim in data.dims:
+            data[self.time_var] = self._obj[self.time_var]
+        data.coords['x'] = ('point', x_coords)
+        data.coords['y'] = ('point', y_coords)
+        return data
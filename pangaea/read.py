@@ -10,11 +10,162 @@
     This module provides helper functions to read in
     land surface model datasets.
 """
+from bisect import bisect_right
+from datetime import datetime
+from glob import glob
+import json
+from multiprocessing.pool import ThreadPool
+import os
+import re
+import time
+
 import numpy as np
 import pandas as pd
 import xarray as xr
 
+from .catalog import LSMCatalog, file_signature, variable_info
+from .log import count, metrics_enabled, LOGGER, Timer
+
+# attribute with the accessor settings in exported datasets
+LSM_STATE_ATTR = 'pangaea_lsm'
+# attribute with the paths and signatures of the files in a Zarr store
+LSM_SOURCES_ATTR = 'pangaea_sources'
+
+
+def _expand_paths(paths):
+    """Get sorted list of paths from path with wildcard."""
+    if not isinstance(paths, (list, tuple)):
+        paths = sorted(glob(paths))
+    if not paths:
+        raise IOError('no files to open')
+    return list(paths)
 
+
+# regular expressions for the datetime format directives
+_TIME_FORMAT_REGEX = {
+    '%Y': r'\d{4}',
+    '%y': r'\d{2}',
+    '%m': r'\d{2}',
+    '%d': r'\d{2}',
+    '%j': r'\d{3}',
+    '%H': r'\d{2}',
+    '%M': r'\d{2}',
+    '%S': r'\d{2}',
+}
+
+
+def _file_time_from_name(path, filename_time_format):
+    """Get the time from the file name using the datetime format.
+    Returns None if the file name does not match the format."""
+    pattern = ''.join(
+        _TIME_FORMAT_REGEX.get(part, re.escape(part))
+        for part in re.split(r'(%[a-zA-Z])', filename_time_format)
+    )
+    match = re.search(pattern, os.path.basename(path))
+    if match is None:
+        return None
+    return pd.Timestamp(datetime.strptime(match.group(0),
+                                          filename_time_format))
+
+
+def _prune_paths_by_name(paths, filename_time_format,
+                         start_time=None, end_time=None):
+    """Remove files outside of the time window based on the time in
+    the file name. Each file is assumed to contain data until the
+    time of the next file."""
+    file_times = [_file_time_from_name(path, filename_time_format)
+                  for path in paths]
+    unique_times = sorted(set(file_time for file_time in file_times
+                              if file_time is not None))
+    pruned_paths = []
+    for path, file_time in zip(paths, file_times):
+        if file_time is not None:
+            if end_time is not None and file_time > end_time:
+                continue
+            next_index = bisect_right(unique_times, file_time)
+            if start_time is not None \
+                    and next_index < len(unique_times) \
+                    and unique_times[next_index] <= start_time:
+                continue
+        pruned_paths.append(path)
+    return pruned_paths
+
+
+def _open_datasets_parallel(paths, preprocess, time_dim,
+                            engine=None, autoclose=True, n_workers=None):
+    """Open the metadata of each file in a thread pool and
+    concatenate the datasets along the time dimension.
+    The preprocess function is called with the dataset and path."""
+    def open_dataset(path):
+        """open lazily and preprocess dataset"""
+        return preprocess(xr.open_dataset(path,
+                                          engine=engine,
+                                          autoclose=autoclose,
+                                          chunks={}),
+                          path)
+
+    open_start = time.time()
+    pool = ThreadPool(n_workers)
+    try:
+        datasets = pool.map(open_dataset, paths)
+    finally:
+        pool.close()
+        pool.join()
+    count('files_opened', len(paths))
+
+    xds = _concat_datasets(datasets, time_dim)
+    LOGGER.debug("Opened %s files in %.3f seconds",
+                 len(paths), time.time() - open_start)
+    return xds
+
+
+class _DatasetsCloser(object):
+    """Close the datasets of each file (xarray without `set_close`)."""
+    def __init__(self, datasets):
+        self.datasets = datasets
+
+    def close(self):
+        """close the dataset of each file"""
+        for dataset in self.datasets:
+            dataset.close()
+
+
+def _close_with(xds, datasets):
+    """Close the datasets of each file when
+    the combined dataset is closed."""
+    closer = _DatasetsCloser(datasets)
+    if hasattr(xds, 'set_close'):
+        xds.set_close(closer.close)
+    else:
+        # pylint: disable=protected-access
+        xds._file_obj = closer
+    return xds
+
+
+def _static_coords(xds, time_dim):
+    """Get the coordinates that are identical in each file."""
+    return [name for name, coord in xds.coords.items()
+            if time_dim not in coord.dims and coord.ndim > 0]
+
+
+def _concat_datasets(datasets, time_dim):
+    """Concatenate the datasets of each file along the time dimension.
+    Coordinates without the time dimension are identical in each file,
+    so they are only used from the first dataset. Scalar coordinates
+    (Ex. the HRRR 'initial_time') are concatenated. The files are
+    closed when the concatenated dataset is closed."""
+    static_coords = _static_coords(datasets[0], time_dim)
+    scalar_coords = [name for name, coord in datasets[0].coords.items()
+                     if coord.ndim == 0 and name != time_dim]
+    xds = xr.concat(datasets[:1] + [
+        dataset.drop([name for name in static_coords
+                      if name in dataset.variables])
+        for dataset in datasets[1:]
+    ], dim=time_dim, coords=scalar_coords)
+    return _close_with(xds, datasets)
+
+
+@Timer('open_mfdataset')
 def open_mfdataset(path_to_lsm_files,
                    lat_var,
                    lon_var,
@@ -26,7 +177,14 @@ def open_mfdataset(path_to_lsm_files,
                    coords_projected=False,
                    loader=None,
                    engine=None,
-                   autoclose=True):
+                   autoclose=True,
+                   parallel=False,
+                   n_workers=None,
+                   catalog=None,
+                   start_time=None,
+                   end_time=None,
+                   filename_time_format=None,
+                   time_format=None):
     """
     Wrapper to open land surface model netcdf files
     using :func:`xarray.open_mfdataset`.
@@ -64,6 +222,37 @@ def open_mfdataset(path_to_lsm_files,
     autoclose: :obj:`str`, optional, default=True
         If True, will use autoclose option with
         :func:`xarray.open_mfdataset`.
+    parallel: bool, optional, default=False
+        If True, the files are opened in a thread pool reading only
+        the metadata and time values from each file. Coordinates
+        without a time dimension are only read from the first file.
+        The time to open the files is logged at the DEBUG level.
+    n_workers: int, optional
+        Number of threads to open files with if `parallel` is True.
+        Default is the number of CPUs.
+    catalog: :obj:`str`, optional
+        Path to a JSON catalog file (see :func:`pangaea.catalog.LSMCatalog`)
+        with the time values of each file. It is created if it does not
+        exist and only new or changed files are scanned to update it.
+        The time values and variables are then read from the catalog,
+        so only the first file is opened and the other files are read
+        when the data is computed.
+    start_time: :obj:`str` or :obj:`datetime.datetime`, optional
+        If set, only files with data after this time are opened
+        and the dataset is subset to start at this time.
+    end_time: :obj:`str` or :obj:`datetime.datetime`, optional
+        If set, only files with data before this time are opened
+        and the dataset is subset to end at this time.
+    filename_time_format: :obj:`str`, optional
+        Datetime format of the time in the file names
+        (Ex. 'era5_gssha_%Y%m%d'). If set, the files outside of the
+        `start_time` and `end_time` window are removed based on the
+        file names before opening. Each file is assumed to contain the
+        data until the time of the next file. Otherwise, the time values
+        from the `catalog` are used if available.
+    time_format: :obj:`str`, optional
+        Datetime format of the time strings (Ex. '%Y-%m-%d_%H:%M:%S').
+        Default is to infer the format.
 
     Returns
     -------
@@ -100,8 +289,10 @@ def open_mfdataset(path_to_lsm_files,
         """xarray loader for HRRR"""
         for var in xds.variables:
             if 'initial_time' in xds[var].attrs.keys():
-                grid_time = pd.to_datetime(xds[var].attrs['initial_time'],
-                                           format="%m/%d/%Y (%H:%M)")
+                initial_time = \
+                    pd.to_datetime(xds[var].attrs['initial_time'],
+                                   format="%m/%d/%Y (%H:%M)")
+                grid_time = initial_time
                 if 'forecast_time' in xds[var].attrs.keys():
                     time_units = 'h'
                     if 'forecast_time_units' in xds[var].attrs.keys():
@@ -110,7 +301,8 @@ def open_mfdataset(path_to_lsm_files,
                     time_dt = int(xds[var].attrs['forecast_time'][0])
                     grid_time += np.timedelta64(time_dt, time_units)
 
-                return xds.assign(time=grid_time)
+                return xds.assign(time=grid_time) \
+                    .assign_coords(initial_time=initial_time)
         return xds
 
     if loader == 'hrrr':
@@ -119,19 +311,99 @@ def open_mfdataset(path_to_lsm_files,
     else:
         preprocess = define_coords
 
-    xds = xr.open_mfdataset(path_to_lsm_files,
-                            autoclose=autoclose,
-                            preprocess=preprocess,
-                            concat_dim=time_dim,
-                            engine=engine,
-                            )
-    xds.lsm.y_var = lat_var
-    xds.lsm.x_var = lon_var
-    xds.lsm.y_dim = lat_dim
-    xds.lsm.x_dim = lon_dim
-    xds.lsm.lon_to_180 = lon_to_180
-    xds.lsm.coords_projected = coords_projected
+    if start_time is not None:
+        start_time = pd.Timestamp(start_time)
+    if end_time is not None:
+        end_time = pd.Timestamp(end_time)
+    subset_time = start_time is not None or end_time is not None
+
+    paths = path_to_lsm_files
+    if subset_time or parallel or catalog is not None:
+        paths = _expand_paths(path_to_lsm_files)
+    if subset_time and filename_time_format is not None:
+        paths = _prune_paths_by_name(paths, filename_time_format,
+                                     start_time, end_time)
+
+    if catalog is not None:
+        lsm_catalog = LSMCatalog(catalog)
 
+        def scan_file(path):
+            """read file information for catalog"""
+            with xr.open_dataset(path, engine=engine) as xds:
+                xds = preprocess(xds)
+                variables = variable_info(xds)
+                xds.lsm.time_var = time_var
+                xds.lsm.time_format = time_format
+                xds.lsm.to_datetime()
+                return {
+                    'time': np.atleast_1d(xds[time_var].values),
+                    'variables': variables,
+                }
+
+        if lsm_catalog.update(paths, scan_file, n_workers):
+            lsm_catalog.save()
+
+        if subset_time:
+            paths = [path for path in paths
+                     if lsm_catalog.overlaps(path, start_time, end_time)]
+
+    if subset_time and not paths:
+        raise IOError('no files to open between {0} and {1}'
+                      .format(start_time, end_time))
+
+    if catalog is not None:
+        def open_file(path, chunks=None):
+            """open and preprocess file"""
+            return preprocess(xr.open_dataset(path,
+                                              engine=engine,
+                                              autoclose=autoclose,
+                                              chunks=chunks))
+
+        def catalog_times(xds, path):
+            """use time values from the catalog"""
+            times = lsm_catalog.times(path)
+            if loader == 'hrrr':
+                return xds.assign(time=times[0])
+            return xds.assign_coords(**{
+                time_var: (lsm_catalog.variables(path)[time_var]['dims'],
+                           times)
+            })
+
+        # only the first file is opened for the attributes and
+        # the coordinates, the other files are read when computed
+        open_start = time.time()
+        count('files_opened')
+        first_xds = catalog_times(open_file(paths[0], chunks={}), paths[0])
+        drop_variables = [time_var] + _static_coords(first_xds, time_dim)
+        xds = _concat_datasets(
+            [first_xds] + [
+                catalog_times(lsm_catalog.lazy_dataset(path, open_file,
+                                                       drop_variables),
+                              path)
+                for path in paths[1:]
+            ],
+            time_dim,
+        )
+        LOGGER.debug("Opened %s files from the catalog in %.3f seconds",
+                     len(paths), time.time() - open_start)
+    elif parallel:
+        xds = _open_datasets_parallel(
+            paths,
+            preprocess=lambda xds, path: preprocess(xds),
+            time_dim=time_dim,
+            engine=engine,
+            autoclose=autoclose,
+            n_workers=n_workers,
+        )
+    else:
+        if metrics_enabled():
+            count('files_opened', len(_expand_paths(paths)))
+        xds = xr.open_mfdataset(paths,
+                                autoclose=autoclose,
+                                preprocess=preprocess,
+                                concat_dim=time_dim,
+                                engine=engine,
+                                )
     # make sure time dimensions are same for slicing
     xds.rename(
         {
@@ -141,5 +413,244 @@ def open_mfdataset(path_to_lsm_files,
         inplace=True
     )
 
+    xds.lsm.time_format = time_format
     xds.lsm.to_datetime()
+    if subset_time:
+        xds = _close_with(xds.sel(time=slice(start_time, end_time)), [xds])
+
+    xds.lsm.y_var = lat_var
+    xds.lsm.x_var = lon_var
+    xds.lsm.y_dim = lat_dim
+    xds.lsm.x_dim = lon_dim
+    xds.lsm.lon_to_180 = lon_to_180
+    xds.lsm.coords_projected = coords_projected
+    xds.lsm.time_format = time_format
     return xds
+
+
+def _lsm_state(xds):
+    """:obj:`dict`: Settings of the accessor to restore the dataset."""
+    return {
+        'y_var': xds.lsm.y_var,
+        'x_var': xds.lsm.x_var,
+        'time_var': xds.lsm.time_var,
+        'y_dim': xds.lsm.y_dim,
+        'x_dim': xds.lsm.x_dim,
+        'time_dim': xds.lsm.time_dim,
+        'lon_to_180': bool(xds.lsm.lon_to_180),
+        'coords_projected': bool(xds.lsm.coords_projected),
+    }
+
+
+def _normalized_dataset(xds, variables=None):
+    """Get the dataset with the grids from North to South and the
+    projection, geotransform, and accessor settings in the
+    attributes."""
+    lsm = xds.lsm
+    lsm_state = _lsm_state(xds)
+    if variables is not None:
+        xds = xds[list(variables)]
+    if lsm.y_inverted:
+        xds = xds.isel({lsm.y_dim: slice(None, None, -1)})
+    else:
+        xds = xds.copy()
+    attrs = dict(xds.attrs)
+    # the WRF latitude/longitude are always assumed to be upside down
+    attrs.pop('MAP_PROJ', None)
+    attrs['proj4'] = lsm.projection.ExportToProj4()
+    attrs['geotransform'] = [float(g) for g in lsm.geotransform]
+    attrs[LSM_STATE_ATTR] = json.dumps(lsm_state, sort_keys=True)
+    xds.attrs = attrs
+    # remove the encoding from the original files
+    for var in xds.variables.values():
+        var.encoding = {}
+    return xds
+
+
+def write_zarr(xds, store, variables=None, chunks=None,
+               compressor=None, mode='w-', append=False):
+    """
+    Write a land surface model dataset to a Zarr store
+    (see :func:`pangaea.LSMGridReader.to_zarr`).
+
+    Parameters
+    ----------
+    xds: :func:`xarray.Dataset`
+        Dataset with the :func:`pangaea.LSMGridReader` settings.
+    store: :obj:`str` or MutableMapping
+        Path to or Zarr store to write to.
+    """
+    time_dim = xds.lsm.time_dim
+    if chunks is None:
+        chunks = {time_dim: 1}
+    xds = _normalized_dataset(xds, variables)
+    if append:
+        with xr.open_zarr(store) as zarr_xds:
+            existing_times = zarr_xds[time_dim].values
+        xds = xds.drop([name for name, var in xds.variables.items()
+                        if time_dim not in var.dims])
+        new_times = ~np.isin(xds[time_dim].values, existing_times)
+        xds = xds.isel({time_dim: new_times})
+        if not xds.sizes[time_dim]:
+            return
+        xds.chunk(chunks).to_zarr(store, mode='a', append_dim=time_dim)
+        return
+
+    encoding = {}
+    if compressor is not None:
+        encoding = {name: {'compressor': compressor}
+                    for name in xds.data_vars}
+    xds.chunk(chunks).to_zarr(store, mode=mode, encoding=encoding)
+
+
+@Timer('open_zarr')
+def open_zarr(store, **kwargs):
+    """
+    Open a land surface model dataset written with
+    :func:`pangaea.LSMGridReader.to_zarr` and restore
+    the settings of the :func:`pangaea.LSMGridReader` accessor.
+
+    Parameters
+    ----------
+    store: :obj:`str` or MutableMapping
+        Path to or Zarr store to read from.
+    **kwargs:
+        Keyword arguments for :func:`xarray.open_zarr`.
+
+    Returns
+    -------
+    :func:`xarray.Dataset`
+
+
+    Read Zarr store with pangaea example::
+
+        import pangaea as pa
+
+        with pa.open_zarr('/path/to/store.zarr') as xds:
+            print(xds.lsm.projection)
+    """
+    xds = xr.open_zarr(store, **kwargs)
+    if LSM_STATE_ATTR not in xds.attrs:
+        raise ValueError("The store was not written "
+                         "with pangaea ...")
+    for attr, value in json.loads(xds.attrs[LSM_STATE_ATTR]).items():
+        setattr(xds.lsm, attr, value)
+    return xds
+
+
+@Timer('append_zarr')
+def append_zarr(path_to_lsm_files,
+                store,
+                lat_var,
+                lon_var,
+                time_var,
+                lat_dim,
+                lon_dim,
+                time_dim,
+                variables=None,
+                chunks=None,
+                compressor=None,
+                **kwargs):
+    """
+    Ingest the land surface model files that are not in the Zarr store
+    yet (see :func:`pangaea.LSMGridReader.to_zarr`). The new files are
+    opened and normalized with :func:`pangaea.open_mfdataset` and
+    appended along the time dimension. The store is created if it does
+    not exist. The paths and the modification time and size of the
+    ingested files are stored in the attributes of the store, so running
+    it again with the same files does not change the store. Ingested
+    files that changed since are rejected, as their time steps are
+    already in the store.
+
+    Parameters
+    ----------
+    path_to_lsm_files: :obj:`str` or :obj:`list`
+        Path to land surface model files with wildcard.
+        (Ex. '/path/to/files/*.nc')
+    store: :obj:`str`
+        Path to the Zarr store.
+    lat_var: :obj:`str`
+        Latitude variable (Ex. lat).
+    lon_var: :obj:`str`
+        Longitude variable (Ex. lon).
+    time_var: :obj:`str`
+        Time variable (Ex. time).
+    lat_dim: :obj:`str`
+        Latitude dimension (Ex. lat).
+    lon_dim: :obj:`str`
+        Longitude dimension (Ex. lon).
+    time_dim: :obj:`str`
+        Time dimension (ex. time).
+    variables: :obj:`list`, optional
+        Names of the variables to write. Default is all variables.
+    chunks: :obj:`dict`, optional
+        Chunk size for each dimension. Default is
+        one time step per chunk.
+    compressor: :func:`numcodecs.abc.Codec`, optional
+        Compressor for the variables when the store is created.
+    **kwargs:
+        Keyword arguments for :func:`pangaea.open_mfdataset`
+        (Ex. loader='hrrr').
+
+    Returns
+    -------
+    :obj:`list`
+        The paths of the files that were ingested.
+
+    Raises
+    ------
+    ValueError
+        If files in the store changed since they were ingested.
+
+
+    Append to Zarr store with pangaea example::
+
+        import pangaea as pa
+
+        pa.append_zarr('/path/to/hrrr/*.grib2',
+                       '/path/to/hrrr.zarr',
+                       lat_var='gridlat_0',
+                       lon_var='gridlon_0',
+                       time_var='time',
+                       lat_dim='ygrid_0',
+                       lon_dim='xgrid_0',
+                       time_dim='time',
+                       loader='hrrr')
+    """
+    paths = [os.path.abspath(path)
+             for path in _expand_paths(path_to_lsm_files)]
+    store_exists = os.path.exists(store)
+    sources = {}
+    if store_exists:
+        with xr.open_zarr(store) as zarr_xds:
+            sources = json.loads(zarr_xds.attrs.get(LSM_SOURCES_ATTR, '{}'))
+    if isinstance(sources, list):
+        # stores written without the file signatures
+        sources = dict((path, None) for path in sources)
+    signatures = dict((path, file_signature(path)) for path in paths)
+    changed_paths = [path for path in paths
+                     if sources.get(path) is not None and
+                     sources[path] != signatures[path]]
+    if changed_paths:
+        raise ValueError("Files changed since they were ingested "
+                         "into the store: {0}".format(changed_paths))
+    new_paths = [path for path in paths if path not in sources]
+    if not new_paths:
+        return []
+
+    with open_mfdataset(new_paths,
+                        lat_var=lat_var,
+                        lon_var=lon_var,
+                        time_var=time_var,
+                        lat_dim=lat_dim,
+                        lon_dim=lon_dim,
+                        time_dim=time_dim,
+                        **kwargs) as xds:
+        sources.update((path, signatures[path]) for path in new_paths)
+        xds.attrs[LSM_SOURCES_ATTR] = json.dumps(sources, sort_keys=True)
+        xds.lsm.to_zarr(store,
+                        variables=variables,
+                        chunks=chunks,
+                        compressor=compressor,
+                        append=store_exists)
+    return new_paths
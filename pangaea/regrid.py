@@ -0,0 +1,374 @@
+# -*- coding: utf-8 -*-
+#
+#  regrid.py
+#  pangaea
+#
+#  Author : Alan D Snow, 2017.
+#  License: BSD 3-Clause
+"""pangaea.regrid
+
+    This module provides reusable sparse regridding weights
+    to map data from one grid to another.
+"""
+import hashlib
+import json
+import os
+
+from affine import Affine
+import numpy as np
+from osgeo import osr
+from scipy import sparse
+
+from .log import count
+from .transform import transform_points
+from .warp import grid_from_definition, map_bands
+
+REGRID_METHODS = ('nearest', 'bilinear', 'average')
+
+
+def _wkt_to_proj4(wkt_projection):
+    """Convert WKT projection to proj4 string."""
+    sp_ref = osr.SpatialReference()
+    sp_ref.ImportFromWkt(wkt_projection)
+    return sp_ref.ExportToProj4()
+
+
+def _apply_affine(affine, x_coords, y_coords):
+    """Apply affine transformation to arrays of coordinates."""
+    return (affine.a * x_coords + affine.b * y_coords + affine.c,
+            affine.d * x_coords + affine.e * y_coords + affine.f)
+
+
+def _save_weights(file_path, weights, info):
+    """Write sparse weights and the JSON serializable info to a file."""
+    with open(file_path, 'wb') as npz_file:
+        np.savez(npz_file,
+                 data=weights.data,
+                 indices=weights.indices,
+                 indptr=weights.indptr,
+                 shape=np.array(weights.shape),
+                 info=np.array(json.dumps(info)))
+
+
+def _load_weights(file_path):
+    """Load sparse weights and the info from a file."""
+    with np.load(file_path) as npz_file:
+        weights = sparse.csr_matrix((npz_file['data'],
+                                     npz_file['indices'],
+                                     npz_file['indptr']),
+                                    shape=tuple(npz_file['shape']))
+        info = json.loads(str(npz_file['info']))
+    return weights, info
+
+
+def _same_grid(grid_def, other_def):
+    """Check if two grid definitions describe the same grid."""
+    sp_ref = osr.SpatialReference()
+    sp_ref.ImportFromWkt(grid_def['wkt'])
+    other_sp_ref = osr.SpatialReference()
+    other_sp_ref.ImportFromWkt(other_def['wkt'])
+    return (list(grid_def['shape']) == list(other_def['shape']) and
+            np.allclose(grid_def['geotransform'],
+                        other_def['geotransform']) and
+            bool(sp_ref.IsSame(other_sp_ref)))
+
+
+def _calculate_weights(src_def, dst_def, method, supersample):
+    """Calculate the sparse weight matrix from the source
+    grid cells to the destination grid cells."""
+    src_y_size, src_x_size = src_def['shape']
+    dst_y_size, dst_x_size = dst_def['shape']
+    num_dst = dst_y_size * dst_x_size
+
+    if method != 'average':
+        supersample = 1
+    # sample locations within each destination cell
+    offsets = (np.arange(supersample) + 0.5) / float(supersample)
+    dst_cols = (np.arange(dst_x_size)[:, None] + offsets).ravel()
+    dst_rows = (np.arange(dst_y_size)[:, None] + offsets).ravel()
+    dst_cols, dst_rows = np.meshgrid(dst_cols, dst_rows)
+    dst_index = (
+        (dst_rows.astype(np.int64) * dst_x_size) +
+        dst_cols.astype(np.int64)
+    ).ravel()
+
+    # destination pixel -> destination coordinate -> source pixel
+    x_coords, y_coords = _apply_affine(
+        Affine.from_gdal(*dst_def['geotransform']),
+        dst_cols.ravel(), dst_rows.ravel())
+    x_coords, y_coords = transform_points(_wkt_to_proj4(dst_def['wkt']),
+                                          _wkt_to_proj4(src_def['wkt']),
+                                          x_coords, y_coords)
+    src_cols, src_rows = _apply_affine(
+        ~Affine.from_gdal(*src_def['geotransform']),
+        x_coords, y_coords)
+
+    if method == 'bilinear':
+        # only use points inside of the source grid; points between
+        # the outer cell centers and the grid edge use the edge values
+        valid = np.tile((src_cols >= 0) & (src_cols < src_x_size) &
+                        (src_rows >= 0) & (src_rows < src_y_size), 4)
+        # weights from the surrounding source cell centers
+        src_cols = src_cols - 0.5
+        src_rows = src_rows - 0.5
+        col_0 = np.floor(src_cols)
+        row_0 = np.floor(src_rows)
+        col_frac = src_cols - col_0
+        row_frac = src_rows - row_0
+        col_0 = col_0.astype(np.int64)
+        row_0 = row_0.astype(np.int64)
+        dst_index = np.tile(dst_index, 4)
+        src_cols = np.concatenate([np.clip(col_0, 0, src_x_size - 1),
+                                   np.clip(col_0 + 1, 0, src_x_size - 1),
+                                   np.clip(col_0, 0, src_x_size - 1),
+                                   np.clip(col_0 + 1, 0, src_x_size - 1)])
+        src_rows = np.concatenate([np.clip(row_0, 0, src_y_size - 1),
+                                   np.clip(row_0, 0, src_y_size - 1),
+                                   np.clip(row_0 + 1, 0, src_y_size - 1),
+                                   np.clip(row_0 + 1, 0, src_y_size - 1)])
+        weights = np.concatenate([(1 - col_frac) * (1 - row_frac),
+                                  col_frac * (1 - row_frac),
+                                  (1 - col_frac) * row_frac,
+                                  col_frac * row_frac])
+    else:
+        src_cols = np.floor(src_cols)
+        src_rows = np.floor(src_rows)
+        valid = ((src_cols >= 0) & (src_cols < src_x_size) &
+                 (src_rows >= 0) & (src_rows < src_y_size))
+        src_cols = np.where(valid, src_cols, 0).astype(np.int64)
+        src_rows = np.where(valid, src_rows, 0).astype(np.int64)
+        weights = np.ones(src_cols.shape, dtype=np.float64)
+
+    weights = sparse.coo_matrix(
+        (weights[valid],
+         (dst_index[valid],
+          src_rows[valid] * src_x_size + src_cols[valid])),
+        shape=(num_dst, src_y_size * src_x_size)
+    ).tocsr()
+    weights.sum_duplicates()
+
+    # normalize the weights for each destination cell
+    row_sums = np.asarray(weights.sum(axis=1)).ravel()
+    row_sums[row_sums == 0] = 1.0
+    return sparse.diags(1.0 / row_sums).dot(weights).tocsr()
+
+
+class Regridder(object):
+    """
+    Sparse interpolation weights to regrid data from a source
+    grid to a destination grid. The weights are computed once and
+    can be applied to any number of time steps.
+
+    Parameters
+    ----------
+    weights: :func:`scipy.sparse.csr_matrix`
+        Weights with shape (destination cells, source cells).
+    src_def: :obj:`dict`
+        Source grid definition (see :func:`grid_definition`).
+    dst_def: :obj:`dict`
+        Destination grid definition (see :func:`grid_definition`).
+    method: :obj:`str`
+        Method used to calculate the weights.
+
+    Regrid with pangaea example::
+
+        import pangaea as pa
+
+        with pa.open_mfdataset('/path/to/ncfiles/*.nc',
+                               lat_var='lat',
+                               lon_var='lon',
+                               time_var='time',
+                               lat_dim='lat',
+                               lon_dim='lon',
+                               time_dim='time') as xds:
+            regridder = xds.lsm.regridder(match_grid='/path/to/grid.tif',
+                                          cache_dir='/path/to/cache')
+            rsd = xds.lsm.resample('tp', match_grid='/path/to/grid.tif',
+                                   regridder=regridder)
+    """
+    def __init__(self, weights, src_def, dst_def, method='average'):
+        self.weights = weights
+        self.src_def = src_def
+        self.dst_def = dst_def
+        self.method = method
+        self._dst_grid = None
+
+    @staticmethod
+    def grid_hash(src_def, dst_def, method='average', supersample=4):
+        """:obj:`str`: Hash of the source and destination grids."""
+        hash_str = json.dumps([src_def, dst_def, method, supersample],
+                              sort_keys=True)
+        return hashlib.sha1(hash_str.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def from_grids(cls, src_def, dst_def, method='average',
+                   supersample=4, cache_dir=None):
+        """Calculate the weights to regrid between grids.
+
+        Parameters
+        ----------
+        src_def: :obj:`dict`
+            Source grid definition (see :func:`grid_definition`).
+        dst_def: :obj:`dict`
+            Destination grid definition (see :func:`grid_definition`).
+        method: :obj:`str`, optional
+            One of 'nearest', 'bilinear', or 'average'.
+            Default is 'average'.
+        supersample: int, optional
+            Number of samples in each direction in a destination cell
+            used to calculate the 'average' weights. Default is 4.
+        cache_dir: :obj:`str`, optional
+            If set, the weights will be loaded from or saved to
+            this directory using a hash of the grid definitions.
+
+        Returns
+        -------
+        :func:`Regridder`
+        """
+        if method not in REGRID_METHODS:
+            raise ValueError("Invalid regrid method: {method}. "
+                             "Valid methods are: {methods}"
+                             .format(method=method,
+                                     methods=REGRID_METHODS))
+
+        cache_file = None
+        if cache_dir is not None:
+            cache_file = os.path.join(
+                cache_dir,
+                "regrid_{0}.npz".format(cls.grid_hash(src_def, dst_def,
+                                                      method, supersample))
+            )
+            if os.path.exists(cache_file):
+                return cls.from_file(cache_file)
+
+        regridder = cls(_calculate_weights(src_def, dst_def,
+                                           method, supersample),
+                        src_def, dst_def, method)
+        if cache_file is not None:
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                pass
+            regridder.to_file(cache_file)
+        return regridder
+
+    @classmethod
+    def from_file(cls, file_path):
+        """Load the regridder from a file.
+
+        Parameters
+        ----------
+        file_path: :obj:`str`
+            Path to the regridder file.
+
+        Returns
+        -------
+        :func:`Regridder`
+        """
+        weights, info = _load_weights(file_path)
+        return cls(weights, info['src'], info['dst'], info['method'])
+
+    def to_file(self, file_path):
+        """Write the regridder to a file.
+
+        Parameters
+        ----------
+        file_path: :obj:`str`
+            Path to the output regridder file (.npz).
+        """
+        _save_weights(file_path, self.weights,
+                      {'src': self.src_def,
+                       'dst': self.dst_def,
+                       'method': self.method})
+
+    def check_grids(self, src_def, dst_def=None):
+        """Check the regridder was created for the grids.
+
+        Parameters
+        ----------
+        src_def: :obj:`dict`
+            Source grid definition (see :func:`grid_definition`).
+        dst_def: :obj:`dict`, optional
+            Destination grid definition (see :func:`grid_definition`).
+
+        Raises
+        ------
+        ValueError
+            If the grid definitions do not match the regridder.
+        """
+        if not _same_grid(self.src_def, src_def):
+            raise ValueError("The source grid does not match "
+                             "the regridder source grid ...")
+        if dst_def is not None and not _same_grid(self.dst_def, dst_def):
+            raise ValueError("The destination grid does not match "
+                             "the regridder destination grid ...")
+
+    @property
+    def dst_grid(self):
+        """:func:`gazar.grid.GDALGrid`: Empty destination grid."""
+        if self._dst_grid is None:
+            self._dst_grid = grid_from_definition(self.dst_def)
+        return self._dst_grid
+
+    def regrid(self, data, fill_value=np.nan):
+        """Regrid data with dimensions (..., y, x).
+
+        .. note:: NaN values in the data are ignored
+            and the weights renormalized.
+
+        Parameters
+        ----------
+        data: :func:`numpy.ndarray`
+            Data on the source grid.
+        fill_value: float, optional
+            Value for destination cells without valid source data.
+            Default is NaN.
+
+        Returns
+        -------
+        :func:`numpy.ndarray`
+            Data on the destination grid.
+        """
+        data = np.asarray(data)
+        src_shape = tuple(self.src_def['shape'])
+        if data.shape[-2:] != src_shape:
+            raise ValueError("Data shape {data_shape} does not match "
+                             "regridder source shape {src_shape}."
+                             .format(data_shape=data.shape[-2:],
+                                     src_shape=src_shape))
+        lead_shape = data.shape[:-2]
+        flat_data = data.reshape((-1, src_shape[0] * src_shape[1])).T
+        invalid = np.isnan(flat_data)
+        if invalid.any():
+            valid = (~invalid).astype(np.float64)
+            new_data = self.weights.dot(np.where(invalid, 0, flat_data))
+            valid_weights = self.weights.dot(valid)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                new_data /= valid_weights
+            new_data[valid_weights <= 0] = fill_value
+        else:
+            new_data = self.weights.dot(flat_data)
+            no_weights = np.diff(self.weights.indptr) == 0
+            new_data[no_weights] = fill_value
+
+        return new_data.T.reshape(lead_shape + tuple(self.dst_def['shape'])) \
+            .astype(np.result_type(data.dtype, np.float32))
+
+    def regrid_bands(self, data_array, band_chunk_size=None):
+        """Regrid a stack of bands with dimensions (band, y, x)
+        in chunks of bands.
+
+        Parameters
+        ----------
+        data_array: :func:`xarray.DataArray` or :func:`numpy.ndarray`
+            3D array with dimensions (band, y, x).
+        band_chunk_size: int, optional
+            Number of bands to regrid at once. Default is all bands.
+
+        Returns
+        -------
+        :func:`numpy.ndarray`
+        """
+        new_data = map_bands(self.regrid, data_array, band_chunk_size)
+        count('bands_regridded', data_array.shape[0])
+        return new_data
@@ -0,0 +1,485 @@
+# -*- coding: utf-8 -*-
+#
+#  temporal.py
+#  pangaea
+#
+#  Author : Alan D Snow, 2017.
+#  License: BSD 3-Clause
+"""pangaea.temporal
+
+    This module provides the de-accumulation and the streaming aggregation
+    and interpolation of stacks of grids along the time dimension with dask
+    for the land surface model accessor (see :class:`pangaea.LSMGridReader`).
+"""
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+from .log import Timer
+
+# variables accumulated over time (WRF & ERA)
+ACCUMULATED_VARIABLES = ('RAINC', 'RAINNC', 'SNOWNC', 'GRAUPELNC',
+                         'tp', 'cp', 'lsp', 'sf', 'ssrd', 'strd',
+                         'ssr', 'str')
+AGGREGATE_METHODS = ('sum', 'mean', 'min', 'max')
+INTERPOLATE_METHODS = ('linear', 'nearest')
+
+
+def _to_nanoseconds(times):
+    """Convert times to integer nanoseconds."""
+    return np.asarray(pd.DatetimeIndex(times).values,
+                      dtype='datetime64[ns]').astype(np.int64)
+
+
+def time_bins(times, freq, closed='left', label='left'):
+    """Get the bins of the time steps.
+
+    Parameters
+    ----------
+    times: :func:`pandas.DatetimeIndex`
+        Increasing time steps.
+    freq: :obj:`str`
+        Frequency of the bins (Ex. '3h' or 'D').
+    closed: :obj:`str`, optional
+        Side of the bin interval that is closed ('left' or 'right').
+        Default is 'left'.
+    label: :obj:`str`, optional
+        Side of the bin interval used as the label ('left' or 'right').
+        Default is 'left'.
+
+    Returns
+    -------
+    :func:`pandas.DatetimeIndex`, :func:`numpy.ndarray`
+        The bin labels and the index of the bin of each time step.
+    """
+    times = pd.DatetimeIndex(times)
+    if closed == 'right':
+        bin_starts = (times - pd.Timedelta(1, unit='ns')).floor(freq)
+    else:
+        bin_starts = times.floor(freq)
+    bin_starts = _to_nanoseconds(bin_starts)
+    if (np.diff(bin_starts) < 0).any():
+        raise ValueError("The time steps need to be increasing ...")
+    bin_starts, bin_index = np.unique(bin_starts, return_inverse=True)
+    labels = pd.to_datetime(bin_starts, unit='ns')
+    if label == 'right':
+        labels = labels + pd.tseries.frequencies.to_offset(freq)
+    return labels, bin_index.ravel()
+
+
+def _bin_starts(bin_index):
+    """Get the index of the first time step of each bin."""
+    return np.flatnonzero(np.r_[True, bin_index[1:] != bin_index[:-1]])
+
+
+def _bin_aligned_chunks(bin_index, time_chunk_size):
+    """Split the time steps into chunks of whole bins with at least
+    time_chunk_size time steps (except for the last chunk)."""
+    chunks = []
+    chunk_start = 0
+    for bin_start in _bin_starts(bin_index)[1:]:
+        if bin_start - chunk_start >= time_chunk_size:
+            chunks.append(int(bin_start - chunk_start))
+            chunk_start = bin_start
+    chunks.append(int(bin_index.size - chunk_start))
+    return tuple(chunks)
+
+
+def reduce_bins(data, bin_index, method):
+    """Reduce the time steps in each bin ignoring NaN values.
+
+    Parameters
+    ----------
+    data: :func:`numpy.ndarray`
+        Array with dimensions (time, ...).
+    bin_index: :func:`numpy.ndarray`
+        Index of the bin of each time step (increasing).
+    method: :obj:`str`
+        One of 'sum', 'mean', 'min', or 'max'.
+
+    Returns
+    -------
+    :func:`numpy.ndarray`
+        Array with dimensions (bin, ...). Bins without
+        valid values are NaN.
+    """
+    starts = _bin_starts(bin_index)
+    valid = ~np.isnan(data)
+    counts = np.add.reduceat(valid, starts, axis=0)
+    if method in ('sum', 'mean'):
+        reduced = np.add.reduceat(np.where(valid, data, 0), starts, axis=0)
+        if method == 'mean':
+            with np.errstate(divide='ignore', invalid='ignore'):
+                reduced = reduced / counts
+    elif method == 'min':
+        reduced = np.minimum.reduceat(np.where(valid, data, np.inf),
+                                      starts, axis=0)
+    elif method == 'max':
+        reduced = np.maximum.reduceat(np.where(valid, data, -np.inf),
+                                      starts, axis=0)
+    else:
+        raise ValueError("Invalid aggregation method: {method}. "
+                         "Valid methods are: {methods}"
+                         .format(method=method, methods=AGGREGATE_METHODS))
+    reduced = reduced.astype(np.result_type(data.dtype, np.float32))
+    reduced[counts == 0] = np.nan
+    return reduced
+
+
+def aggregate_bins(data, bin_index, method, time_chunk_size=None):
+    """Lazily reduce the time steps in each bin. The time chunks are
+    aligned to the bins, so each chunk is reduced independently.
+
+    Parameters
+    ----------
+    data: :func:`dask.array.Array`
+        Array with dimensions (time, ...).
+    bin_index: :func:`numpy.ndarray`
+        Index of the bin of each time step (increasing).
+    method: :obj:`str`
+        One of 'sum', 'mean', 'min', or 'max'.
+    time_chunk_size: int, optional
+        Minimum number of time steps in a chunk.
+        Default is the largest time chunk of the data.
+
+    Returns
+    -------
+    :func:`dask.array.Array`
+        Array with dimensions (bin, ...).
+    """
+    if method not in AGGREGATE_METHODS:
+        raise ValueError("Invalid aggregation method: {method}. "
+                         "Valid methods are: {methods}"
+                         .format(method=method, methods=AGGREGATE_METHODS))
+    time_chunks = _bin_aligned_chunks(bin_index, time_chunk_size or
+                                      max(data.chunks[0]))
+    data = data.rechunk((time_chunks,) + data.chunks[1:])
+    offsets = np.cumsum((0,) + time_chunks)
+    bin_chunks = tuple(int(np.unique(bin_index[start:end]).size)
+                       for start, end in zip(offsets[:-1], offsets[1:]))
+
+    def reduce_block(block, block_info=None):
+        """reduce the bins in a block of time steps"""
+        time_block = block_info[0]['chunk-location'][0]
+        return reduce_bins(block,
+                           bin_index[offsets[time_block]:
+                                     offsets[time_block + 1]],
+                           method)
+
+    return data.map_blocks(reduce_block,
+                           chunks=(bin_chunks,) + data.chunks[1:],
+                           dtype=np.result_type(data.dtype, np.float32))
+
+
+def interpolation_indices(src_times, dst_times, method='linear'):
+    """Get the time steps and weights to interpolate in time.
+
+    Parameters
+    ----------
+    src_times: :func:`pandas.DatetimeIndex`
+        Increasing time steps of the data.
+    dst_times: :func:`pandas.DatetimeIndex`
+        Time steps to interpolate to.
+    method: :obj:`str`, optional
+        One of 'linear' or 'nearest'. Default is 'linear'.
+
+    Returns
+    -------
+    :func:`numpy.ndarray`, :func:`numpy.ndarray`, :func:`numpy.ndarray`
+        The time steps before and after each time and the
+        weight of the time step after.
+    """
+    if method not in INTERPOLATE_METHODS:
+        raise ValueError("Invalid interpolation method: {method}. "
+                         "Valid methods are: {methods}"
+                         .format(method=method,
+                                 methods=INTERPOLATE_METHODS))
+    src_times = _to_nanoseconds(src_times)
+    # relative to the first time step to keep the precision
+    dst_times = (_to_nanoseconds(dst_times) - src_times[0]) \
+        .astype(np.float64)
+    src_times = (src_times - src_times[0]).astype(np.float64)
+    if (dst_times < src_times[0]).any() or (dst_times > src_times[-1]).any():
+        raise ValueError("The times to interpolate to need to be "
+                         "within the time steps of the data ...")
+    upper = np.searchsorted(src_times, dst_times, side='right')
+    upper = np.clip(upper, 1, max(src_times.size - 1, 1))
+    lower = upper - 1
+    upper = np.minimum(upper, src_times.size - 1)
+    interval = src_times[upper] - src_times[lower]
+    interval[interval == 0] = 1
+    weights = np.clip((dst_times - src_times[lower]) / interval, 0, 1)
+    if method == 'nearest':
+        lower = np.where(weights > 0.5, upper, lower)
+        upper = lower
+        weights = np.zeros(weights.shape)
+    return lower, upper, weights
+
+
+def interpolate_steps(data, lower, upper, weights):
+    """Lazily interpolate between time steps. The time steps are
+    selected in order, so each output chunk only reads the time steps
+    from the matching input chunk and the next time step.
+
+    Parameters
+    ----------
+    data: :func:`dask.array.Array`
+        Array with dimensions (time, ...).
+    lower: :func:`numpy.ndarray`
+        Time step before each time.
+    upper: :func:`numpy.ndarray`
+        Time step after each time.
+    weights: :func:`numpy.ndarray`
+        Weight of the time step after each time.
+
+    Returns
+    -------
+    :func:`dask.array.Array`
+        Array with dimensions (time, ...).
+    """
+    # pylint: disable=import-outside-toplevel
+    import dask.array as da
+    weights = weights.reshape((-1,) + (1,) * (data.ndim - 1))
+    lower_data = data[lower]
+    if (weights == 0).all():
+        return lower_data.astype(np.result_type(data.dtype, np.float32))
+    upper_data = data[upper]
+    # use the time step directly when it matches to avoid NaN
+    # values in the other time step
+    return da.where(weights == 0, lower_data,
+                    da.where(weights == 1, upper_data,
+                             lower_data +
+                             (upper_data - lower_data) * weights))
+
+
+class TemporalMixin(object):
+    """
+    De-accumulation, aggregation, and interpolation in time
+    of the :class:`pangaea.LSMGridReader` accessor.
+    """
+    def _detect_resets(self, data):
+        """Get the time steps where most of the grid cells drop or the
+        previous time step has no values. The flags are reduced lazily
+        one chunk at a time with the data."""
+        spatial_dims = [dim for dim in data.dims if dim != self.time_dim]
+        previous_data = data.shift({self.time_dim: 1})
+        # ignore differences from rounding the stored values
+        # (Ex. int16 packed with a scale factor in each file)
+        encoding = data.encoding
+        if 'scale_factor' not in encoding and data.name in self._obj:
+            encoding = self._obj[data.name].encoding
+        precision = abs(float(encoding.get('scale_factor', 0)))
+        tolerance = (1e-6 * abs(previous_data)).clip(min=precision)
+        drops = ((previous_data - data) > tolerance).sum(spatial_dims)
+        valid = (data.notnull() & previous_data.notnull()).sum(spatial_dims)
+        no_data = previous_data.isnull().all(spatial_dims)
+        return (drops > 0.5 * valid) | no_data
+
+    def _accumulation_resets(self, data, accumulation_reset=None):
+        """Get the time steps where the accumulation restarts."""
+        num_times = self._obj.sizes[self.time_dim]
+        resets = np.zeros(num_times, dtype=bool)
+        resets[:1] = True
+        if accumulation_reset is None:
+            initial_time = self._obj.coords.get('initial_time')
+            if initial_time is None or \
+                    initial_time.dims != (self.time_dim,):
+                raise ValueError("Need 'accumulation_reset' to "
+                                 "de-accumulate without the 'initial_time' "
+                                 "coordinate ...")
+            initial_time = initial_time.values
+            resets[1:] |= initial_time[1:] != initial_time[:-1]
+        elif isinstance(accumulation_reset, str) and \
+                accumulation_reset == 'detect':
+            return self._detect_resets(data) | \
+                xr.DataArray(resets, dims=(self.time_dim,))
+        elif isinstance(accumulation_reset, (str, pd.DateOffset,
+                                             pd.Timedelta)):
+            # steps at the end of the cycle belong to the cycle
+            cycles = (self.datetime - pd.Timedelta(1, unit='ns')) \
+                .floor(accumulation_reset)
+            resets[1:] |= cycles[1:] != cycles[:-1]
+        else:
+            resets |= np.asarray(accumulation_reset, dtype=bool)
+        return xr.DataArray(resets, dims=(self.time_dim,))
+
+    def _deaccumulate(self, data, accumulation_reset=None):
+        """Get the accumulation in each time interval. Each time step
+        only needs the previous time step, so dask arrays are
+        computed one chunk (plus one step) at a time."""
+        if self.time_dim not in data.dims:
+            raise ValueError("The variable needs the time dimension "
+                             "{time_dim} to de-accumulate ..."
+                             .format(time_dim=self.time_dim))
+        if data.chunks is None:
+            data = data.chunk()
+        resets = self._accumulation_resets(data, accumulation_reset)
+        interval_data = data - data.shift({self.time_dim: 1})
+        return interval_data.where(~resets, data)
+
+    def _is_accumulated(self, variable):
+        """Check if the variable is accumulated over time."""
+        if variable in ACCUMULATED_VARIABLES or variable.endswith('_acc'):
+            return True
+        var = self._obj.variables.get(variable)
+        return var is not None and \
+            'time: sum' in str(var.attrs.get('cell_methods', ''))
+
+    def _time_tiles(self, data, tile_size):
+        """Get the variable as a dask array split into spatial tiles."""
+        if data.chunks is None:
+            data = data.chunk()
+        if tile_size is not None:
+            data = data.chunk({self.y_dim: tile_size,
+                               self.x_dim: tile_size})
+        return data
+
+    def _time_dataarray(self, data, new_data, times, lazy):
+        """Create the variable with new time steps."""
+        new_var = xr.DataArray(
+            new_data,
+            name=data.name,
+            dims=data.dims,
+            coords=dict([(name, coord) for name, coord
+                         in data.coords.items()
+                         if self.time_dim not in coord.dims] +
+                        [(self.time_var, (self.time_dim, times))]),
+            attrs=dict(data.attrs))
+        if not lazy:
+            new_var.load()
+        return new_var
+
+    @Timer('lsm.aggregate_time')
+    def aggregate_time(self, variable, freq, method=None, closed=None,
+                       label=None, accumulation_reset=None,
+                       time_chunk_size=None, tile_size=None, lazy=False,
+                       yslice=slice(None), xslice=slice(None)):
+        """Aggregate a variable to a coarser time step (Ex. daily).
+
+        The time chunks are aligned to the bins of the new time steps
+        and each chunk is reduced independently, so only one chunk
+        per spatial tile is in memory at a time.
+
+            Daily totals example::
+
+                daily_rainc = xds.lsm.aggregate_time('RAINC', 'D')
+
+            Parameters
+            ----------
+            variable: :obj:`str`
+                Name of variable in dataset.
+            freq: :obj:`str`
+                Frequency of the new time steps (Ex. '3h' or 'D').
+            method: :obj:`str`, optional
+                One of 'sum', 'mean', 'min', or 'max'. Default is 'sum'
+                for accumulated variables (Ex. 'RAINC' or 'tp'), which are
+                de-accumulated first, and 'mean' for other variables.
+            closed: :obj:`str`, optional
+                Side of the interval of the new time steps that is closed
+                ('left' or 'right'). Default is 'right' for accumulated
+                variables and 'left' for other variables.
+            label: :obj:`str`, optional
+                Side of the interval used as the new time step
+                ('left' or 'right'). Default is the same as `closed`.
+            accumulation_reset: :obj:`str` or array-like, optional
+                Where the accumulation restarts for accumulated variables
+                (see :func:`~pangaea.LSMGridReader.getvar`). Required
+                without the 'initial_time' coordinate.
+            time_chunk_size: int, optional
+                Minimum number of time steps in a chunk.
+                Default is the largest time chunk of the variable.
+            tile_size: int, optional
+                If set, the grid is split into tiles of this size in
+                each direction that are processed in parallel.
+            lazy: bool, optional
+                If True, the data will be returned as a lazily evaluated
+                dask array. Default is False.
+            yslice: :obj:`slice`, optional
+                Slice in y-direction of grid to extract data from.
+            xslice: :obj:`slice`, optional
+                Slice in x-direction of grid to extract data from.
+
+            Returns
+            -------
+            :func:`xarray.DataArray`
+        """
+        accumulated = self._is_accumulated(variable)
+        if method is None:
+            method = 'sum' if accumulated else 'mean'
+        if closed is None:
+            closed = 'right' if accumulated else 'left'
+        if label is None:
+            label = closed
+
+        data = self._time_tiles(
+            self.getvar(variable, yslice=yslice, xslice=xslice,
+                        deaccumulate=accumulated,
+                        accumulation_reset=accumulation_reset),
+            tile_size)
+        new_times, bin_index = time_bins(self.datetime, freq,
+                                         closed=closed, label=label)
+        new_data = aggregate_bins(data.data, bin_index, method,
+                                  time_chunk_size)
+        new_var = self._time_dataarray(data, new_data, new_times, lazy)
+        new_var.attrs['cell_methods'] = \
+            '{time_dim}: {method}'.format(time_dim=self.time_dim,
+                                          method=method)
+        return new_var
+
+    @Timer('lsm.interpolate_time')
+    def interpolate_time(self, variable, times=None, freq=None,
+                         method='linear', tile_size=None, lazy=False,
+                         yslice=slice(None), xslice=slice(None)):
+        """Interpolate a variable to new time steps (Ex. hourly).
+
+        Each new time step only reads the time steps before and after
+        it, so the data is streamed one chunk at a time.
+
+            .. note:: Accumulated variables are interpolated as the
+                accumulated values. De-accumulate the result with the
+                new time steps if needed.
+
+            Hourly example::
+
+                hourly_t2m = xds.lsm.interpolate_time('t2m', freq='h')
+
+            Parameters
+            ----------
+            variable: :obj:`str`
+                Name of variable in dataset.
+            times: array-like, optional
+                Time steps to interpolate to.
+            freq: :obj:`str`, optional
+                Frequency of the new time steps from the first to the
+                last time step (Ex. 'h'). Used if `times` is not provided.
+            method: :obj:`str`, optional
+                One of 'linear' or 'nearest'. Default is 'linear'.
+            tile_size: int, optional
+                If set, the grid is split into tiles of this size in
+                each direction that are processed in parallel.
+            lazy: bool, optional
+                If True, the data will be returned as a lazily evaluated
+                dask array. Default is False.
+            yslice: :obj:`slice`, optional
+                Slice in y-direction of grid to extract data from.
+            xslice: :obj:`slice`, optional
+                Slice in x-direction of grid to extract data from.
+
+            Returns
+            -------
+            :func:`xarray.DataArray`
+        """
+        if times is None:
+            if freq is None:
+                raise ValueError("Need 'times' or 'freq' to interpolate "
+                                 "the time steps ...")
+            times = pd.date_range(self.datetime[0], self.datetime[-1],
+                                  freq=freq)
+        times = pd.DatetimeIndex(times)
+        lower, upper, weights = interpolation_indices(self.datetime, times,
+                                                      method)
+        data = self._time_tiles(
+            self.getvar(variable, yslice=yslice, xslice=xslice),
+            tile_size)
+        new_data = interpolate_steps(data.data, lower, upper, weights)
+        return self._time_dataarray(data, new_data, times, lazy)
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+#
+#  transform.py
+#  pangaea
+#
+#  Author : Alan D Snow, 2017.
+#  License: BSD 3-Clause
+"""pangaea.transform
+
+    This module provides cached coordinate transformations
+    between projections.
+"""
+import numpy as np
+import pyproj
+
+from .warp import band_chunks
+
+# transformers shared between datasets
+_TRANSFORMERS = {}
+
+
+def _crs_string(projection):
+    """Get the string used to create and cache the transformer."""
+    if hasattr(projection, 'ExportToProj4'):
+        return str(projection.ExportToProj4())
+    return str(projection)
+
+
+class _ProjTransformer(object):
+    """Transformer with the :func:`pyproj.transform` function
+    for pyproj < 2.2 (python 2)."""
+    def __init__(self, src_crs, dst_crs):
+        self.src_proj = self._proj(src_crs)
+        self.dst_proj = self._proj(dst_crs)
+
+    @staticmethod
+    def _proj(crs):
+        """Create the projection from a proj4 or EPSG string."""
+        if crs.lower().startswith('epsg:'):
+            return pyproj.Proj(init=crs.lower())
+        return pyproj.Proj(crs)
+
+    def transform(self, x_coords, y_coords, inplace=False):
+        """Transform the x, y (longitude, latitude) coordinates."""
+        new_x, new_y = pyproj.transform(self.src_proj, self.dst_proj,
+                                        x_coords, y_coords)
+        if not inplace:
+            return new_x, new_y
+        x_coords[...] = new_x
+        y_coords[...] = new_y
+        return x_coords, y_coords
+
+
+def _create_transformer(src_crs, dst_crs):
+    """Create a transformer with x, y (longitude, latitude) axis order."""
+    if hasattr(pyproj, 'Transformer'):
+        try:
+            return pyproj.Transformer.from_crs(src_crs, dst_crs,
+                                               always_xy=True)
+        except TypeError:
+            # always_xy was added in pyproj 2.2 (python 3 only)
+            pass
+    return _ProjTransformer(src_crs, dst_crs)
+
+
+def get_transformer(src_projection, dst_projection):
+    """Get a cached transformer between projections.
+
+    Parameters
+    ----------
+    src_projection: :func:`osr.SpatialReference` or :obj:`str`
+        Source projection (or proj4/EPSG string).
+    dst_projection: :func:`osr.SpatialReference` or :obj:`str`
+        Destination projection (or proj4/EPSG string).
+
+    Returns
+    -------
+    :func:`pyproj.Transformer`
+        Transformer with x, y (longitude, latitude) axis order
+        (a wrapper of :func:`pyproj.transform` for pyproj < 2.2).
+    """
+    transform_key = (_crs_string(src_projection),
+                     _crs_string(dst_projection))
+    if transform_key not in _TRANSFORMERS:
+        _TRANSFORMERS[transform_key] = \
+            _create_transformer(*transform_key)
+    return _TRANSFORMERS[transform_key]
+
+
+def transform_points(src_projection, dst_projection, x_coords, y_coords,
+                     chunk_size=None):
+    """Transform coordinates between projections.
+
+    The coordinates are copied into new float64 arrays which are
+    transformed in place, so the peak memory is only the output arrays.
+
+    Parameters
+    ----------
+    src_projection: :func:`osr.SpatialReference` or :obj:`str`
+        Source projection (or proj4/EPSG string).
+    dst_projection: :func:`osr.SpatialReference` or :obj:`str`
+        Destination projection (or proj4/EPSG string).
+    x_coords: :func:`numpy.ndarray`
+        X coordinates (or longitude).
+    y_coords: :func:`numpy.ndarray`
+        Y coordinates (or latitude).
+    chunk_size: int, optional
+        Number of points to transform at once. Default is all points.
+
+    Returns
+    -------
+    :func:`numpy.ndarray`, :func:`numpy.ndarray`
+        The transformed x and y coordinates.
+    """
+    x_coords = np.asarray(x_coords)
+    y_coords = np.asarray(y_coords)
+    shape = np.broadcast(x_coords, y_coords).shape
+    x_out = np.empty(shape, dtype=np.float64)
+    y_out = np.empty(shape, dtype=np.float64)
+    x_out[...] = x_coords
+    y_out[...] = y_coords
+    if _crs_string(src_projection) == _crs_string(dst_projection):
+        return x_out, y_out
+
+    transformer = get_transformer(src_projection, dst_projection)
+    x_flat = x_out.reshape(-1)
+    y_flat = y_out.reshape(-1)
+    for chunk in band_chunks(x_flat.size, chunk_size):
+        transformer.transform(x_flat[chunk], y_flat[chunk], inplace=True)
+    return x_out, y_out
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+#
+#  warp.py
+#  pangaea
+#
+#  Author : Alan D Snow, 2017.
+#  License: BSD 3-Clause
+"""pangaea.warp
+
+    This module provides helper functions to warp
+    stacks of grids with GDAL in batches of bands.
+"""
+from multiprocessing import Pool, RawArray
+
+import numpy as np
+from gazar.grid import (load_raster, resample_grid,
+                        ArrayGrid, GDALGrid)
+from osgeo import gdal, gdal_array, gdalconst, osr
+
+from .log import count
+
+# state shared with each worker process
+_WORKER_STATE = {}
+
+
+def warp_dtype(dtype):
+    """Get the data type of the warped data. Integer and float32
+    data are warped as float32 and float64 data as float64.
+
+    Parameters
+    ----------
+    dtype: :func:`numpy.dtype`
+        Data type of the source data.
+
+    Returns
+    -------
+    :func:`numpy.dtype`
+    """
+    return np.result_type(dtype, np.float32)
+
+
+def grid_definition(wkt_projection, geotransform, shape):
+    """Get a hashable definition of a grid.
+
+    Parameters
+    ----------
+    wkt_projection: :obj:`str`
+        WKT projection string of the grid.
+    geotransform: :obj:`tuple`
+        Geotransform of the grid.
+    shape: :obj:`tuple`
+        Shape of the grid (y_size, x_size).
+
+    Returns
+    -------
+    :obj:`dict`
+    """
+    return {
+        'wkt': str(wkt_projection),
+        'geotransform': [float(gt_val) for gt_val in geotransform],
+        'shape': [int(dim) for dim in shape],
+    }
+
+
+def grid_from_definition(grid_def):
+    """Create an empty in memory :func:`gazar.grid.GDALGrid`
+    from a grid definition.
+    """
+    y_size, x_size = grid_def['shape']
+    dataset = gdal.GetDriverByName('MEM').Create("", x_size, y_size, 1,
+                                                 gdalconst.GDT_Float32)
+    dataset.SetGeoTransform(grid_def['geotransform'])
+    dataset.SetProjection(grid_def['wkt'])
+    return GDALGrid(dataset)
+
+
+def match_grid_definition(match_grid):
+    """Get the grid definition of a grid to match.
+
+    Parameters
+    ----------
+    match_grid: :obj:`str` or :func:`gdal.Dataset` or :func:`GDALGrid`
+        The grid to match.
+
+    Returns
+    -------
+    :obj:`dict`
+    """
+    match_ds, match_proj = load_raster(match_grid)
+    return grid_definition(match_proj,
+                           match_ds.GetGeoTransform(),
+                           (match_ds.RasterYSize, match_ds.RasterXSize))
+
+
+def projection_grid_definition(src_def, projection, error_threshold=0.125):
+    """Get the grid definition GDAL would use to reproject
+    the source grid to a new projection.
+
+    Parameters
+    ----------
+    src_def: :obj:`dict`
+        Source grid definition.
+    projection: :func:`osr.SpatialReference`
+        Projection to convert data to.
+    error_threshold: float, optional
+        Default is 0.125 (same as gdalwarp commandline).
+
+    Returns
+    -------
+    :obj:`dict`
+    """
+    src_grid = grid_from_definition(src_def)
+    dst_wkt = projection.ExportToWkt()
+    warped_vrt = gdal.AutoCreateWarpedVRT(src_grid.dataset,
+                                          src_def['wkt'],
+                                          dst_wkt,
+                                          gdalconst.GRA_Average,
+                                          error_threshold)
+    return grid_definition(dst_wkt,
+                           warped_vrt.GetGeoTransform(),
+                           (warped_vrt.RasterYSize, warped_vrt.RasterXSize))
+
+
+def band_chunks(num_bands, band_chunk_size=None):
+    """Generate slices to split bands into chunks.
+
+    Parameters
+    ----------
+    num_bands: int
+        Total number of bands.
+    band_chunk_size: int, optional
+        Maximum number of bands in a chunk. Default is all bands.
+
+    Yields
+    ------
+    :obj:`slice`
+    """
+    if band_chunk_size is None or band_chunk_size < 1:
+        band_chunk_size = max(num_bands, 1)
+    for start in range(0, num_bands, band_chunk_size):
+        yield slice(start, min(start + band_chunk_size, num_bands))
+
+
+def map_bands(func, data_array, band_chunk_size=None):
+    """Apply a function to a stack of bands one chunk of bands
+    at a time, so only one chunk is read into memory at once.
+
+    Parameters
+    ----------
+    func: callable
+        Function that takes a :func:`numpy.ndarray` with dimensions
+        (band, y, x) and returns an array with the bands
+        as the first dimension.
+    data_array: :func:`xarray.DataArray` or :func:`numpy.ndarray`
+        3D array with dimensions (band, y, x).
+    band_chunk_size: int, optional
+        Number of bands to read at once. Default is all bands.
+
+    Returns
+    -------
+    :func:`numpy.ndarray`
+        The results of all chunks with dimensions (band, ...).
+    """
+    num_bands = data_array.shape[0]
+    new_data = None
+    for band_slice in band_chunks(num_bands, band_chunk_size):
+        data = np.asarray(data_array[band_slice])
+        count('bytes_read', data.nbytes)
+        band_data = func(data)
+        if new_data is None:
+            new_data = np.empty((num_bands,) + band_data.shape[1:],
+                                dtype=band_data.dtype)
+        new_data[band_slice] = band_data
+    return new_data
+
+
+class ResampleWarp(object):
+    """
+    Picklable function to resample a grid to match a grid definition.
+
+    Parameters
+    ----------
+    match_def: :obj:`dict`
+        Definition of the grid to match (see :func:`grid_definition`).
+    """
+    def __init__(self, match_def):
+        self.match_def = match_def
+        self._match_grid = None
+
+    def __getstate__(self):
+        return {'match_def': self.match_def}
+
+    def __setstate__(self, state):
+        self.__init__(state['match_def'])
+
+    def dst_definition(self, src_def):
+        """:obj:`dict`: Definition of the warped grid."""
+        # pylint: disable=unused-argument
+        return self.match_def
+
+    def __call__(self, arr_grid):
+        if self._match_grid is None:
+            self._match_grid = grid_from_definition(self.match_def)
+        return resample_grid(original_grid=arr_grid,
+                             match_grid=self._match_grid,
+                             as_gdal_grid=True)
+
+
+class ProjectionWarp(object):
+    """
+    Picklable function to reproject a grid to a new projection.
+
+    Parameters
+    ----------
+    wkt_projection: :obj:`str`
+        WKT projection string to convert data to.
+    resampling: :func:`osgeo.gdalconst`, optional
+        Method to use for resampling. Default is `gdalconst.GRA_Average`.
+    """
+    def __init__(self, wkt_projection, resampling=gdalconst.GRA_Average):
+        self.wkt_projection = wkt_projection
+        self.resampling = resampling
+
+    @property
+    def projection(self):
+        """:func:`osr.SpatialReference`: Projection to convert data to."""
+        projection = osr.SpatialReference()
+        projection.ImportFromWkt(self.wkt_projection)
+        return projection
+
+    def dst_definition(self, src_def):
+        """:obj:`dict`: Definition of the warped grid."""
+        return projection_grid_definition(src_def, self.projection)
+
+    def __call__(self, arr_grid):
+        return arr_grid.to_projection(self.projection, self.resampling)
+
+
+def warp_bands(data_array, wkt_projection, geotransform, warp_grid,
+               band_chunk_size=None, n_workers=None):
+    """Warp a stack of bands with one GDAL call per chunk of bands.
+
+    Parameters
+    ----------
+    data_array: :func:`xarray.DataArray` or :func:`numpy.ndarray`
+        3D array with dimensions (band, y, x).
+    wkt_projection: :obj:`str`
+        WKT projection string of the data.
+    geotransform: :obj:`tuple`
+        Geotransform of the data.
+    warp_grid: :func:`ResampleWarp` or :func:`ProjectionWarp`
+        Function that takes a multi-band :func:`gazar.grid.ArrayGrid`
+        and returns the warped :func:`gazar.grid.GDALGrid`.
+    band_chunk_size: int, optional
+        Number of bands to warp at once. Default is all bands
+        (or split evenly between workers if `n_workers` is set).
+    n_workers: int, optional
+        If set, the chunks of bands are warped in parallel
+        with this number of processes.
+
+    Returns
+    -------
+    :func:`numpy.ndarray`, :func:`gazar.grid.GDALGrid`
+        The warped data with dimensions (band, y, x)
+        and the warped grid.
+    """
+    if n_workers is not None and n_workers > 1:
+        return _warp_bands_parallel(data_array, wkt_projection,
+                                    geotransform, warp_grid,
+                                    band_chunk_size, n_workers)
+
+    num_bands = data_array.shape[0]
+    dtype = warp_dtype(data_array.dtype)
+    gdal_dtype = gdal_array.NumericTypeCodeToGDALTypeCode(dtype)
+    new_data = None
+    warped_grid = None
+    for band_slice in band_chunks(num_bands, band_chunk_size):
+        in_array = np.asarray(data_array[band_slice])
+        count('bytes_read', in_array.nbytes)
+        arr_grid = ArrayGrid(in_array=in_array.astype(dtype, copy=False),
+                             wkt_projection=wkt_projection,
+                             geotransform=geotransform,
+                             gdal_dtype=gdal_dtype)
+        warped_grid = warp_grid(arr_grid)
+        warped_data = warped_grid.np_array(band='all') \
+            .reshape((-1, warped_grid.y_size, warped_grid.x_size))
+        if new_data is None:
+            new_data = np.empty((num_bands,
+                                 warped_grid.y_size,
+                                 warped_grid.x_size),
+                                dtype=dtype)
+        new_data[band_slice] = warped_data
+    count('bands_warped', num_bands)
+    return new_data, warped_grid
+
+
+def _init_worker(wkt_projection, geotransform, warp_grid,
+                 shared_data, shape, dtype):
+    """Store the source geometry and output buffer in the worker."""
+    _WORKER_STATE['wkt_projection'] = wkt_projection
+    _WORKER_STATE['geotransform'] = geotransform
+    _WORKER_STATE['warp_grid'] = warp_grid
+    _WORKER_STATE['new_data'] = \
+        np.frombuffer(shared_data, dtype=dtype).reshape(shape)
+
+
+def _warp_chunk(chunk):
+    """Warp a chunk of bands into the shared output buffer."""
+    band_slice, in_array = chunk
+    _WORKER_STATE['new_data'][band_slice] = \
+        warp_bands(in_array,
+                   wkt_projection=_WORKER_STATE['wkt_projection'],
+                   geotransform=_WORKER_STATE['geotransform'],
+                   warp_grid=_WORKER_STATE['warp_grid'])[0]
+    return band_slice
+
+
+def _warp_bands_parallel(data_array, wkt_projection, geotransform,
+                         warp_grid, band_chunk_size, n_workers):
+    """Warp chunks of bands in a process pool."""
+    num_bands = data_array.shape[0]
+    if band_chunk_size is None:
+        band_chunk_size = -(-num_bands // n_workers)
+    dst_def = warp_grid.dst_definition(
+        grid_definition(wkt_projection, geotransform, data_array.shape[1:])
+    )
+    shape = (num_bands,) + tuple(dst_def['shape'])
+    dtype = np.dtype(warp_dtype(data_array.dtype))
+    shared_data = RawArray('b', int(np.prod(shape)) * dtype.itemsize)
+
+    chunks = list(band_chunks(num_bands, band_chunk_size))
+    pool = Pool(n_workers,  # pylint: disable=consider-using-with
+                initializer=_init_worker,
+                initargs=(wkt_projection, geotransform, warp_grid,
+                          shared_data, shape, dtype.str))
+    try:
+        # only read in enough data for one chunk per worker at a time
+        for start in range(0, len(chunks), n_workers):
+            chunk_data = [(band_slice, np.asarray(data_array[band_slice]))
+                          for band_slice in chunks[start:start + n_workers]]
+            count('bytes_read',
+                  sum(in_array.nbytes for _, in_array in chunk_data))
+            pool.map(_warp_chunk, chunk_data)
+    finally:
+        # the workers do not outlive a failed chunk
+        pool.close()
+        pool.join()
+    count('bands_warped', num_bands)
+
+    new_data = np.frombuffer(shared_data, dtype=dtype).reshape(shape)
+    return new_data, grid_from_definition(dst_def)
@@ -9,19 +9,64 @@
     This module is an extension for xarray for land surface models.
     (see: http://xarray.pydata.org/en/stable/internals.html#extending-xarray)
 """
-from affine import Affine
 import numpy as np
-from osgeo import osr, gdalconst
 import pandas as pd
-from pyproj import Proj, transform
-from gazar.grid import (geotransform_from_yx, resample_grid,
-                        utm_proj_from_latlon, ArrayGrid)
-import wrf
 import xarray as xr
 
+from .bbox import BBoxMixin
+from .geotransform import GeotransformMixin
+from .log import Timer
+from .points import PointsMixin
+from .temporal import TemporalMixin
+
+# NOTE: GDAL (osgeo), gazar, wrf-python, and pyproj are imported
+# in the methods that use them so that importing pangaea and
+# registering the accessor stays fast.
+
+
+# datetime format of the WRF Times variable
+WRF_TIME_FORMAT = '%Y-%m-%d_%H:%M:%S'
+
+
+def _native_slice(yslice, y_size):
+    """Convert a slice of a grid flipped in the y-direction
+    to a slice with a positive step of the original grid.
+    Integer indices (and arrays of them) are converted to
+    the matching indices of the original grid.
+
+    Returns
+    -------
+    :obj:`slice` or int or :func:`numpy.ndarray`, bool
+        The slice and if it needs to be reversed to match
+        the order of the slice of the flipped grid.
+    """
+    if not isinstance(yslice, slice):
+        indices = np.asarray(yslice)
+        if indices.dtype.kind not in 'iu':
+            raise ValueError("yslice needs to be a slice or integer "
+                             "indices, got: {0}".format(yslice))
+        if ((indices < -y_size) | (indices >= y_size)).any():
+            raise IndexError("yslice {0} is out of bounds for the "
+                             "y-dimension of size {1}"
+                             .format(yslice, y_size))
+        native_indices = y_size - 1 - indices % y_size
+        if native_indices.ndim == 0:
+            return int(native_indices), False
+        return native_indices, False
+    start, stop, step = yslice.indices(y_size)
+    flipped_indices = range(start, stop, step)
+    if not flipped_indices:
+        return slice(0, 0), False
+    first_index = y_size - 1 - flipped_indices[0]
+    last_index = y_size - 1 - flipped_indices[-1]
+    if step > 0:
+        return slice(last_index, first_index + 1, step), True
+    return slice(first_index, last_index + 1, -step), False
+
 
 @xr.register_dataset_accessor('lsm')
-class LSMGridReader(object):
+class LSMGridReader(GeotransformMixin, BBoxMixin, PointsMixin,
+                    TemporalMixin):
     """
     This is an extension for xarray specifically
     designed for land surface models.
@@ -54,6 +99,8 @@ class LSMGridReader(object):
         self._affine = None
         self._center = None
         self._y_inverted = None
+        self._coords_cache = {}
+        self._time_format = None
 
         # set variable information
         self.y_var = 'lat'
@@ -63,28 +110,44 @@ class LSMGridReader(object):
         self.y_dim = 'y'
         self.x_dim = 'x'
         self.time_dim = 'time'
+        # datetime format of the time strings (Ex. '%Y-%m-%d_%H:%M:%S')
+        self.time_format = None
         # convert lon from [0 to 360] to [-180 to 180]
         self.lon_to_180 = False
         # coordinates are projected already
         self.coords_projected = False
+        # number of points to transform between projections at once
+        self.transform_chunk_size = None
+        # calculate the geotransform from the grid metadata
+        self.geotransform_from_metadata = False
+        # check the geotransform from the grid metadata
+        self.verify_geotransform = True
 
     def to_datetime(self):
         """Converts time to datetime."""
         time_values = self._obj[self.time_var].values
         if 'datetime' not in str(time_values.dtype):
-            try:
-                time_values = [time_val.decode('utf-8') for
-                               time_val in time_values]
-            except AttributeError:
-                pass
-
-            try:
-                datetime_values = pd.to_datetime(time_values)
-            except ValueError:
-                # WRF DATETIME FORMAT
-                datetime_values = \
-                    pd.to_datetime(time_values,
-                                   format="%Y-%m-%d_%H:%M:%S")
+            if time_values.dtype.kind == 'O':
+                try:
+                    time_values = time_values.astype(np.bytes_)
+                except (TypeError, ValueError, UnicodeEncodeError):
+                    pass
+            if time_values.dtype.kind == 'S':
+                time_values = np.char.decode(time_values, 'utf-8')
+
+            time_format = self.time_format or self._time_format
+            if time_format is not None:
+                datetime_values = pd.to_datetime(time_values,
+                                                 format=time_format)
+            else:
+                try:
+                    datetime_values = pd.to_datetime(time_values)
+                except ValueError:
+                    # WRF DATETIME FORMAT
+                    datetime_values = \
+                        pd.to_datetime(time_values,
+                                       format=WRF_TIME_FORMAT)
+                    self._time_format = WRF_TIME_FORMAT
 
             self._obj[self.time_var].values = datetime_values
 
@@ -105,169 +168,84 @@ class LSMGridReader(object):
     def datetime(self):
         """Get datetime object for time variable"""
         self.to_datetime()
+        time_index = self._obj.indexes.get(self.time_var)
+        if isinstance(time_index, pd.DatetimeIndex):
+            return time_index
         return pd.to_datetime(self._obj[self.time_var].values)
 
-    def _load_wrf_projection(self):
-        """Load the osgeo.osr projection for WRF Grid.
-
-        - 'MAP_PROJ': The map projection type as an integer.
-        - 'TRUELAT1': True latitude 1.
-        - 'TRUELAT2': True latitude 2.
-        - 'MOAD_CEN_LAT': Mother of all domains center latitude.
-        - 'STAND_LON': Standard longitude.
-        - 'POLE_LAT': Pole latitude.
-        - 'POLE_LON': Pole longitude.
-        """
-        # load in params from WRF Global Attributes
-        possible_proj_params = ('MAP_PROJ', 'TRUELAT1', 'TRUELAT2',
-                                'MOAD_CEN_LAT', 'STAND_LON', 'POLE_LAT',
-                                'POLE_LON', 'CEN_LAT', 'CEN_LON', 'DX', 'DY')
-        proj_params = dict()
-        for proj_param in possible_proj_params:
-            if proj_param in self._obj.attrs:
-                proj_params[proj_param] = self._obj.attrs[proj_param]
-
-        # determine projection from WRF Grid
-        proj = wrf.projection.getproj(**proj_params)
-
-        # export to Proj4 and add as osr projection
-        self._projection = osr.SpatialReference()
-        self._projection.ImportFromProj4(str(proj.proj4()))
-
-    def _load_grib_projection(self):
-        """Get the osgeo.osr projection for Grib Grid.
-            - grid_type:  Lambert Conformal
-            - Latin1:     True latitude 1.
-            - Latin2:     True latitude 2.
-            - Lov:        Central meridian.
-            - Lo1:        Pole longitude.
-            - La1:        Pole latitude.
-            - Dx:         [ 3.]
-            - Dy:         [ 3.]
-        """
-        lat_var_attrs = self._obj[self.y_var].attrs
-        if 'Lambert Conformal' in lat_var_attrs['grid_type']:
-            mean_lat = self._obj[self.y_var].mean().values
-            proj4_str = ("+proj=lcc "
-                         "+lat_1={true_lat_1} "
-                         "+lat_2={true_lat_2} "
-                         "+lat_0={latitude_of_origin} "
-                         "+lon_0={central_meridian} "
-                         "+x_0=0 +y_0=0 "
-                         "+ellps=WGS84 +datum=WGS84 "
-                         "+units=m +no_defs") \
-                .format(true_lat_1=lat_var_attrs['Latin1'][0],
-                        true_lat_2=lat_var_attrs['Latin2'][0],
-                        latitude_of_origin=mean_lat,
-                        central_meridian=lat_var_attrs['Lov'][0])
-        else:
-            raise ValueError("Unsupported projection: {grid_type}"
-                             .format(grid_type=lat_var_attrs['grid_type']))
-
-        # export to Proj4 and add as osr projection
-        self._projection = osr.SpatialReference()
-        self._projection.ImportFromProj4(proj4_str)
-
-    @property
-    def projection(self):
-        """:func:`osgeo.osr.SpatialReference`
-            The projection for the dataset.
-        """
-        if self._projection is None:
-            # read projection information from global attributes
-            map_proj4 = self._obj.attrs.get('proj4')
-            if map_proj4 is not None:
-                self._projection = osr.SpatialReference()
-                self._projection.ImportFromProj4(str(map_proj4))
-            elif 'MAP_PROJ' in self._obj.attrs:
-                self._load_wrf_projection()
-            elif 'grid_type' in self._obj[self.y_var].attrs:
-                self._load_grib_projection()
-            elif 'ProjectionCoordinateSystem' in self._obj.keys():
-                # national water model
-                proj4_str = self._obj['ProjectionCoordinateSystem'] \
-                                .attrs['proj4']
-                self._projection = osr.SpatialReference()
-                self._projection.ImportFromProj4(str(proj4_str))
-            else:
-                # default to EPSG 4326
-                self._projection = osr.SpatialReference()
-                self._projection.ImportFromEPSG(4326)
-            # make sure EPSG loaded if possible
-            self._projection.AutoIdentifyEPSG()
-        return self._projection
-
-    @property
-    def epsg(self):
-        """str: EPSG code"""
-        if self._epsg is None:
-            self._epsg = self.projection.GetAuthorityCode(None)
-        return self._epsg
-
-    @property
-    def dx(self):
-        """float: Pixel size in x direction."""
-        return self.geotransform[1]
-
-    @property
-    def dy(self):
-        """float: Pixel size in y direction."""
-        return -self.geotransform[-1]
-
-    @property
-    def geotransform(self):
-        """:obj:`tuple`: The geotransform for grid."""
-        if self._geotransform is None:
-            if self._obj.attrs.get('geotransform') is not None:
-                self._geotransform = [float(g) for g in
-                                      self._obj.attrs.get('geotransform')]
-
-            elif str(self.epsg) != '4326':
-                proj_y, proj_x = self.coords
-                self._geotransform = geotransform_from_yx(proj_y,
-                                                          proj_x)
-            else:
-                self._geotransform = geotransform_from_yx(*self.latlon)
-
-        return self._geotransform
-
-    @property
-    def affine(self):
-        """:func:`Affine`: The affine for the transformation."""
-        if self._affine is None:
-            self._affine = Affine.from_gdal(*self.geotransform)
-        return self._affine
-
     @property
-    def x_size(self):
-        """int: Number of columns in the dataset."""
-        return self._obj.dims[self.x_dim]
-
-    @property
-    def y_size(self):
-        """int: Number of rows in the dataset."""
-        return self._obj.dims[self.y_dim]
+    def _coords_cache_key(self):
+        """tuple: The coordinate settings used by the cache."""
+        return (self.y_var, self.x_var,
+                self.lon_to_180, self.coords_projected)
+
+    def _cached_coords(self, name, calc_coords):
+        """Get coordinate arrays from the cache or calculate them.
+        The cache is invalidated if the coordinate settings change."""
+        cache_key = self._coords_cache_key
+        cached = self._coords_cache.get(name)
+        if cached is None or cached[0] != cache_key:
+            coord_arrays = tuple(np.asarray(coord_array).view()
+                                 for coord_array in calc_coords())
+            # prevent modifying the cached arrays
+            for coord_array in coord_arrays:
+                coord_array.flags.writeable = False
+            cached = (cache_key, coord_arrays)
+            self._coords_cache[name] = cached
+        return cached[1]
+
+    def _transform_to_latlon(self, x_coords, y_coords):
+        """Transform coordinates from the grid projection
+        to longitude/latitude."""
+        # pylint: disable=import-outside-toplevel
+        from .transform import transform_points
+        return transform_points(self.projection, 'epsg:4326',
+                                x_coords, y_coords,
+                                chunk_size=self.transform_chunk_size)
+
+    def _transform_from_latlon(self, lon, lat):
+        """Transform longitude/latitude to the grid projection."""
+        # pylint: disable=import-outside-toplevel
+        from .transform import transform_points
+        return transform_points('epsg:4326', self.projection,
+                                lon, lat,
+                                chunk_size=self.transform_chunk_size)
+
+    def _raw_axes(self):
+        """Gets the raw 1D coordinate axes of dataset (north up)"""
+        x_coords = self._obj[self.x_var].values
+        y_coords = self._obj[self.y_var].values
+        if x_coords.ndim != 1 or y_coords.ndim != 1:
+            raise ValueError("Coordinates are not 1D. "
+                             "The grid is not rectilinear ...")
+        # WRF & NWM Grids are upside down
+        if self.y_inverted:
+            y_coords = y_coords[::-1]
+        return y_coords, x_coords
 
     @property
     def _raw_coords(self):
         """Gets the raw coordinated of dataset"""
-        x_coords = self._obj[self.x_var].values
-        y_coords = self._obj[self.y_var].values
+        def calc_raw_coords():
+            """calculate raw coordinates"""
+            x_coords = self._obj[self.x_var].values
+            y_coords = self._obj[self.y_var].values
 
-        if x_coords.ndim == 3:
-            x_coords = x_coords[0]
-        if y_coords.ndim == 3:
-            y_coords = y_coords[0]
+            if x_coords.ndim == 3:
+                x_coords = x_coords[0]
+            if y_coords.ndim == 3:
+                y_coords = y_coords[0]
 
-        if x_coords.ndim < 2:
-            x_coords, y_coords = np.meshgrid(x_coords, y_coords)
+            if x_coords.ndim < 2:
+                return np.meshgrid(*self._raw_axes()[::-1])[::-1]
 
-        # WRF & NWM Grids are upside down
-        if self.y_inverted:
-            x_coords = x_coords[::-1]
-            y_coords = y_coords[::-1]
+            # WRF & NWM Grids are upside down
+            if self.y_inverted:
+                x_coords = x_coords[::-1]
+                y_coords = y_coords[::-1]
 
-        return y_coords, x_coords
+            return y_coords, x_coords
+        return self._cached_coords('raw', calc_raw_coords)
 
     @property
     def latlon(self):
@@ -275,29 +253,35 @@ class LSMGridReader(object):
 
             .. warning:: The grids always be returned with [0,0]
                 as Northeast and [-1,-1] as Southwest.
+
+            .. note:: The arrays are cached and read-only.
         """
-        if 'MAP_PROJ' in self._obj.attrs:
-            lat, lon = wrf.latlon_coords(self._obj, as_np=True)
-            if lat.ndim == 3:
-                lat = lat[0]
-            if lon.ndim == 3:
-                lon = lon[0]
-            # WRF Grid is upside down
-            lat = lat[::-1]
-            lon = lon[::-1]
-        else:
-            lat, lon = self._raw_coords
+        def calc_latlon():
+            """calculate latitude and longitude"""
+            if 'MAP_PROJ' in self._obj.attrs:
+                # pylint: disable=import-outside-toplevel
+                import wrf
+                lat, lon = wrf.latlon_coords(self._obj, as_np=True)
+                if lat.ndim == 3:
+                    lat = lat[0]
+                if lon.ndim == 3:
+                    lon = lon[0]
+                # WRF Grid is upside down
+                lat = lat[::-1]
+                lon = lon[::-1]
+            else:
+                lat, lon = self._raw_coords
 
-        if self.coords_projected:
-            lon, lat = transform(Proj(self.projection.ExportToProj4()),
-                                 Proj(init='epsg:4326'),
-                                 lon,
-                                 lat)
+            if self.coords_projected:
+                lon, lat = self._transform_to_latlon(lon, lat)
 
-        if self.lon_to_180:
-            lon = (lon + 180) % 360 - 180  # convert [0, 360] to [-180, 180]
+            if self.lon_to_180:
+                # convert [0, 360] to [-180, 180]
+                lon = (lon + 180) % 360 - 180
 
-        return lat, lon
+            return lat, lon
+        return self._cached_coords('latlon',
+                                   Timer('lsm.latlon')(calc_latlon))
 
     @property
     def coords(self):
@@ -305,15 +289,17 @@ class LSMGridReader(object):
 
             .. warning:: The grids always be returned with [0,0]
                 as Northeast and [-1,-1] as Southwest.
+
+            .. note:: The arrays are cached and read-only.
         """
         if not self.coords_projected:
-            lat, lon = self.latlon
-            x_coords, y_coords = \
-                transform(Proj(init='epsg:4326'),
-                          Proj(self.projection.ExportToProj4()),
-                          lon,
-                          lat)
-            return y_coords, x_coords
+            def calc_coords():
+                """calculate projected coordinates"""
+                lat, lon = self.latlon
+                x_coords, y_coords = self._transform_from_latlon(lon, lat)
+                return y_coords, x_coords
+            return self._cached_coords('coords',
+                                       Timer('lsm.coords')(calc_coords))
         return self._raw_coords
 
     @property
@@ -351,105 +337,411 @@ class LSMGridReader(object):
                                  }
                           )
 
-    def resample(self, variable, match_grid):
-        """Resample data to grid.
+    @Timer('lsm.regridder')
+    def regridder(self, match_grid=None, projection=None,
+                  method='average', supersample=4, cache_dir=None):
+        """Create a regridder with precomputed sparse weights
+        to regrid data from this grid to a new grid.
 
             Parameters
             ----------
-            variable: :obj:`str`
-                Name of variable in dataset.
             match_grid: :func:`gdal.Dataset` or :func:`sloot.grid.GDALGrid`
                 Grid you want the data resampled to match resolution.
                 You can also pass the path to the grid.
+            projection: :func:`osr.SpatialReference`
+                Projection to convert data to. Used if `match_grid`
+                is not provided.
+            method: :obj:`str`, optional
+                One of 'nearest', 'bilinear', or 'average'.
+                Default is 'average'.
+            supersample: int, optional
+                Number of samples in each direction in a destination cell
+                used to calculate the 'average' weights. Default is 4.
+            cache_dir: :obj:`str`, optional
+                If set, the weights will be loaded from or saved to
+                this directory using a hash of the grid definitions.
+
+            Returns
+            -------
+            :func:`pangaea.regrid.Regridder`
         """
-        new_data = []
-        for band in range(self._obj.dims[self.time_dim]):
-            data = self._obj[variable][band].values
-            arr_grid = ArrayGrid(in_array=data,
-                                 wkt_projection=self.projection.ExportToWkt(),
-                                 geotransform=self.geotransform)
-            resampled_data_grid = resample_grid(original_grid=arr_grid,
-                                                match_grid=match_grid,
-                                                as_gdal_grid=True)
-            new_data.append(resampled_data_grid.np_array())
+        # pylint: disable=import-outside-toplevel
+        from .regrid import Regridder
+        # pylint: disable=import-outside-toplevel
+        from .warp import match_grid_definition, projection_grid_definition
+        if match_grid is not None:
+            dst_def = match_grid_definition(match_grid)
+        elif projection is not None:
+            dst_def = projection_grid_definition(self.grid_definition,
+                                                 projection)
+        else:
+            raise ValueError("Need 'match_grid' or 'projection' "
+                             "to create the regridder ...")
+        return Regridder.from_grids(self.grid_definition, dst_def,
+                                    method=method,
+                                    supersample=supersample,
+                                    cache_dir=cache_dir)
+
+    def _map_time_blocks(self, variable, block_function, out_shape,
+                         dtype, band_chunk_size=None):
+        """Lazily apply function to blocks of time steps
+        that span the full grid."""
+        var = self._obj[variable]
+        if var.chunks is None:
+            var = var.chunk()
+        data = var.data
+        time_chunks = data.chunks[0]
+        if band_chunk_size is not None:
+            time_chunks = band_chunk_size
+        data = data.rechunk((time_chunks, -1, -1))
+        return data.map_blocks(block_function,
+                               chunks=(data.chunks[0],
+                                       (out_shape[0],),
+                                       (out_shape[1],)),
+                               dtype=dtype)
+
+    def _warp(self, variable, warp_grid, band_chunk_size, n_workers, lazy):
+        """Warp all time steps of variable with GDAL."""
+        # pylint: disable=import-outside-toplevel
+        from .warp import grid_from_definition, warp_bands, warp_dtype
+        wkt_projection = self.projection.ExportToWkt()
+        geotransform = self.geotransform
+        if lazy:
+            def warp_block(block):
+                """warp block of time steps"""
+                return warp_bands(block,
+                                  wkt_projection=wkt_projection,
+                                  geotransform=geotransform,
+                                  warp_grid=warp_grid)[0]
+
+            dst_def = warp_grid.dst_definition(self.grid_definition)
+            new_data = self._map_time_blocks(variable, warp_block,
+                                             dst_def['shape'],
+                                             warp_dtype(
+                                                 self._obj[variable].dtype),
+                                             band_chunk_size)
+            new_grid = grid_from_definition(dst_def)
+        else:
+            new_data, new_grid = \
+                warp_bands(self._obj[variable],
+                           wkt_projection=wkt_projection,
+                           geotransform=geotransform,
+                           warp_grid=warp_grid,
+                           band_chunk_size=band_chunk_size,
+                           n_workers=n_workers)
 
         self.to_datetime()
-        return self._export_dataset(variable, np.array(new_data),
-                                    resampled_data_grid)
+        return self._export_dataset(variable, new_data, new_grid)
+
+    def _regrid(self, variable, regridder, dst_def, band_chunk_size, lazy):
+        """Regrid variable with precomputed weights."""
+        regridder.check_grids(self.grid_definition, dst_def)
+        if lazy:
+            new_data = self._map_time_blocks(
+                variable, regridder.regrid, regridder.dst_def['shape'],
+                np.result_type(self._obj[variable].dtype, np.float32),
+                band_chunk_size)
+        else:
+            new_data = regridder.regrid_bands(self._obj[variable],
+                                              band_chunk_size)
+        self.to_datetime()
+        return self._export_dataset(variable, new_data,
+                                    regridder.dst_grid)
 
-    def _getvar(self, variable, yslice, xslice):
-        """Get the variable either directly or calculated"""
-        # FAILED ATTEMPT TO USE wrf.getvar
-        # if 'MAP_PROJ' in self._obj.attrs:
-        #    try:
-        #        nc_file = self._obj._file_obj.ds
-        #    except AttributeError:
-        #        nc_file = self._obj._file_obj.file_objs
-        #    var = wrf.getvar(nc_file, variable)
-        def extract_slice(var, slice_arr):
-            """extract by slice"""
-            if var.ndim == 4:
-                var = var[slice_arr[0], slice_arr[1],
-                          slice_arr[2], slice_arr[3]]
-            if var.ndim == 3:
-                var = var[slice_arr[0], slice_arr[1], slice_arr[2]]
-            else:
-                var = var[slice_arr[0], slice_arr[1]]
-            return var
+    @Timer('lsm.resample')
+    def resample(self, variable, match_grid, band_chunk_size=None,
+                 regridder=None, lazy=False, n_workers=None):
+        """Resample data to grid.
+
+            Parameters
+            ----------
+            variable: :obj:`str`
+                Name of variable in dataset.
+            match_grid: :func:`gdal.Dataset` or :func:`sloot.grid.GDALGrid`
+                Grid you want the data resampled to match resolution.
+                You can also pass the path to the grid.
+            band_chunk_size: int, optional
+                Number of time steps to resample with each GDAL call.
+                Default is all time steps at once.
+            regridder: :func:`pangaea.regrid.Regridder`, optional
+                If set, the precomputed weights will be used
+                instead of GDAL (see :func:`~LSMGridReader.regridder`).
+                A ValueError is raised if it was created for other grids.
+            lazy: bool, optional
+                If True, the data will be returned as a lazily evaluated
+                dask array chunked along the time dimension. Make sure
+                the source dataset stays open until the data is computed.
+                Default is False.
+            n_workers: int, optional
+                If set, chunks of time steps are warped in parallel with
+                this number of processes. The output is identical to
+                the serial output. Ignored if `lazy` is True.
 
+            Returns
+            -------
+            :func:`xarray.Dataset`
+        """
+        # pylint: disable=import-outside-toplevel
+        from .warp import match_grid_definition, ResampleWarp
+        dst_def = match_grid_definition(match_grid)
+        if regridder is not None:
+            return self._regrid(variable, regridder, dst_def,
+                                band_chunk_size, lazy)
+        return self._warp(variable, ResampleWarp(dst_def),
+                          band_chunk_size, n_workers, lazy)
+
+    def _getvar(self, variable, yslice, xslice, north_up=True):
+        """Get the variable either directly or calculated"""
+        if variable not in self._obj.variables:
+            # pylint: disable=import-outside-toplevel
+            from .derived import find_derived_variable
+            derived_variable = find_derived_variable(variable,
+                                                     self._obj.variables)
+            if derived_variable is not None:
+                return self._getvar_derived(derived_variable, yslice,
+                                            xslice, north_up)
         var = self._obj[variable]
-        slc = [slice(None)] * var.ndim
-        # flip in y-direction
+        reverse = False
         if self.y_inverted:
-            slc[var.get_axis_num(self.y_dim)] = slice(None, None, -1)
-            var = extract_slice(var, slc)
-        # get data out
-        slc[var.get_axis_num(self.x_dim)] = xslice
-        slc[var.get_axis_num(self.y_dim)] = yslice
-        return extract_slice(var, slc)
+            # compose the flip in y-direction with the slice
+            yslice, reverse = _native_slice(yslice, self.y_size)
+        var = var.isel({self.y_dim: yslice, self.x_dim: xslice})
+        if reverse and north_up:
+            var = var.isel({self.y_dim: slice(None, None, -1)})
+        return var
+
+    def _getvar_derived(self, derived_variable, yslice, xslice, north_up):
+        """Lazily calculate a derived variable from the source variables
+        in the window. Dask arrays are evaluated one chunk at a time."""
+        sources = [self._getvar(source, yslice, xslice, north_up)
+                   for source in derived_variable.sources]
+        data = xr.apply_ufunc(
+            derived_variable.evaluate, *sources,
+            dask='parallelized',
+            output_dtypes=[np.result_type(np.float32, *[
+                source.dtype for source in sources])])
+        data.name = derived_variable.name
+        data.attrs = dict(derived_variable.attrs)
+        return data
+
+    def _reduce_4d(self, data, yslice, xslice, north_up,
+                   calc_4d_method, calc_4d_dim,
+                   calc_4d_weights=None, calc_4d_slice=None):
+        """Reduce a 4D variable to 3D. Dask arrays are reduced
+        one chunk of time at a time with all of the methods
+        computed from the same chunk."""
+        if calc_4d_slice is not None:
+            data = data.isel({calc_4d_dim: calc_4d_slice})
+        if data.chunks is not None:
+            # reduction dimension in a single chunk
+            data = data.chunk({calc_4d_dim: data.sizes[calc_4d_dim]})
+
+        weights = calc_4d_weights
+        if weights is not None:
+            if np.ndim(weights) == 0:
+                weights = self._obj[weights]
+                if self.y_dim in weights.dims:
+                    weights = self._getvar(calc_4d_weights, yslice,
+                                           xslice, north_up)
+            elif not isinstance(weights, xr.DataArray):
+                weights = xr.DataArray(np.asarray(weights),
+                                       dims=[calc_4d_dim])
+            if calc_4d_slice is not None and \
+                    weights.sizes[calc_4d_dim] != data.sizes[calc_4d_dim]:
+                weights = weights.isel({calc_4d_dim: calc_4d_slice})
+
+        methods = [calc_4d_method] if np.ndim(calc_4d_method) == 0 \
+            else list(calc_4d_method)
+        reduced = []
+        for method in methods:
+            if weights is None:
+                reduced.append(getattr(data, method)(dim=calc_4d_dim))
+            elif method in ('mean', 'sum'):
+                weighted_data = (data * weights).sum(dim=calc_4d_dim)
+                if method == 'mean':
+                    weighted_data /= weights.where(data.notnull()) \
+                        .sum(dim=calc_4d_dim)
+                reduced.append(weighted_data)
+            else:
+                raise ValueError("Weighted reduction only supported for "
+                                 "'mean' and 'sum' ...")
+
+        if np.ndim(calc_4d_method) == 0:
+            return reduced[0]
+        return xr.concat(reduced, dim=pd.Index(methods, name='method'))
 
     def getvar(self, variable,
                yslice=slice(None),
                xslice=slice(None),
                calc_4d_method=None,
-               calc_4d_dim=None):
+               calc_4d_dim=None,
+               north_up=True,
+               calc_4d_weights=None,
+               calc_4d_slice=None,
+               deaccumulate=False,
+               accumulation_reset=None):
         """Get variable from model with subset options.
 
             .. warning:: The grids will always be returned with [0,0]
-                as Northeast and [-1,-1] as Southwest.
+                as Northeast and [-1,-1] as Southwest
+                unless `north_up` is False.
 
             Parameters
             ----------
             variable: :obj:`str`
-                Name of variable in dataset.
-            yslice: :obj:`slice`, optional
-                Slice in y-direction of grid to extract data from.
-            xslice: :obj:`slice`, optional
-                Slice in x-direction of grid to extract data from.
-            calc_4d_method: :obj:`str`
+                Name of variable in dataset or derived variable
+                (Ex. 'wind_speed', see :mod:`pangaea.derived`).
+            yslice: :obj:`slice` or int, optional
+                Slice or index in y-direction of grid to extract data from.
+            xslice: :obj:`slice` or int, optional
+                Slice or index in x-direction of grid to extract data from.
+            calc_4d_method: :obj:`str` or :obj:`list`
                 Method to convert 4D variables to 3D variables
-                (Ex. 'mean', 'min', or 'max').
+                (Ex. 'mean', 'min', or 'max'). If a list of methods
+                is given, the results are stacked along the 'method'
+                dimension.
             calc_4d_dim: :obj:`str`
                 Dimension to reduce grid from 4D to 3D (Ex. 'top_bottom').
+            north_up: bool, optional
+                If False, the data for the same slices is returned in the
+                orientation of the dataset to avoid reversing the y-axis.
+                The 'y_inverted' attribute of the returned variable
+                is True if the grid is from South to North.
+                Default is True.
+            calc_4d_weights: :obj:`str` or array-like, optional
+                Name of the variable in the dataset or array with the
+                weights along `calc_4d_dim` (Ex. 'DZS' for the
+                WRF soil layer thickness). Only for 'mean' and 'sum'.
+            calc_4d_slice: :obj:`slice`, optional
+                Slice of the layers in `calc_4d_dim` to reduce
+                (Ex. slice(0, 2) for the top two soil layers).
+            deaccumulate: bool, optional
+                If True, an accumulated variable (Ex. 'RAINC' or 'tp')
+                is converted to the accumulation in each time interval
+                lazily with dask. The first time step and the steps
+                after a reset keep the accumulated value.
+                Default is False.
+            accumulation_reset: :obj:`str`, bool, or array-like, optional
+                Where the accumulation restarts when de-accumulating.
+                Either the frequency of the forecast cycles
+                (Ex. '12h' for forecasts from 00 and 12 UTC),
+                a boolean array along the time dimension, False if the
+                accumulation starts at the first time step (Ex. WRF), or
+                'detect' for the time steps where the values drop in most
+                of the grid cells (beyond the rounding of packed values)
+                or the previous time step has no values.
+                Default is where the 'initial_time' coordinate changes
+                (Ex. HRRR) and it is required without it.
 
             Returns
             -------
             :func:`xarray.DataArray`
         """
-        data = self._getvar(variable, yslice, xslice)
+        data = self._getvar(variable, yslice, xslice, north_up)
 
         if data.ndim == 4:
             if calc_4d_method is None or calc_4d_dim is None:
                 raise ValueError("The variable {var} has 4 dimension. "
                                  "Need 'calc_4d_method' and 'calc_4d_dim' "
                                  "to proceed ...".format(var=variable))
-            data = getattr(data, calc_4d_method)(dim=calc_4d_dim)
+            data = self._reduce_4d(data, yslice, xslice, north_up,
+                                   calc_4d_method, calc_4d_dim,
+                                   calc_4d_weights, calc_4d_slice)
+
+        if deaccumulate:
+            data = self._deaccumulate(data, accumulation_reset)
 
         data[self.time_var] = self._obj[self.time_var]
+        if not north_up:
+            data.attrs['y_inverted'] = bool(self.y_inverted)
 
         return data
 
-    def to_projection(self, variable, projection):
+    @Timer('lsm.zonal_weights')
+    def zonal_weights(self, polygons=None, labels=None,
+                      polygon_projection=None, id_field=None,
+                      supersample=10, cache_dir=None):
+        """Create sparse cell coverage weights to aggregate
+        data on this grid over zones (Ex. watersheds).
+
+            Parameters
+            ----------
+            polygons: :obj:`str` or :obj:`list`, optional
+                Path to a vector file (Ex. shapefile) or a list of
+                polygons (shapely, WKT, or :func:`ogr.Geometry`).
+            labels: array-like or :obj:`str` or :func:`gdal.Dataset`
+                Used if `polygons` is not provided. Array of zone ids
+                on the grid (north up) or a label raster
+                (or path to the raster) in any grid and projection.
+            polygon_projection: :func:`osr.SpatialReference`, optional
+                Projection of the polygons. Default is the projection of
+                the vector file or longitude/latitude (EPSG:4326).
+            id_field: :obj:`str`, optional
+                Field in the vector file with the zone ids.
+                Default is the feature id (or the index in the list).
+            supersample: int, optional
+                Number of samples in each direction in a grid cell used
+                to calculate the coverage fractions. Default is 10.
+            cache_dir: :obj:`str`, optional
+                If set, the weights will be loaded from or saved to
+                this directory using a hash of the grid and zones.
+
+            Returns
+            -------
+            :func:`pangaea.zonal.ZonalWeights`
+        """
+        # pylint: disable=import-outside-toplevel
+        from .zonal import ZonalWeights
+        return ZonalWeights.from_dataset(self, polygons=polygons,
+                                         labels=labels,
+                                         polygon_projection=polygon_projection,
+                                         id_field=id_field,
+                                         supersample=supersample,
+                                         cache_dir=cache_dir)
+
+    @Timer('lsm.zonal_mean')
+    def zonal_mean(self, variable, zonal_weights, band_chunk_size=None,
+                   lazy=False):
+        """Get the area weighted mean of a variable in each zone
+        for all time steps.
+
+            Basin average example::
+
+                zonal_weights = xds.lsm.zonal_weights(
+                    polygons='/path/to/subbasins.shp',
+                    id_field='basin_id',
+                    cache_dir='/path/to/cache')
+                basin_rainc = xds.lsm.zonal_mean('RAINC', zonal_weights)
+
+            Parameters
+            ----------
+            variable: :obj:`str`
+                Name of variable in dataset.
+            zonal_weights: :func:`pangaea.zonal.ZonalWeights`
+                The zonal weights
+                (see :func:`~LSMGridReader.zonal_weights`).
+            band_chunk_size: int, optional
+                Number of time steps to aggregate at once.
+                Default is all time steps at once.
+            lazy: bool, optional
+                If True, the data will be returned as a lazily evaluated
+                dask array chunked along the time dimension. Make sure
+                the source dataset stays open until the data is computed.
+                Default is False.
+
+            Returns
+            -------
+            :func:`xarray.DataArray`
+                Data with dimensions (time, zone).
+        """
+        # pylint: disable=import-outside-toplevel
+        from .zonal import zonal_mean
+        return zonal_mean(self, variable, zonal_weights,
+                          band_chunk_size=band_chunk_size, lazy=lazy)
+
+    @Timer('lsm.to_projection')
+    def to_projection(self, variable, projection, band_chunk_size=None,
+                      regridder=None, lazy=False, n_workers=None):
         """Convert Grid to New Projection.
 
             Parameters
@@ -458,41 +750,83 @@ class LSMGridReader(object):
                 Name of variable in dataset.
             projection: :func:`osr.SpatialReference`
                 Projection to convert data to.
+            band_chunk_size: int, optional
+                Number of time steps to reproject with each GDAL call.
+                Default is all time steps at once.
+            regridder: :func:`pangaea.regrid.Regridder`, optional
+                If set, the precomputed weights will be used
+                instead of GDAL (see :func:`~LSMGridReader.regridder`).
+                A ValueError is raised if it was created for other grids.
+            lazy: bool, optional
+                If True, the data will be returned as a lazily evaluated
+                dask array chunked along the time dimension. Make sure
+                the source dataset stays open until the data is computed.
+                Default is False.
+            n_workers: int, optional
+                If set, chunks of time steps are warped in parallel with
+                this number of processes. The output is identical to
+                the serial output. Ignored if `lazy` is True.
 
             Returns
             -------
             :func:`xarray.Dataset`
         """
-        new_data = []
-        for band in range(self._obj.dims[self.time_dim]):
-            arr_grid = ArrayGrid(in_array=self._obj[variable][band].values,
-                                 wkt_projection=self.projection.ExportToWkt(),
-                                 geotransform=self.geotransform)
-            ggrid = arr_grid.to_projection(projection, gdalconst.GRA_Average)
-            new_data.append(ggrid.np_array())
-
-        self.to_datetime()
-        return self._export_dataset(variable, np.array(new_data),
-                                    ggrid)
-
-    def to_utm(self, variable):
+        if regridder is not None:
+            # pylint: disable=import-outside-toplevel
+            from .warp import projection_grid_definition
+            return self._regrid(variable, regridder,
+                                projection_grid_definition(
+                                    self.grid_definition, projection),
+                                band_chunk_size, lazy)
+
+        # pylint: disable=import-outside-toplevel
+        from .warp import ProjectionWarp
+        return self._warp(variable,
+                          ProjectionWarp(projection.ExportToWkt()),
+                          band_chunk_size, n_workers, lazy)
+
+    @Timer('lsm.to_utm')
+    def to_utm(self, variable, band_chunk_size=None, regridder=None,
+               lazy=False, n_workers=None):
         """Convert Grid to UTM projection at center of grid.
 
             Parameters
             ----------
             variable: :obj:`str`
                 Name of variable in dataset.
+            band_chunk_size: int, optional
+                Number of time steps to reproject with each GDAL call.
+                Default is all time steps at once.
+            regridder: :func:`pangaea.regrid.Regridder`, optional
+                If set, the precomputed weights will be used
+                instead of GDAL (see :func:`~LSMGridReader.regridder`).
+                A ValueError is raised if it was created for other grids.
+            lazy: bool, optional
+                If True, the data will be returned as a lazily evaluated
+                dask array chunked along the time dimension.
+                Default is False.
+            n_workers: int, optional
+                If set, chunks of time steps are warped in parallel with
+                this number of processes. The output is identical to
+                the serial output. Ignored if `lazy` is True.
 
             Returns
             -------
             :func:`xarray.Dataset`
         """
         # get utm projection
+        # pylint: disable=import-outside-toplevel
+        from gazar.grid import utm_proj_from_latlon
         center_lon, center_lat = self.center
         dst_proj = utm_proj_from_latlon(center_lat, center_lon,
                                         as_osr=True)
-        return self.to_projection(variable, dst_proj)
+        return self.to_projection(variable, dst_proj,
+                                  band_chunk_size=band_chunk_size,
+                                  regridder=regridder,
+                                  lazy=lazy,
+                                  n_workers=n_workers)
 
+    @Timer('lsm.to_tif')
     def to_tif(self, variable, time_index, out_path):
         """Dump a variable at a time index to a geotiff.
 
@@ -505,7 +839,120 @@ class LSMGridReader(object):
             out_path: :obj:`str`
                 Path to output geotiff file,
         """
+        # pylint: disable=import-outside-toplevel
+        from gazar.grid import ArrayGrid
         arr_grid = ArrayGrid(in_array=self._obj[variable][time_index].values,
                              wkt_projection=self.projection.ExportToWkt(),
                              geotransform=self.geotransform)
         arr_grid.to_tif(out_path)
+
+    @Timer('lsm.to_tifs')
+    def to_tifs(self, variable, out_path, band_chunk_size=None,
+                compress='DEFLATE', tiled=True, cog=False, n_workers=None):
+        """Dump all time steps of a variable to geotiffs.
+
+            Export example::
+
+                # one multi-band geotiff
+                xds.lsm.to_tifs('RAINC', 'rainc.tif')
+                # one geotiff per time step
+                xds.lsm.to_tifs('RAINC', 'rainc_{time:%Y%m%d%H}.tif',
+                                n_workers=4)
+
+            Parameters
+            ----------
+            variable: :obj:`str`
+                Name of variable in dataset.
+            out_path: :obj:`str`
+                Path to output geotiff file. If it contains the
+                format fields '{index}' or '{time}', a file is
+                written for each time step. Otherwise, all time steps
+                are written to one multi-band geotiff.
+            band_chunk_size: int, optional
+                Number of time steps to read into memory at once.
+                Default is all time steps at once.
+            compress: :obj:`str`, optional
+                Compression method (Ex. 'DEFLATE', 'LZW').
+                Default is 'DEFLATE'.
+            tiled: bool, optional
+                If True, the geotiffs will be tiled. Default is True.
+            cog: bool, optional
+                If True, the output is a Cloud Optimized GeoTIFF
+                (requires GDAL >= 3.1). Default is False.
+            n_workers: int, optional
+                If set, the geotiffs for each time step are written in
+                parallel with this number of threads.
+        """
+        # pylint: disable=import-outside-toplevel
+        from .export import write_multiband_tif, write_tif_series
+        if '{' in out_path:
+            out_paths = [out_path.format(index=time_index, time=time_value)
+                         for time_index, time_value
+                         in enumerate(self.datetime)]
+            write_tif_series(self._obj[variable], self.grid_definition,
+                             out_paths,
+                             band_chunk_size=band_chunk_size,
+                             compress=compress,
+                             tiled=tiled,
+                             cog=cog,
+                             n_workers=n_workers)
+        else:
+            write_multiband_tif(self._obj[variable], self.grid_definition,
+                                out_path,
+                                band_chunk_size=band_chunk_size,
+                                compress=compress,
+                                tiled=tiled,
+                                cog=cog)
+
+    @Timer('lsm.to_zarr')
+    def to_zarr(self, store, variables=None, chunks=None,
+                compressor=None, mode='w-', append=False):
+        """Write the dataset to a Zarr store that can be reopened
+        with :func:`pangaea.open_zarr` without normalizing it again.
+
+            .. note:: The grids are written with [0,0] as Northeast
+                and [-1,-1] as Southwest. The projection, geotransform,
+                and accessor settings are stored in the attributes.
+
+            Parameters
+            ----------
+            store: :obj:`str` or MutableMapping
+                Path to or Zarr store to write to.
+            variables: :obj:`list`, optional
+                Names of the variables to write. Default is all variables.
+            chunks: :obj:`dict`, optional
+                Chunk size for each dimension. Default is
+                one time step per chunk.
+            compressor: :func:`numcodecs.abc.Codec`, optional
+                Compressor for the variables (Ex. numcodecs.Blosc()).
+                Default is the Zarr default compressor.
+            mode: :obj:`str`, optional
+                'w' to overwrite or 'w-' to fail if the store exists.
+                Default is 'w-'.
+            append: bool, optional
+                If True, the time steps not already in the existing store
+                are appended along the time dimension. The variables
+                without the time dimension are not written again
+                and the `chunks` should match the existing store.
+                Default is False.
+
+        Zarr example::
+
+            import pangaea as pa
+
+            with pa.open_mfdataset('/path/to/ncfiles/*.nc',
+                                   lat_var='lat',
+                                   lon_var='lon',
+                                   time_var='time',
+                                   lat_dim='lat',
+                                   lon_dim='lon',
+                                   time_dim='time') as xds:
+                xds.lsm.to_zarr('/path/to/store.zarr')
+
+            with pa.open_zarr('/path/to/store.zarr') as xds:
+                print(xds.lsm.projection)
+        """
+        # pylint: disable=import-outside-toplevel
+        from .read import write_zarr
+        write_zarr(self._obj, store, variables=variables, chunks=chunks,
+                   compressor=compressor, mode=mode, append=append)
@@ -0,0 +1,514 @@
+# -*- coding: utf-8 -*-
+#
+#  zonal.py
+#  pangaea
+#
+#  Author : Alan D Snow, 2017.
+#  License: BSD 3-Clause
+"""pangaea.zonal
+
+    This module provides reusable sparse cell coverage weights
+    to aggregate grids over zones (Ex. watersheds).
+"""
+import hashlib
+import json
+import os
+
+from gazar.grid import load_raster
+import numpy as np
+from osgeo import gdal, gdalconst, ogr, osr
+from scipy import sparse
+import xarray as xr
+
+from .log import count
+from .regrid import _load_weights, _same_grid, _save_weights
+from .warp import map_bands
+
+
+def _spatial_ref(projection):
+    """Get an osr projection with the x, y (longitude, latitude)
+    axis order from an osr projection, WKT, proj4, or EPSG string."""
+    if hasattr(projection, 'ExportToWkt'):
+        projection = projection.ExportToWkt()
+    sp_ref = osr.SpatialReference()
+    sp_ref.SetFromUserInput(str(projection))
+    if hasattr(sp_ref, 'SetAxisMappingStrategy'):
+        sp_ref.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    return sp_ref
+
+
+def _to_geometry(polygon):
+    """Convert a polygon (shapely, WKT, or ogr) to :func:`ogr.Geometry`."""
+    if hasattr(polygon, 'ExportToWkb'):
+        return polygon.Clone()
+    if hasattr(polygon, 'wkb'):
+        return ogr.CreateGeometryFromWkb(polygon.wkb)
+    return ogr.CreateGeometryFromWkt(str(polygon))
+
+
+def _read_polygons(polygons, polygon_projection, id_field):
+    """Get the zone ids, geometries, and projection of the polygons."""
+    if isinstance(polygons, str):
+        vector_ds = ogr.Open(polygons)
+        if vector_ds is None:
+            raise IOError("Unable to open polygons: {0}".format(polygons))
+        layer = vector_ds.GetLayer()
+        if polygon_projection is None and layer.GetSpatialRef() is not None:
+            polygon_projection = layer.GetSpatialRef().ExportToWkt()
+        zone_ids = []
+        geometries = []
+        for feature in layer:
+            zone_ids.append(feature.GetFID() if id_field is None
+                            else feature.GetField(id_field))
+            geometries.append(feature.GetGeometryRef().Clone())
+    else:
+        geometries = [_to_geometry(polygon) for polygon in polygons]
+        zone_ids = list(range(len(geometries)))
+    if polygon_projection is None:
+        polygon_projection = 'EPSG:4326'
+    return zone_ids, geometries, _spatial_ref(polygon_projection)
+
+
+def _supersample_definition(grid_def, supersample):
+    """Get the grid definition with each cell split into
+    supersample x supersample cells."""
+    geotransform = list(grid_def['geotransform'])
+    for gt_index in (1, 2, 4, 5):
+        geotransform[gt_index] /= float(supersample)
+    return dict(grid_def,
+                geotransform=geotransform,
+                shape=[dim * supersample for dim in grid_def['shape']])
+
+
+def _label_dataset(grid_def):
+    """Create an empty in memory label raster for a grid definition."""
+    y_size, x_size = grid_def['shape']
+    dataset = gdal.GetDriverByName('MEM').Create("", x_size, y_size, 1,
+                                                 gdalconst.GDT_Int32)
+    dataset.SetGeoTransform(grid_def['geotransform'])
+    dataset.SetProjection(grid_def['wkt'])
+    return dataset
+
+
+def _rasterize_polygons(geometries, polygon_sp_ref, grid_def):
+    """Rasterize the polygons with the zone index + 1 as the label."""
+    grid_sp_ref = _spatial_ref(grid_def['wkt'])
+    transform = osr.CoordinateTransformation(polygon_sp_ref, grid_sp_ref)
+    vector_ds = ogr.GetDriverByName('Memory').CreateDataSource('')
+    layer = vector_ds.CreateLayer('zones', grid_sp_ref, ogr.wkbUnknown)
+    layer.CreateField(ogr.FieldDefn('label', ogr.OFTInteger))
+    for zone_index, geometry in enumerate(geometries):
+        geometry = geometry.Clone()
+        geometry.Transform(transform)
+        feature = ogr.Feature(layer.GetLayerDefn())
+        feature.SetField('label', zone_index + 1)
+        feature.SetGeometry(geometry)
+        layer.CreateFeature(feature)
+
+    label_ds = _label_dataset(grid_def)
+    gdal.RasterizeLayer(label_ds, [1], layer, options=['ATTRIBUTE=label'])
+    return label_ds.ReadAsArray()
+
+
+def _coverage_weights(labels, grid_def, supersample, num_zones):
+    """Calculate the sparse weight matrix from the grid cells
+    to the zones from labels on the supersampled grid.
+
+    The weights are the fraction of each cell covered by the zone
+    multiplied by the relative cell area for geographic grids.
+    """
+    y_size, x_size = grid_def['shape']
+    label_rows, label_cols = np.nonzero(labels > 0)
+    fractions = np.full(label_rows.size, 1.0 / supersample ** 2)
+    if _spatial_ref(grid_def['wkt']).IsGeographic():
+        geotransform = grid_def['geotransform']
+        lat = geotransform[3] + \
+            (label_rows + 0.5) * geotransform[5] / supersample
+        fractions *= np.cos(np.radians(lat))
+
+    weights = sparse.coo_matrix(
+        (fractions,
+         (labels[label_rows, label_cols] - 1,
+          (label_rows // supersample) * x_size +
+          label_cols // supersample)),
+        shape=(num_zones, y_size * x_size)
+    ).tocsr()
+    weights.sum_duplicates()
+    return weights
+
+
+class ZonalWeights(object):
+    """
+    Sparse cell coverage weights to aggregate data on a grid
+    over zones (Ex. watersheds). The weights are computed once
+    and can be applied to any number of time steps.
+
+    Parameters
+    ----------
+    weights: :func:`scipy.sparse.csr_matrix`
+        Weights with shape (zones, grid cells).
+    grid_def: :obj:`dict`
+        Grid definition (see :func:`grid_definition`).
+    zone_ids: :obj:`list`
+        Identifier of each zone.
+
+    Zonal mean with pangaea example::
+
+        import pangaea as pa
+
+        with pa.open_mfdataset('/path/to/ncfiles/*.nc',
+                               lat_var='lat',
+                               lon_var='lon',
+                               time_var='time',
+                               lat_dim='lat',
+                               lon_dim='lon',
+                               time_dim='time') as xds:
+            zonal_weights = xds.lsm.zonal_weights(
+                polygons='/path/to/subbasins.shp',
+                id_field='basin_id',
+                cache_dir='/path/to/cache')
+            basin_tp = xds.lsm.zonal_mean('tp', zonal_weights)
+    """
+    def __init__(self, weights, grid_def, zone_ids):
+        self.weights = weights
+        self.grid_def = grid_def
+        self.zone_ids = list(zone_ids)
+
+    @staticmethod
+    def zone_hash(grid_def, zone_key, supersample=10):
+        """:obj:`str`: Hash of the grid and the zones."""
+        hash_str = json.dumps([grid_def, zone_key, supersample],
+                              sort_keys=True)
+        return hashlib.sha1(hash_str.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _from_cache(cls, cache_dir, zone_hash, calc_zonal_weights):
+        """Load the weights from the cache or calculate them."""
+        if cache_dir is None:
+            return calc_zonal_weights()
+        cache_file = os.path.join(cache_dir,
+                                  "zonal_{0}.npz".format(zone_hash))
+        if os.path.exists(cache_file):
+            return cls.from_file(cache_file)
+        zonal_weights = calc_zonal_weights()
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            pass
+        zonal_weights.to_file(cache_file)
+        return zonal_weights
+
+    @classmethod
+    def from_polygons(cls, grid_def, polygons, polygon_projection=None,
+                      id_field=None, supersample=10, cache_dir=None):
+        """Calculate the weights from the fraction of each grid cell
+        covered by the polygons.
+
+        .. note:: Each cell is split into supersample x supersample
+            cells that are assigned to one polygon. Overlapping
+            polygons are not supported.
+
+        Parameters
+        ----------
+        grid_def: :obj:`dict`
+            Grid definition (see :func:`grid_definition`).
+        polygons: :obj:`str` or :obj:`list`
+            Path to a vector file (Ex. shapefile) or a list of
+            polygons (shapely, WKT, or :func:`ogr.Geometry`).
+        polygon_projection: :func:`osr.SpatialReference`, optional
+            Projection of the polygons. Default is the projection of
+            the vector file or longitude/latitude (EPSG:4326).
+        id_field: :obj:`str`, optional
+            Field in the vector file with the zone ids.
+            Default is the feature id (or the index in the list).
+        supersample: int, optional
+            Number of samples in each direction in a grid cell used
+            to calculate the coverage fractions. Default is 10.
+        cache_dir: :obj:`str`, optional
+            If set, the weights will be loaded from or saved to
+            this directory using a hash of the grid and polygons.
+
+        Returns
+        -------
+        :func:`ZonalWeights`
+        """
+        zone_ids, geometries, polygon_sp_ref = \
+            _read_polygons(polygons, polygon_projection, id_field)
+        zone_key = [
+            polygon_sp_ref.ExportToWkt(),
+            [str(zone_id) for zone_id in zone_ids],
+            hashlib.sha1(b''.join(bytes(geometry.ExportToWkb())
+                                  for geometry in geometries)).hexdigest(),
+        ]
+
+        def calc_zonal_weights():
+            """calculate the weights from the rasterized polygons"""
+            labels = _rasterize_polygons(
+                geometries, polygon_sp_ref,
+                _supersample_definition(grid_def, supersample))
+            return cls(_coverage_weights(labels, grid_def, supersample,
+                                         len(zone_ids)),
+                       grid_def, zone_ids)
+        return cls._from_cache(cache_dir,
+                               cls.zone_hash(grid_def, zone_key,
+                                             supersample),
+                               calc_zonal_weights)
+
+    @classmethod
+    def from_labels(cls, grid_def, labels, supersample=10, cache_dir=None):
+        """Calculate the weights from a label raster with the zone id
+        of each cell. Cells with 0 or the nodata value are not in a zone.
+
+        Parameters
+        ----------
+        grid_def: :obj:`dict`
+            Grid definition (see :func:`grid_definition`).
+        labels: array-like or :obj:`str` or :func:`gdal.Dataset`
+            Array of zone ids on the grid (north up) or a label raster
+            (or path to the raster) in any grid and projection.
+        supersample: int, optional
+            Number of samples in each direction in a grid cell used to
+            calculate the coverage fractions from a label raster.
+            Default is 10.
+        cache_dir: :obj:`str`, optional
+            If set, the weights will be loaded from or saved to
+            this directory using a hash of the grid and labels.
+
+        Returns
+        -------
+        :func:`ZonalWeights`
+        """
+        if isinstance(labels, str) or hasattr(labels, 'GetRasterBand') \
+                or hasattr(labels, 'dataset'):
+            label_ds, label_wkt = load_raster(labels)
+            label_values = label_ds.ReadAsArray()
+            nodata = label_ds.GetRasterBand(1).GetNoDataValue()
+            zone_key = [label_wkt, list(label_ds.GetGeoTransform())]
+        else:
+            label_ds = None
+            label_values = np.asarray(labels)
+            nodata = None
+            supersample = 1
+            if list(label_values.shape) != list(grid_def['shape']):
+                raise ValueError("Labels shape {label_shape} does not "
+                                 "match the grid shape {grid_shape}."
+                                 .format(label_shape=label_values.shape,
+                                         grid_shape=grid_def['shape']))
+            zone_key = [list(label_values.shape)]
+        in_zone = label_values != 0
+        if nodata is not None:
+            in_zone &= label_values != nodata
+        zone_ids = np.unique(label_values[in_zone])
+        zone_key.append(hashlib.sha1(
+            np.ascontiguousarray(label_values).tobytes()).hexdigest())
+
+        def calc_zonal_weights():
+            """calculate the weights from the labels on the grid"""
+            zone_labels = np.zeros(label_values.shape, dtype=np.int64)
+            zone_labels[in_zone] = \
+                np.searchsorted(zone_ids, label_values[in_zone]) + 1
+            if label_ds is not None:
+                # warp the zone labels to the supersampled grid
+                src_ds = gdal.GetDriverByName('MEM').Create(
+                    "", label_ds.RasterXSize, label_ds.RasterYSize, 1,
+                    gdalconst.GDT_Int32)
+                src_ds.SetGeoTransform(label_ds.GetGeoTransform())
+                src_ds.SetProjection(label_wkt)
+                src_ds.GetRasterBand(1).WriteArray(zone_labels)
+                dst_def = _supersample_definition(grid_def, supersample)
+                dst_ds = _label_dataset(dst_def)
+                gdal.ReprojectImage(src_ds, dst_ds, label_wkt,
+                                    dst_def['wkt'],
+                                    gdalconst.GRA_NearestNeighbour)
+                zone_labels = dst_ds.ReadAsArray()
+            return cls(_coverage_weights(zone_labels, grid_def, supersample,
+                                         zone_ids.size),
+                       grid_def, zone_ids.tolist())
+        return cls._from_cache(cache_dir,
+                               cls.zone_hash(grid_def, zone_key,
+                                             supersample),
+                               calc_zonal_weights)
+
+    @classmethod
+    def from_dataset(cls, lsm, polygons=None, labels=None,
+                     polygon_projection=None, id_field=None,
+                     supersample=10, cache_dir=None):
+        """Create the zonal weights for the grid of a land surface model
+        dataset (see :func:`pangaea.LSMGridReader.zonal_weights`).
+
+        Parameters
+        ----------
+        lsm: :func:`pangaea.LSMGridReader`
+            Accessor of the dataset.
+
+        Returns
+        -------
+        :func:`ZonalWeights`
+        """
+        if polygons is not None:
+            return cls.from_polygons(lsm.grid_definition, polygons,
+                                     polygon_projection=polygon_projection,
+                                     id_field=id_field,
+                                     supersample=supersample,
+                                     cache_dir=cache_dir)
+        if labels is not None:
+            return cls.from_labels(lsm.grid_definition, labels,
+                                   supersample=supersample,
+                                   cache_dir=cache_dir)
+        raise ValueError("Need 'polygons' or 'labels' "
+                         "to create the zonal weights ...")
+
+    @classmethod
+    def from_file(cls, file_path):
+        """Load the zonal weights from a file.
+
+        Parameters
+        ----------
+        file_path: :obj:`str`
+            Path to the zonal weights file.
+
+        Returns
+        -------
+        :func:`ZonalWeights`
+        """
+        weights, zone_info = _load_weights(file_path)
+        return cls(weights, zone_info['grid'], zone_info['zone_ids'])
+
+    def to_file(self, file_path):
+        """Write the zonal weights to a file.
+
+        Parameters
+        ----------
+        file_path: :obj:`str`
+            Path to the output zonal weights file (.npz).
+        """
+        _save_weights(file_path, self.weights,
+                      {'grid': self.grid_def,
+                       'zone_ids': self.zone_ids})
+
+    def check_grid(self, grid_def):
+        """Check the zonal weights were created for the grid.
+
+        Parameters
+        ----------
+        grid_def: :obj:`dict`
+            Grid definition (see :func:`pangaea.warp.grid_definition`).
+
+        Raises
+        ------
+        ValueError
+            If the grid definition does not match the zonal weights.
+        """
+        if not _same_grid(self.grid_def, grid_def):
+            raise ValueError("The grid does not match "
+                             "the zonal weights grid ...")
+
+    def aggregate(self, data):
+        """Get the weighted mean of each zone for data
+        with dimensions (..., y, x).
+
+        .. note:: NaN values in the data are ignored
+            and the weights renormalized.
+
+        Parameters
+        ----------
+        data: :func:`numpy.ndarray`
+            Data on the grid (north up).
+
+        Returns
+        -------
+        :func:`numpy.ndarray`
+            Data with dimensions (..., zone).
+        """
+        data = np.asarray(data)
+        grid_shape = tuple(self.grid_def['shape'])
+        if data.shape[-2:] != grid_shape:
+            raise ValueError("Data shape {data_shape} does not match "
+                             "the zonal weights grid shape {grid_shape}."
+                             .format(data_shape=data.shape[-2:],
+                                     grid_shape=grid_shape))
+        lead_shape = data.shape[:-2]
+        flat_data = data.reshape((-1, grid_shape[0] * grid_shape[1])).T
+        invalid = np.isnan(flat_data)
+        if invalid.any():
+            zone_data = self.weights.dot(np.where(invalid, 0, flat_data))
+            zone_weights = self.weights.dot((~invalid).astype(np.float64))
+        else:
+            zone_data = self.weights.dot(flat_data)
+            zone_weights = np.asarray(self.weights.sum(axis=1))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            zone_data = zone_data / zone_weights
+        zone_data[np.broadcast_to(zone_weights <= 0, zone_data.shape)] = \
+            np.nan
+        return zone_data.T.reshape(lead_shape + (len(self.zone_ids),)) \
+            .astype(np.result_type(data.dtype, np.float32))
+
+    def aggregate_bands(self, data_array, band_chunk_size=None):
+        """Get the weighted mean of each zone for a stack of bands
+        with dimensions (band, y, x) in chunks of bands.
+
+        Parameters
+        ----------
+        data_array: :func:`xarray.DataArray` or :func:`numpy.ndarray`
+            3D array with dimensions (band, y, x).
+        band_chunk_size: int, optional
+            Number of bands to aggregate at once. Default is all bands.
+
+        Returns
+        -------
+        :func:`numpy.ndarray`
+            Data with dimensions (band, zone).
+        """
+        new_data = map_bands(self.aggregate, data_array, band_chunk_size)
+        count('bands_aggregated', data_array.shape[0])
+        return new_data
+
+
+def zonal_mean(lsm, variable, weights, band_chunk_size=None, lazy=False):
+    """Get the area weighted mean of a variable of a land surface model
+    dataset in each zone (see :func:`pangaea.LSMGridReader.zonal_mean`).
+
+    Parameters
+    ----------
+    lsm: :func:`pangaea.LSMGridReader`
+        Accessor of the dataset.
+    variable: :obj:`str`
+        Name of variable in dataset.
+    weights: :func:`ZonalWeights`
+        The zonal weights.
+
+    Returns
+    -------
+    :func:`xarray.DataArray`
+        Data with dimensions (time, zone).
+
+    Raises
+    ------
+    ValueError
+        If the zonal weights were created for another grid.
+    """
+    weights.check_grid(lsm.grid_definition)
+    data = lsm.getvar(variable)
+    num_zones = len(weights.zone_ids)
+    dtype = np.result_type(data.dtype, np.float32)
+    if lazy:
+        if data.chunks is None:
+            data = data.chunk()
+        dask_data = data.data.rechunk((band_chunk_size or
+                                       data.data.chunks[0], -1, -1))
+        zone_data = dask_data.map_blocks(
+            weights.aggregate,
+            drop_axis=2,
+            chunks=(dask_data.chunks[0], (num_zones,)),
+            dtype=dtype)
+    else:
+        zone_data = weights.aggregate_bands(data, band_chunk_size)
+    return xr.DataArray(
+        zone_data,
+        name=variable,
+        dims=(lsm.time_dim, 'zone'),
+        coords={
+            lsm.time_var: data[lsm.time_var],
+            'zone': weights.zone_ids,
+        },
+        attrs=dict(data.attrs))
@@ -10,6 +10,8 @@ from setuptools import setup, find_packages
 
 requires = [
     'gazar',
+    'pyproj',
+    'scipy',
     'wrf-python',
 ]
 
@@ -43,6 +45,13 @@ setup(name='pangaea',
               'pytest',
               'pytest-cov',
               'pylint',
+              'zarr',
+          ],
+          'zarr': [
+              'zarr',
+          ],
+          'numexpr': [
+              'numexpr',
           ],
           'docs': [
               'mock',
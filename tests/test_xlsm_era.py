@@ -6,8 +6,21 @@
 #  Author : Alan D Snow, 2017.
 #  License: BSD 3-Clause
 
+from glob import glob
+import json
+import os
 from os import path
+import shutil
+import subprocess
+import sys
+import threading
+try:
+    import tracemalloc
+except ImportError:
+    # python 2
+    tracemalloc = None
 
+import numpy as np
 from numpy.testing import assert_almost_equal
 import pandas as pd
 from affine import Affine
@@ -15,6 +28,7 @@ import pytest
 import xarray as xr
 
 import pangaea as pa
+from pangaea.log import Timer
 
 from .conftest import compare_proj4
 
@@ -33,8 +47,7 @@ class ERA(object):
         self.path_to_lsm_files = \
             path.join(tread, input_folder, '*.nc')
 
-    @property
-    def xd(self):
+    def open(self, **kwargs):
         return pa.open_mfdataset(self.path_to_lsm_files,
                                  lat_var=self.lsm_lat_var,
                                  lon_var=self.lsm_lon_var,
@@ -42,7 +55,12 @@ class ERA(object):
                                  lat_dim=self.lsm_lat_dim,
                                  lon_dim=self.lsm_lon_dim,
                                  time_dim=self.lsm_time_dim,
-                                 lon_to_180=True)
+                                 lon_to_180=True,
+                                 **kwargs)
+
+    @property
+    def xd(self):
+        return self.open()
 
 
 @pytest.fixture(scope="module")
@@ -134,6 +152,239 @@ def test_read_era(era):
         assert rainc.equals(lrainc)
 
 
+def test_read_era_parallel(era):
+    """Test reading in ERA Interim grids in parallel"""
+    with era.xd as xd, era.open(parallel=True, n_workers=2) as pxd:
+        assert (pxd.lsm.datetime == xd.lsm.datetime).all()
+        assert_almost_equal(pxd.lsm.geotransform, xd.lsm.geotransform)
+        assert_almost_equal(pxd.tp.values, xd.tp.values)
+
+
+@pytest.mark.parametrize("open_kwargs", [
+    dict(parallel=True),
+    dict(parallel=True, start_time='2016-01-03 03:00:00'),
+    dict(catalog='era_close_catalog.json'),
+])
+def test_read_era_close_files(era, tgrid, monkeypatch, open_kwargs):
+    """Test the file of each dataset is closed with the dataset"""
+    open_kwargs = dict(open_kwargs)
+    if 'catalog' in open_kwargs:
+        open_kwargs['catalog'] = path.join(tgrid.output,
+                                           open_kwargs['catalog'])
+    opened = []
+    open_dataset = xr.open_dataset
+
+    def record_open_dataset(*args, **kwargs):
+        xds = open_dataset(*args, **kwargs)
+        opened.append(xds)
+        return xds
+
+    def is_closed(xds):
+        return getattr(xds, '_close', getattr(xds, '_file_obj', None)) \
+            is None
+
+    monkeypatch.setattr(xr, 'open_dataset', record_open_dataset)
+    with era.open(**open_kwargs):
+        assert opened
+        assert not all(is_closed(xds) for xds in opened)
+    assert all(is_closed(xds) for xds in opened)
+
+
+def test_read_era_catalog(era, tgrid):
+    """Test reading in ERA Interim grids with a catalog"""
+    catalog = path.join(tgrid.output, 'era_catalog.json')
+    with era.xd as xd:
+        with era.open(catalog=catalog) as cxd:
+            assert path.exists(catalog)
+            assert (cxd.lsm.datetime == xd.lsm.datetime).all()
+            assert_almost_equal(cxd.tp.values, xd.tp.values)
+        # reopen from the existing catalog
+        pa.log_metrics()
+        pa.reset_metrics()
+        try:
+            with era.open(catalog=catalog) as cxd:
+                metrics = pa.get_metrics()
+                assert (cxd.lsm.datetime == xd.lsm.datetime).all()
+                assert_almost_equal(cxd.tp.values, xd.tp.values)
+        finally:
+            pa.log_metrics(False)
+            pa.reset_metrics()
+    # only the first file is opened and no files are scanned
+    assert metrics['counters']['files_opened'] == 1
+    assert 'files_scanned' not in metrics['counters']
+
+
+def test_read_era_catalog_open_once(era, tgrid, monkeypatch):
+    """Test each file is opened once to compute all of the variables"""
+    catalog = path.join(tgrid.output, 'era_open_once_catalog.json')
+    with era.open(catalog=catalog):
+        pass
+    opened = []
+    open_dataset = xr.open_dataset
+
+    def record_open_dataset(filename, *args, **kwargs):
+        opened.append(filename)
+        return open_dataset(filename, *args, **kwargs)
+
+    monkeypatch.setattr(xr, 'open_dataset', record_open_dataset)
+    with era.open(catalog=catalog) as cxd:
+        cxd.load()
+    assert len(opened) > 1
+    assert len(set(opened)) == len(opened)
+
+
+def test_read_era_catalog_times(era, tgrid):
+    """Test the time values are read from the catalog"""
+    catalog = path.join(tgrid.output, 'era_times_catalog.json')
+    with era.open(catalog=catalog) as cxd:
+        times = cxd.lsm.datetime
+    # shift the catalog times without changing the files
+    with open(catalog) as catalog_file:
+        catalog_info = json.load(catalog_file)
+    for entry in catalog_info['files'].values():
+        entry['time'] = [(pd.Timestamp(time_value) +
+                          pd.Timedelta(hours=1)).isoformat()
+                         for time_value in entry['time']]
+    with open(catalog, 'w') as catalog_file:
+        json.dump(catalog_info, catalog_file)
+    with era.open(catalog=catalog,
+                  start_time='2016-01-03 01:00:00',
+                  end_time='2016-01-03 13:00:00') as cxd:
+        assert (cxd.lsm.datetime ==
+                pd.to_datetime(['2016-01-03 01:00:00', '2016-01-03 04:00:00',
+                                '2016-01-03 07:00:00', '2016-01-03 10:00:00',
+                                '2016-01-03 13:00:00'])).all()
+    with era.open(catalog=catalog) as cxd:
+        assert (cxd.lsm.datetime == times + pd.Timedelta(hours=1)).all()
+
+
+def test_read_era_time_window(era, tgrid):
+    """Test reading in ERA Interim grids in a time window"""
+    start_time = '2016-01-03 03:00:00'
+    end_time = '2016-01-03 12:00:00'
+    date_array = ['2016-01-03 03:00:00', '2016-01-03 06:00:00',
+                  '2016-01-03 09:00:00', '2016-01-03 12:00:00']
+    with era.xd as xd:
+        subset_tp = xd.tp.sel(time=slice(start_time, end_time)).values
+    with era.open(start_time=start_time,
+                  end_time=end_time,
+                  filename_time_format='%Y%m%d') as sxd:
+        assert (sxd.lsm.datetime == pd.to_datetime(date_array)).all()
+        assert_almost_equal(sxd.tp.values, subset_tp)
+        assert sxd.lsm.lon_to_180
+    catalog = path.join(tgrid.output, 'era_window_catalog.json')
+    with era.open(start_time=start_time,
+                  end_time=end_time,
+                  catalog=catalog) as sxd:
+        assert (sxd.lsm.datetime == pd.to_datetime(date_array)).all()
+        assert_almost_equal(sxd.tp.values, subset_tp)
+
+
+def test_append_zarr_era(era, tgrid):
+    """Test appending ERA Interim files to a zarr store"""
+    out_store = path.join(tgrid.output, 'era_append.zarr')
+    kwargs = dict(lat_var=era.lsm_lat_var,
+                  lon_var=era.lsm_lon_var,
+                  time_var=era.lsm_time_var,
+                  lat_dim=era.lsm_lat_dim,
+                  lon_dim=era.lsm_lon_dim,
+                  time_dim=era.lsm_time_dim,
+                  lon_to_180=True)
+    first_files = era.path_to_lsm_files.replace('*', '*20160102*')
+    assert pa.append_zarr(first_files, out_store, **kwargs)
+    new_files = pa.append_zarr(era.path_to_lsm_files, out_store, **kwargs)
+    assert new_files
+    assert not any('20160102' in new_file for new_file in new_files)
+    assert not pa.append_zarr(era.path_to_lsm_files, out_store, **kwargs)
+    with era.xd as xd, pa.open_zarr(out_store) as zxd:
+        assert zxd.lsm.lon_to_180
+        assert (zxd.lsm.datetime.sort_values() == xd.lsm.datetime).all()
+        assert_almost_equal(zxd.tp.sortby('time').values, xd.tp.values)
+
+
+def test_append_zarr_era_changed_file(era, tgrid):
+    """Test files changed since they were appended are rejected"""
+    input_dir = path.join(tgrid.output, 'era_changed')
+    os.makedirs(input_dir)
+    for era_file in glob(era.path_to_lsm_files.replace('*', '*20160102*')):
+        shutil.copy(era_file, input_dir)
+    out_store = path.join(tgrid.output, 'era_changed.zarr')
+    kwargs = dict(lat_var=era.lsm_lat_var,
+                  lon_var=era.lsm_lon_var,
+                  time_var=era.lsm_time_var,
+                  lat_dim=era.lsm_lat_dim,
+                  lon_dim=era.lsm_lon_dim,
+                  time_dim=era.lsm_time_dim,
+                  lon_to_180=True)
+    input_files = path.join(input_dir, '*.nc')
+    assert pa.append_zarr(input_files, out_store, **kwargs)
+    assert not pa.append_zarr(input_files, out_store, **kwargs)
+    changed_file = sorted(glob(input_files))[0]
+    file_stat = os.stat(changed_file)
+    os.utime(changed_file, (file_stat.st_atime, file_stat.st_mtime + 10))
+    with pytest.raises(ValueError):
+        pa.append_zarr(input_files, out_store, **kwargs)
+
+
+def test_coords_cache_era(era):
+    """Test caching ERA Interim coordinates"""
+    with era.xd as xd:
+        lat, lon = xd.lsm.latlon
+        assert xd.lsm.latlon[0] is lat
+        assert not lon.flags.writeable
+        assert xd.lsm.is_rectilinear
+        y_axis, x_axis = xd.lsm.axes
+        assert_almost_equal(y_axis, lat[:, 0])
+        assert_almost_equal(x_axis, lon[0])
+        # changing the settings invalidates the cache
+        xd.lsm.lon_to_180 = False
+        assert_almost_equal(xd.lsm.latlon[1], lon % 360)
+        xd.lsm.lon_to_180 = True
+        assert_almost_equal(xd.lsm.latlon[1], lon)
+
+
+def test_getvar_bbox_era(era):
+    """Test getting ERA Interim grids within a bounding box"""
+    bbox = (-112.4, 40.1, -111.6, 41.2)
+    with era.xd as xd:
+        yslice, xslice = xd.lsm.bbox_slices(bbox)
+        assert yslice == slice(1, 4)
+        assert xslice == slice(1, 4)
+        # polygon vertices
+        polygon = [(-112.4, 40.1), (-112.4, 41.2), (-111.6, 40.1)]
+        assert xd.lsm.bbox_slices(polygon) == (yslice, xslice)
+        btp = xd.lsm.getvar_bbox('tp', bbox)
+        assert btp.shape == (len(xd.lsm.datetime), 3, 3)
+        assert btp.equals(xd.lsm.getvar('tp', yslice=yslice, xslice=xslice))
+        with pytest.raises(ValueError):
+            xd.lsm.bbox_slices((-90, 10, -89, 11))
+
+
+def test_getvar_points_era(era):
+    """Test getting ERA Interim time series at points"""
+    rows = np.array([1, 2, 3])
+    cols = np.array([1, 3, 2])
+    with era.xd as xd:
+        lat, lon = xd.lsm.latlon
+        tp = xd.lsm.getvar('tp').values
+        ptp = xd.lsm.getvar_points('tp', lon[rows, cols], lat[rows, cols])
+        assert ptp.dims == ('time', 'point')
+        assert_almost_equal(ptp.values, tp[:, rows, cols])
+        # longitude from 0 to 360
+        ptp = xd.lsm.getvar_points('tp', lon[rows, cols] % 360,
+                                   lat[rows, cols], time_chunk_size=5)
+        assert_almost_equal(ptp.values, tp[:, rows, cols])
+        # bilinear between cell centers and outside of grid
+        ptp = xd.lsm.getvar_points('tp',
+                                   [(lon[1, 1] + lon[1, 2]) / 2, -90],
+                                   [lat[1, 1], 10],
+                                   method='bilinear')
+        assert_almost_equal(ptp.values[:, 0],
+                            (tp[:, 1, 1] + tp[:, 1, 2]) / 2,
+                            decimal=5)
+        assert np.isnan(ptp.values[:, 1]).all()
+
+
 def test_resample_era(era, tgrid):
     """Test resample ERA Interim grid"""
     resample_grid = path.join(tgrid.input, 'resample_grid.asc')
@@ -150,3 +401,402 @@ def test_resample_era(era, tgrid):
         assert_almost_equal(rsd.lsm.geotransform,
                             xdc.lsm.geotransform,
                             decimal=3)
+
+
+def test_resample_era_band_chunks(era, tgrid):
+    """Test resample ERA Interim grid in chunks of bands"""
+    resample_grid = path.join(tgrid.input, 'resample_grid.asc')
+    with era.xd as xd:
+        rsd = xd.lsm.resample('tp', match_grid=resample_grid,
+                              band_chunk_size=7)
+
+    compare_netcdf = path.join(tgrid.compare, 'resample_era.nc')
+    with xr.open_dataset(compare_netcdf) as xdc:
+        assert_almost_equal(rsd.tp.values, xdc.tp.values)
+        assert_almost_equal(rsd.lsm.geotransform,
+                            xdc.lsm.geotransform,
+                            decimal=3)
+
+
+@pytest.mark.parametrize("dtype", ['float32', 'float64', 'int32'])
+def test_resample_era_lazy_dtype(era, tgrid, dtype):
+    """Test lazy resample keeps the data type of the source"""
+    resample_grid = path.join(tgrid.input, 'resample_grid.asc')
+    with era.xd as xd:
+        xd['tp_cast'] = xd.tp.astype(dtype)
+        rsd = xd.lsm.resample('tp_cast', match_grid=resample_grid,
+                              band_chunk_size=7, lazy=True)
+        expected_dtype = np.result_type(dtype, np.float32)
+        assert rsd.tp_cast.dtype == expected_dtype
+        assert rsd.tp_cast.values.dtype == expected_dtype
+
+
+def test_resample_era_parallel_float64(era, tgrid):
+    """Test resample float64 ERA Interim grid in parallel"""
+    resample_grid = path.join(tgrid.input, 'resample_grid.asc')
+    with era.xd as xd:
+        xd['tp64'] = xd.tp.astype(np.float64)
+        rsd = xd.lsm.resample('tp64', match_grid=resample_grid,
+                              band_chunk_size=7)
+        prsd = xd.lsm.resample('tp64', match_grid=resample_grid,
+                               band_chunk_size=7, n_workers=2)
+    assert prsd.tp64.dtype == np.float64
+    assert_almost_equal(prsd.tp64.values, rsd.tp64.values)
+
+
+def test_regridder_era(era, tgrid):
+    """Test resample ERA Interim grid with cached regridder"""
+    resample_grid = path.join(tgrid.input, 'resample_grid.asc')
+    cache_dir = path.join(tgrid.output, 'regrid_cache')
+    with era.xd as xd:
+        regridder = xd.lsm.regridder(match_grid=resample_grid,
+                                     method='nearest',
+                                     cache_dir=cache_dir)
+        assert len(os.listdir(cache_dir)) == 1
+        cached_regridder = xd.lsm.regridder(match_grid=resample_grid,
+                                            method='nearest',
+                                            cache_dir=cache_dir)
+        assert (regridder.weights != cached_regridder.weights).nnz == 0
+        rsd = xd.lsm.resample('tp', match_grid=resample_grid,
+                              regridder=cached_regridder)
+        tp_values = xd.tp.values
+        # default area weighted average
+        average_regridder = xd.lsm.regridder(match_grid=resample_grid)
+        ard = xd.lsm.resample('tp', match_grid=resample_grid,
+                              regridder=average_regridder)
+
+    compare_netcdf = path.join(tgrid.compare, 'resample_era.nc')
+    with xr.open_dataset(compare_netcdf) as xdc:
+        assert rsd.tp.shape == xdc.tp.shape
+        assert_almost_equal(rsd.lsm.geotransform,
+                            xdc.lsm.geotransform,
+                            decimal=3)
+        assert_almost_equal(ard.tp.values, xdc.tp.values)
+        assert_almost_equal(ard.lsm.geotransform,
+                            xdc.lsm.geotransform,
+                            decimal=3)
+    # nearest neighbor only uses values from the original grid
+    assert np.isin(rsd.tp.values[~np.isnan(rsd.tp.values)],
+                   tp_values.astype(rsd.tp.dtype)).all()
+
+
+def test_regridder_era_grid_mismatch(era, tgrid):
+    """Test regridder created for another grid is rejected"""
+    resample_grid = path.join(tgrid.input, 'resample_grid.asc')
+    with era.xd as xd:
+        proj_regridder = xd.lsm.regridder(projection=xd.lsm.projection,
+                                          method='nearest')
+        with pytest.raises(ValueError):
+            xd.lsm.resample('tp', match_grid=resample_grid,
+                            regridder=proj_regridder)
+
+
+def test_regridder_era_bilinear_edges(era):
+    """Test bilinear regridder only uses points inside the source grid"""
+    from pangaea.regrid import Regridder
+    with era.xd as xd:
+        src_def = xd.lsm.grid_definition
+        geotransform = list(src_def['geotransform'])
+        geotransform[0] -= geotransform[1]
+        geotransform[3] -= geotransform[5]
+        # destination grid with one extra cell on each side
+        dst_def = dict(src_def,
+                       geotransform=geotransform,
+                       shape=[dim + 2 for dim in src_def['shape']])
+        regridder = Regridder.from_grids(src_def, dst_def,
+                                         method='bilinear')
+        tp_values = xd.tp.values[:2]
+    new_data = regridder.regrid(tp_values)
+    assert np.isnan(new_data[:, 0]).all()
+    assert np.isnan(new_data[:, -1]).all()
+    assert np.isnan(new_data[:, :, 0]).all()
+    assert np.isnan(new_data[:, :, -1]).all()
+    assert_almost_equal(new_data[:, 1:-1, 1:-1], tp_values, decimal=5)
+
+
+@pytest.mark.parametrize("use_numexpr", [True, False])
+def test_getvar_derived_era(era, monkeypatch, use_numexpr):
+    """Test getting derived variables from ERA Interim grids"""
+    import pangaea.derived
+    if not use_numexpr:
+        monkeypatch.setattr(pangaea.derived, 'numexpr', None)
+    kwargs = dict(yslice=slice(1, 4), xslice=slice(0, 3))
+    with era.xd as xd:
+        u10 = xd.lsm.getvar('u10', **kwargs).values
+        v10 = xd.lsm.getvar('v10', **kwargs).values
+        wind_speed = xd.lsm.getvar('wind_speed', **kwargs)
+        assert wind_speed.shape == u10.shape
+        assert wind_speed.attrs['units'] == 'm s**-1'
+        assert_almost_equal(wind_speed.values, np.sqrt(u10**2 + v10**2),
+                            decimal=5)
+        relative_humidity = xd.lsm.getvar('relative_humidity').values
+        assert np.nanmax(relative_humidity) <= 100.5
+        assert np.nanmin(relative_humidity) > 0
+        with pytest.raises(KeyError):
+            xd.lsm.getvar('net_radiation')
+
+
+def test_getvar_deaccumulate_era(era):
+    """Test de-accumulating ERA Interim forecast precipitation"""
+    with era.xd as xd:
+        tp = xd.lsm.getvar('tp').values
+        times = xd.lsm.datetime
+        dtp = xd.lsm.getvar('tp', deaccumulate=True,
+                            accumulation_reset='12h')
+        assert dtp.chunks is not None
+        # forecasts from 00 and 12 UTC end at 00 and 12 UTC
+        resets = np.ones(len(times), dtype=bool)
+        resets[1:] = (times[:-1].hour % 12 == 0) & (times[:-1].minute == 0)
+        expected = np.where(resets[:, None, None],
+                            tp, tp - np.roll(tp, 1, axis=0))
+        assert_almost_equal(dtp.values, expected)
+        dtp = xd.lsm.getvar('tp', deaccumulate=True,
+                            accumulation_reset=resets)
+        assert_almost_equal(dtp.values, expected)
+
+
+def test_getvar_deaccumulate_era_detect_resets(era):
+    """Test de-accumulating ERA Interim forecast precipitation
+    with the resets detected from the data"""
+    with era.xd as xd:
+        # no 'initial_time' coordinate to find the resets
+        with pytest.raises(ValueError):
+            xd.lsm.getvar('tp', deaccumulate=True)
+        dtp = xd.lsm.getvar('tp', deaccumulate=True,
+                            accumulation_reset='detect').values
+        cycle_dtp = xd.lsm.getvar('tp', deaccumulate=True,
+                                  accumulation_reset='12h').values
+    # no negative precipitation (except rounding errors)
+    assert np.nanmin(dtp) > -1e-12
+    assert_almost_equal(dtp, cycle_dtp)
+
+
+def test_getvar_deaccumulate_detect_resets_packed(tgrid):
+    """Test detecting the resets of int16 packed accumulations
+    with a different scale factor in each file"""
+    times = pd.date_range('2016-01-02 03:00', periods=8, freq='3h')
+    rng = np.random.RandomState(42)
+    steps = rng.uniform(0.0001, 0.002, size=(8, 6, 6))
+    # forecasts from 00 and 12 UTC
+    tp = np.concatenate([steps[:4].cumsum(axis=0),
+                         steps[4:].cumsum(axis=0)])
+    # small decrease in one cell that is not a reset
+    tp[2, 1, 1] = tp[1, 1, 1] - 0.0005
+    packed_dir = path.join(tgrid.output, 'packed')
+    os.mkdir(packed_dir)
+    for file_index, file_times in enumerate((slice(0, 4), slice(4, 8))):
+        file_tp = tp[file_times]
+        xr.Dataset(
+            {'tp': (('time', 'latitude', 'longitude'), file_tp)},
+            coords={'time': times[file_times],
+                    'latitude': np.arange(45.0, 39.0, -1.0),
+                    'longitude': np.arange(-100.0, -94.0, 1.0)},
+        ).to_netcdf(
+            path.join(packed_dir, 'packed_{}.nc'.format(file_index)),
+            encoding={'tp': {'dtype': 'int16',
+                             'scale_factor': file_tp.max() / 30000,
+                             'add_offset': 0.0,
+                             '_FillValue': -32767}})
+
+    with ERA(tgrid.output, 'packed').open() as xd:
+        assert xd.tp.encoding['scale_factor'] > 0
+        dtp = xd.lsm.getvar('tp', deaccumulate=True,
+                            accumulation_reset='detect')
+        assert dtp.chunks is not None
+        cycle_dtp = xd.lsm.getvar('tp', deaccumulate=True,
+                                  accumulation_reset='12h')
+        assert_almost_equal(dtp.values, cycle_dtp.values)
+        assert dtp.values[2, 1, 1] < 0
+
+
+def test_aggregate_time_era(era):
+    """Test aggregating ERA Interim grids in time"""
+    with era.xd as xd:
+        # the ERA Interim forecasts restart at 00Z and 12Z
+        dtp = xd.lsm.getvar('tp', deaccumulate=True,
+                            accumulation_reset='12h').compute()
+        dtp['time'] = xd.lsm.datetime
+        expected = dtp.resample(time='D', closed='right',
+                                label='right').sum()
+        daily_tp = xd.lsm.aggregate_time('tp', 'D', tile_size=2,
+                                         accumulation_reset='12h')
+        assert daily_tp.attrs['cell_methods'] == 'time: sum'
+        assert (daily_tp['time'].values == expected['time'].values).all()
+        assert_almost_equal(daily_tp.values, expected.values)
+        # no 'initial_time' coordinate to find the resets
+        with pytest.raises(ValueError):
+            xd.lsm.aggregate_time('tp', 'D')
+        daily_tp = xd.lsm.aggregate_time('tp', 'D', tile_size=2,
+                                         accumulation_reset='detect')
+        assert_almost_equal(daily_tp.values, expected.values)
+        assert np.nanmin(daily_tp.values) > -1e-12
+
+        t2m = xd.lsm.getvar('t2m').compute()
+        t2m['time'] = xd.lsm.datetime
+        max_t2m = xd.lsm.aggregate_time('t2m', '12h', method='max',
+                                        time_chunk_size=3)
+        expected = t2m.resample(time='12h').max()
+        assert_almost_equal(max_t2m.values, expected.values)
+
+
+def test_interpolate_time_era(era):
+    """Test interpolating ERA Interim grids in time"""
+    with era.xd as xd:
+        times = xd.lsm.datetime
+        t2m = xd.lsm.getvar('t2m').values
+        hourly_t2m = xd.lsm.interpolate_time('t2m', freq='h', tile_size=2)
+        assert hourly_t2m.shape[0] == \
+            (times[-1] - times[0]) // pd.Timedelta(hours=1) + 1
+        original = np.isin(hourly_t2m['time'].values, times.values)
+        assert_almost_equal(hourly_t2m.values[original], t2m)
+        mid_t2m = xd.lsm.interpolate_time(
+            't2m', times=[times[0] + (times[1] - times[0]) / 2])
+        assert_almost_equal(mid_t2m.values[0], (t2m[0] + t2m[1]) / 2,
+                            decimal=4)
+        with pytest.raises(ValueError):
+            xd.lsm.interpolate_time('t2m',
+                                    times=[times[0] - pd.Timedelta(1, 'h')])
+
+
+def test_zonal_mean_era(era, tgrid):
+    """Test area weighted zonal mean of ERA Interim grid"""
+    zone_ids = [10, 20]
+    with era.xd as xd:
+        tp = xd.lsm.getvar('tp').values
+        lat, _ = xd.lsm.latlon
+        labels = np.zeros(lat.shape, dtype=np.int64)
+        labels[:2, :2] = zone_ids[0]
+        labels[2:, 1:] = zone_ids[1]
+        zonal_weights = xd.lsm.zonal_weights(labels=labels)
+        assert zonal_weights.zone_ids == zone_ids
+        ztp = xd.lsm.zonal_mean('tp', zonal_weights)
+        assert ztp.dims == ('time', 'zone')
+        assert list(ztp['zone'].values) == zone_ids
+        cell_area = np.cos(np.radians(lat))
+        for zone_index, zone_id in enumerate(zone_ids):
+            in_zone = labels == zone_id
+            assert_almost_equal(ztp.values[:, zone_index],
+                                (tp[:, in_zone] * cell_area[in_zone])
+                                .sum(axis=1) / cell_area[in_zone].sum(),
+                                decimal=5)
+
+        # polygon around the cells of the first zone
+        x_min, x_res, _, y_max, _, y_res = xd.lsm.geotransform
+        polygon = ('POLYGON (({0} {1}, {2} {1}, {2} {3}, {0} {3}, {0} {1}))'
+                   .format(x_min, y_max, x_min + 2 * x_res, y_max + 2 * y_res))
+        cache_dir = path.join(tgrid.output, 'zonal_cache')
+        polygon_weights = xd.lsm.zonal_weights(polygons=[polygon],
+                                               cache_dir=cache_dir)
+        assert len(os.listdir(cache_dir)) == 1
+        cached_weights = xd.lsm.zonal_weights(polygons=[polygon],
+                                              cache_dir=cache_dir)
+        assert (polygon_weights.weights != cached_weights.weights).nnz == 0
+        ptp = xd.lsm.zonal_mean('tp', cached_weights,
+                                band_chunk_size=5, lazy=True)
+        assert_almost_equal(ptp.values[:, 0], ztp.values[:, 0], decimal=5)
+
+
+def test_zonal_mean_era_grid_mismatch(era):
+    """Test zonal weights created for another grid are rejected"""
+    from pangaea.zonal import ZonalWeights
+    with era.xd as xd:
+        grid_def = xd.lsm.grid_definition
+        geotransform = list(grid_def['geotransform'])
+        geotransform[0] += geotransform[1]
+        # same shape, shifted by one cell
+        shifted_def = dict(grid_def, geotransform=geotransform)
+        labels = np.ones(grid_def['shape'], dtype=np.int64)
+        zonal_weights = ZonalWeights.from_labels(shifted_def, labels)
+        with pytest.raises(ValueError):
+            xd.lsm.zonal_mean('tp', zonal_weights)
+
+
+def test_metrics_era(era, tgrid):
+    """Test timing and counter metrics with resample ERA Interim grid"""
+    resample_grid = path.join(tgrid.input, 'resample_grid.asc')
+    pa.log_metrics()
+    pa.reset_metrics()
+    try:
+        with era.xd as xd:
+            xd.lsm.resample('tp', match_grid=resample_grid)
+        metrics = pa.get_metrics()
+    finally:
+        pa.log_metrics(False)
+        pa.reset_metrics()
+
+    assert metrics['timers']['open_mfdataset']['count'] == 1
+    assert metrics['timers']['lsm.resample']['total'] > 0
+    assert metrics['counters']['files_opened'] > 0
+    assert metrics['counters']['bands_warped'] > 0
+    assert metrics['counters']['bytes_read'] > 0
+
+
+@pytest.mark.skipif(not hasattr(tracemalloc, 'reset_peak'),
+                    reason="requires tracemalloc.reset_peak")
+def test_metrics_nested_peak_memory():
+    """Test nested timers keep the peak memory of the parent"""
+    pa.log_metrics(trace_memory=True)
+    pa.reset_metrics()
+    try:
+        with Timer('outer'):
+            big_array = np.ones(10**7)
+            del big_array
+            with Timer('inner'):
+                np.ones(10)
+        peak_memory = pa.get_metrics()['peak_memory']
+    finally:
+        pa.log_metrics(False)
+        pa.reset_metrics()
+    assert peak_memory['outer'] >= 8e7
+    assert peak_memory['inner'] < 8e7
+
+
+@pytest.mark.skipif(not hasattr(tracemalloc, 'reset_peak'),
+                    reason="requires tracemalloc.reset_peak")
+def test_metrics_thread_peak_memory():
+    """Test timers in other threads keep the peak memory of the parent"""
+    def small_operation():
+        with Timer('thread'):
+            np.ones(10)
+
+    pa.log_metrics(trace_memory=True)
+    pa.reset_metrics()
+    try:
+        with Timer('outer'):
+            big_array = np.ones(10**7)
+            del big_array
+            thread = threading.Thread(target=small_operation)
+            thread.start()
+            thread.join()
+        peak_memory = pa.get_metrics()['peak_memory']
+    finally:
+        pa.log_metrics(False)
+        pa.reset_metrics()
+    assert peak_memory['outer'] >= 8e7
+    assert peak_memory['thread'] < 8e7
+
+
+@pytest.mark.skipif(not hasattr(tracemalloc, 'reset_peak'),
+                    reason="requires tracemalloc.reset_peak")
+def test_metrics_keep_user_tracemalloc():
+    """Test tracemalloc started by the user is not stopped"""
+    tracemalloc.start()
+    try:
+        pa.log_metrics(trace_memory=True)
+        pa.log_metrics(False)
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+    pa.log_metrics(trace_memory=True)
+    assert tracemalloc.is_tracing()
+    pa.log_metrics(False)
+    assert not tracemalloc.is_tracing()
+
+
+def test_import_lazy():
+    """Test importing pangaea does not load GDAL, gazar, wrf, or pyproj"""
+    code = ("import sys; import pangaea; "
+            "print(','.join(sorted(set(sys.modules) & "
+            "{'osgeo', 'gazar', 'wrf', 'pyproj'})))")
+    loaded = subprocess.check_output([sys.executable, '-c', code])
+    assert loaded.decode().strip() == ''
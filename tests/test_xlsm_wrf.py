@@ -8,12 +8,15 @@
 
 from os import path
 
+import numpy as np
 from numpy.testing import assert_almost_equal
 import pandas as pd
 from affine import Affine
+from osgeo import gdal
 import pytest
 
 import pangaea as pa
+from pangaea.transform import transform_points
 
 from .conftest import compare_proj4, compare_rasters
 
@@ -139,6 +142,161 @@ def test_read_wrf(wrf):
             lcldfr = xd.lsm.getvar('CLDFRA', calc_4d_dim='bottom_top')
 
 
+def test_read_wrf_time_format(wrf):
+    """Test reading in WRF grid with the time format"""
+    with wrf.xd as xd, \
+            pa.open_mfdataset(wrf.path_to_lsm_files,
+                              lat_var=wrf.lsm_lat_var,
+                              lon_var=wrf.lsm_lon_var,
+                              time_var=wrf.lsm_time_var,
+                              lat_dim=wrf.lsm_lat_dim,
+                              lon_dim=wrf.lsm_lon_dim,
+                              time_dim=wrf.lsm_time_dim,
+                              time_format='%Y-%m-%d_%H:%M:%S') as fxd:
+        assert isinstance(fxd.lsm.datetime, pd.DatetimeIndex)
+        assert (fxd.lsm.datetime == xd.lsm.datetime).all()
+
+
+def test_wrf_getvar_native(wrf):
+    """Test getting WRF variables in the original orientation"""
+    with wrf.xd as xd:
+        lrainc = xd.lsm.getvar('RAINC',
+                               yslice=slice(200, 202),
+                               xslice=slice(100, 102),
+                               north_up=False)
+        assert lrainc.attrs['y_inverted']
+        rainc = xd['RAINC'][:, 23:25, 100:102]
+        assert rainc.equals(lrainc)
+        # step in y-direction
+        lrainc = xd.lsm.getvar('RAINC', yslice=slice(1, 10, 4))
+        rainc = xd['RAINC'][:, ::-1][:, 1:10:4]
+        assert rainc.equals(lrainc)
+
+
+def test_wrf_getvar_index(wrf):
+    """Test getting WRF variables with integer indices"""
+    with wrf.xd as xd:
+        flipped_rainc = xd['RAINC'][:, ::-1]
+        lrainc = xd.lsm.getvar('RAINC', yslice=200, xslice=100)
+        assert lrainc.dims == ('time',)
+        assert_almost_equal(lrainc.values,
+                            flipped_rainc[:, 200, 100].values)
+        lrainc = xd.lsm.getvar('RAINC', yslice=-1, xslice=slice(100, 102))
+        assert_almost_equal(lrainc.values,
+                            flipped_rainc[:, -1, 100:102].values)
+        with pytest.raises(IndexError):
+            xd.lsm.getvar('RAINC', yslice=xd.lsm.y_size)
+        with pytest.raises(ValueError):
+            xd.lsm.getvar('RAINC', yslice=1.5)
+
+
+def test_wrf_getvar_points(wrf):
+    """Test getting WRF time series at points with the KD-tree"""
+    rows = np.array([0, 23, 200, 224])
+    cols = np.array([0, 100, 101, 287])
+    with wrf.xd as xd:
+        lat, lon = xd.lsm.latlon
+        rainc = xd.lsm.getvar('RAINC').values
+        prainc = xd.lsm.getvar_points('RAINC',
+                                      lon[rows, cols], lat[rows, cols])
+        assert_almost_equal(prainc.values, rainc[:, rows, cols])
+        prainc = xd.lsm.getvar_points('RAINC',
+                                      lon[rows, cols], lat[rows, cols],
+                                      method='bilinear',
+                                      time_chunk_size=3)
+        assert_almost_equal(prainc.values, rainc[:, rows, cols],
+                            decimal=3)
+
+
+def test_wrf_getvar_deaccumulate(wrf):
+    """Test de-accumulating WRF precipitation"""
+    with wrf.xd as xd:
+        rainc = xd.lsm.getvar('RAINC').values
+        drainc = xd.lsm.getvar('RAINC', deaccumulate=True,
+                               accumulation_reset=False)
+        assert_almost_equal(drainc.values[0], rainc[0])
+        assert_almost_equal(drainc.values[1:], np.diff(rainc, axis=0))
+
+
+def test_wrf_getvar_4d(wrf):
+    """Test reducing WRF 4D variables"""
+    with wrf.xd as xd:
+        kwargs = dict(yslice=slice(200, 202),
+                      xslice=slice(100, 102),
+                      calc_4d_dim='bottom_top')
+        lcldfr = xd.lsm.getvar('CLDFRA',
+                               calc_4d_method=['max', 'mean'],
+                               **kwargs)
+        assert list(lcldfr['method'].values) == ['max', 'mean']
+        assert_almost_equal(
+            lcldfr.sel(method='max').values,
+            xd.lsm.getvar('CLDFRA', calc_4d_method='max', **kwargs).values)
+        # weighted mean
+        num_layers = xd.dims['bottom_top']
+        wcldfr = xd.lsm.getvar('CLDFRA',
+                               calc_4d_method='mean',
+                               calc_4d_weights=[2.0] * num_layers,
+                               **kwargs)
+        assert_almost_equal(wcldfr.values,
+                            lcldfr.sel(method='mean').values)
+        # layer selection
+        scldfr = xd.lsm.getvar('CLDFRA',
+                               calc_4d_method='max',
+                               calc_4d_slice=slice(0, 2),
+                               **kwargs)
+        cldfr = xd['CLDFRA'][:, :2, ::-1][:, :, 200:202, 100:102] \
+            .max(dim='bottom_top')
+        assert_almost_equal(scldfr.values, cldfr.values)
+        with pytest.raises(ValueError):
+            xd.lsm.getvar('CLDFRA',
+                          calc_4d_method='max',
+                          calc_4d_weights=[2.0] * num_layers,
+                          **kwargs)
+
+
+def test_wrf_metadata_geotransform(wrf):
+    """Test WRF geotransform from the grid metadata"""
+    with wrf.xd as xd:
+        xd.lsm.geotransform_from_metadata = True
+        assert_almost_equal(xd.lsm.geotransform,
+                            (-872999.84920640418, 5999.9997414365271, 0,
+                             657001.05737870606, 0, -6000.0006532160332),
+                            decimal=-3)
+        assert xd.lsm._verify_geotransform(xd.lsm.geotransform)
+        assert not xd.lsm._verify_geotransform(
+            (-863000.0, 6000.0, 0, 657000.0, 0, -6000.0))
+
+
+def test_wrf_transform_chunks(wrf):
+    """Test transforming WRF coordinates in chunks"""
+    with wrf.xd as xd:
+        lat, lon = xd.lsm.latlon
+        x_coords, y_coords = transform_points('epsg:4326',
+                                              xd.lsm.projection,
+                                              lon, lat,
+                                              chunk_size=1000)
+        assert x_coords.dtype == 'float64'
+        assert_almost_equal(y_coords, xd.lsm.coords[0], decimal=3)
+        assert_almost_equal(x_coords, xd.lsm.coords[1], decimal=3)
+
+
+def test_wrf_zarr(wrf, tgrid):
+    """Test WRF export to and read from zarr"""
+    out_store = path.join(tgrid.output, 'wrf.zarr')
+    with wrf.xd as xd:
+        xd.lsm.to_zarr(out_store, variables=['RAINC'], mode='w')
+        with pa.open_zarr(out_store) as zxd:
+            assert not zxd.lsm.y_inverted
+            assert zxd.lsm.y_var == wrf.lsm_lat_var
+            assert (zxd.lsm.datetime == xd.lsm.datetime).all()
+            compare_proj4(zxd.lsm.projection.ExportToProj4(),
+                          xd.lsm.projection.ExportToProj4())
+            assert_almost_equal(zxd.lsm.geotransform, xd.lsm.geotransform)
+            assert_almost_equal(zxd.lsm.latlon, xd.lsm.latlon)
+            assert_almost_equal(zxd.lsm.getvar('RAINC').values,
+                                xd.lsm.getvar('RAINC').values)
+
+
 def test_wrf_tiff(wrf, tgrid):
     """Test write wrf grid"""
     new_raster = path.join(tgrid.output, 'wrf_rainc.tif')
@@ -148,6 +306,27 @@ def test_wrf_tiff(wrf, tgrid):
     compare_rasters(path.join(tgrid.compare, 'wrf_rainc.tif'), new_raster)
 
 
+def test_wrf_tiffs(wrf, tgrid):
+    """Test write all time steps of wrf grid"""
+    series_raster = path.join(tgrid.output, 'wrf_rainc_{index:02d}.tif')
+    multiband_raster = path.join(tgrid.output, 'wrf_rainc_all.tif')
+    with wrf.xd as xd:
+        xd.lsm.to_tifs('RAINC', series_raster,
+                       band_chunk_size=5, n_workers=2)
+        xd.lsm.to_tifs('RAINC', multiband_raster, band_chunk_size=5)
+
+    compare_raster = path.join(tgrid.compare, 'wrf_rainc.tif')
+    compare_rasters(compare_raster, series_raster.format(index=3))
+    ds_c = gdal.Open(compare_raster)
+    ds_m = gdal.Open(multiband_raster)
+    assert ds_m.RasterCount == 16
+    assert_almost_equal(ds_m.GetRasterBand(4).ReadAsArray(),
+                        ds_c.GetRasterBand(1).ReadAsArray())
+    assert_almost_equal(ds_m.GetGeoTransform(),
+                        ds_c.GetGeoTransform(),
+                        decimal=5)
+
+
 def test_wrf_project(wrf):
     """Test project wrf grid"""
     with wrf.xd as xd:
@@ -214,6 +393,29 @@ def test_wrf_project(wrf):
                             [-106.6965833, 34.8059311])
 
 
+def test_wrf_project_lazy(wrf):
+    """Test project wrf grid lazily"""
+    with wrf.xd as xd:
+        pgrid = xd.lsm.to_utm('RAINC')
+        lazy_pgrid = xd.lsm.to_utm('RAINC', band_chunk_size=5, lazy=True)
+        assert lazy_pgrid.RAINC.chunks[0] == (5, 5, 5, 1)
+        assert_almost_equal(lazy_pgrid.lsm.geotransform,
+                            pgrid.lsm.geotransform)
+        assert_almost_equal(lazy_pgrid.RAINC.values, pgrid.RAINC.values)
+
+
+def test_wrf_project_parallel(wrf):
+    """Test project wrf grid in parallel"""
+    with wrf.xd as xd:
+        pgrid = xd.lsm.to_utm('RAINC')
+        parallel_pgrid = xd.lsm.to_utm('RAINC', band_chunk_size=3,
+                                       n_workers=2)
+        assert_almost_equal(parallel_pgrid.lsm.geotransform,
+                            pgrid.lsm.geotransform)
+        assert_almost_equal(parallel_pgrid.RAINC.values,
+                            pgrid.RAINC.values)
+
+
 def test_wrf_tiff_project(wrf, tgrid):
     """Test write wrf grid"""
     log_file = path.join(tgrid.output, 'wrf_tif.log')
@@ -228,3 +430,19 @@ def test_wrf_tiff_project(wrf, tgrid):
     compare_log_file = path.join(tgrid.compare, 'wrf_tif.log')
     with open(log_file) as lgf, open(compare_log_file) as clgf:
         assert lgf.read() == clgf.read()
+
+
+@pytest.mark.parametrize("use_numexpr", [True, False])
+def test_wrf_relative_humidity(monkeypatch, use_numexpr):
+    """Test WRF relative humidity from the mixing ratio"""
+    import pangaea.derived
+    if not use_numexpr:
+        monkeypatch.setattr(pangaea.derived, 'numexpr', None)
+    relative_humidity = pangaea.derived.find_derived_variable(
+        'relative_humidity', ['Q2', 'T2', 'PSFC'])
+    # 20 C with half of the saturation vapor pressure (2336.9 Pa)
+    # e = Q2 * PSFC / (0.622 + Q2) = 1168.5 Pa
+    rh_values = relative_humidity.evaluate(np.array([0.0072565]),
+                                           np.array([293.15]),
+                                           np.array([101325.0]))
+    assert_almost_equal(rh_values, [50.0], decimal=3)